@@ -0,0 +1,355 @@
+"""
+Bulk extraction for back-office imports.
+
+Reads (investor_type, text) records as JSONL, one per line:
+
+    {"id": "row-17", "investor_type": "Individual", "text": "John Doe, john@example.com, +1 555 0100"}
+
+and writes one JSON result per line as soon as its record is done (results are
+not in input order; match them by "id", which defaults to the line number).
+
+Records run over a bounded pool of workers. Short records of the same investor
+type are packed into one extraction prompt; when the LLM answers 429 every
+worker pauses for the backoff delay. The compiled schema and its per-type
+mandatory fields are loaded once for the whole batch.
+
+    python batch_extract.py records.jsonl -o results.jsonl [--concurrency 8] [--pack-size 5]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from live_fill_2 import (
+    extract_inputs,
+    extraction_chain,
+    fallback_extract,
+    get_chain,
+    get_extraction_llm,
+    parse_extraction,
+    select_schema_keys,
+    validate_phone_format,
+)
+from schema_index import FillState
+from session_state import is_filled
+from structured_output import extraction_stats, salvage_json
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Config -------------------
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_PACK_SIZE = int(os.getenv("BATCH_PACK_SIZE", "5"))
+# Records longer than this are extracted on their own
+BATCH_PACK_MAX_CHARS = int(os.getenv("BATCH_PACK_MAX_CHARS", "400"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "5"))
+BATCH_BACKOFF_BASE = float(os.getenv("BATCH_BACKOFF_BASE", "1"))
+BATCH_BACKOFF_MAX = float(os.getenv("BATCH_BACKOFF_MAX", "60"))
+
+PACKED_EXTRACT_TEMPLATE = """You are an assistant that extracts structured form data from several independent records.
+
+Available form fields (use exact keys):
+{schema_json}
+
+Records:
+{records}
+
+Return ONLY a valid JSON object mapping each record number to the fields extracted from that record alone.
+Keys inside each record MUST match the form fields exactly. Use {{}} for a record with nothing to extract.
+
+Example output: {{"1": {{"Name": "John Doe"}}, "2": {{}}}}
+
+JSON:"""
+
+
+# ------------------- Rate limiting -------------------
+def _is_rate_limited(error: Exception):
+    return type(error).__name__ == "RateLimitError" or getattr(error, "status_code", None) == 429
+
+
+def _is_fatal(error: Exception):
+    """Errors no retry or fallback fixes (bad key, unknown model, rejected request): the batch stops"""
+    return (type(error).__name__ in ("AuthenticationError", "PermissionDeniedError", "NotFoundError", "BadRequestError")
+            or getattr(error, "status_code", None) in (400, 401, 403, 404))
+
+
+def _retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RateLimitGate:
+    """Shared pause: a 429 seen by one worker holds back every worker until the backoff ends"""
+
+    def __init__(self):
+        self.resume_at = 0.0
+
+    async def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def penalize(self, delay: float):
+        self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+
+async def invoke_with_backoff(chain, inputs: dict, gate: RateLimitGate, stats: dict):
+    """chain.ainvoke with exponential backoff (full jitter, honours Retry-After) on rate limits"""
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        await gate.wait()
+        try:
+            stats["llm_calls"] += 1
+            return await chain.ainvoke(inputs)
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == BATCH_MAX_RETRIES:
+                raise
+            stats["rate_limited"] += 1
+            delay = _retry_after(e) or random.uniform(0, min(BATCH_BACKOFF_MAX, BATCH_BACKOFF_BASE * 2 ** attempt))
+            gate.penalize(delay)
+
+
+# ------------------- Records -------------------
+def read_records(lines):
+    """Yield (id, record or None, error) for each non-blank JSONL line"""
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "Invalid record: expected a JSON object"
+            continue
+        yield record.get("id", line_no), record, None
+
+
+def _record_text(record: dict):
+    return record.get("text") or record.get("user_message") or ""
+
+
+def iter_packs(records, schema, emit, pack_size: int = BATCH_PACK_SIZE, max_chars: int = BATCH_PACK_MAX_CHARS):
+    """Group valid records into packs of one investor type; invalid ones are emitted straight away"""
+    pending = {}
+    for record_id, record, error in records:
+        if error is None:
+            investor_type = record.get("investor_type", "")
+            if schema.mandatory_fields(investor_type) is None:
+                error = f"Invalid investor type: {investor_type}"
+            elif not _record_text(record):
+                error = "Missing 'text'"
+        if error:
+            emit({"id": record_id, "error": error})
+            continue
+
+        item = (record_id, investor_type, _record_text(record))
+        if pack_size <= 1 or len(item[2]) > max_chars:
+            yield [item]
+            continue
+        pack = pending.setdefault(investor_type, [])
+        pack.append(item)
+        if len(pack) >= pack_size:
+            yield pending.pop(investor_type)
+    yield from pending.values()
+
+
+# ------------------- Extraction -------------------
+async def _extract_single(text: str, schema, mandatory_flat: dict, gate: RateLimitGate, stats: dict):
+    schema_keys = select_schema_keys(text, schema.defaults, schema, mandatory_flat)
+    chain = extraction_chain(schema_keys)
+    result = await invoke_with_backoff(chain, extract_inputs(text, "", schema.defaults, schema_keys), gate, stats)
+    return parse_extraction(result, schema.defaults)
+
+
+async def _extract_packed(pack: list, schema, mandatory_flat: dict, gate: RateLimitGate, stats: dict):
+    selected = set()
+    for _, _, text in pack:
+        selected.update(select_schema_keys(text, schema.defaults, schema, mandatory_flat))
+    inputs = {
+        "schema_json": json.dumps([k for k in schema.paths if k in selected], ensure_ascii=False),
+        "records": "\n".join(f"[{n}] {json.dumps(text, ensure_ascii=False)}" for n, (_, _, text) in enumerate(pack, 1)),
+    }
+    chain = get_chain(PACKED_EXTRACT_TEMPLATE, get_extraction_llm())
+    result = await invoke_with_backoff(chain, inputs, gate, stats)
+    parsed, complete = salvage_json(result.content if hasattr(result, 'content') else str(result))
+    if parsed is None:
+        extraction_stats.record(parsed, complete)
+        raise ValueError("Unparseable packed extraction")
+    # A cut-off answer keeps the records it finished; the others, and records whose
+    # answer is not an object, come back as None and are extracted one by one
+    fields = []
+    kept = returned = 0
+    for n in range(1, len(pack) + 1):
+        value = parsed.get(str(n))
+        if value is None and complete:
+            value = {}
+        elif not isinstance(value, dict) or not (value or complete):
+            value = None
+        if value:
+            returned += len(value)
+            kept += sum(1 for k in value if k in schema.position)
+        fields.append(value)
+    extraction_stats.record(parsed, complete, kept, returned)
+    return fields
+
+
+def build_result(record_id, investor_type: str, text: str, extracted, schema):
+    """Per-record output: validated fields (LLM, else regex/NER fallback) and what is still missing"""
+    extracted = {k: v for k, v in (extracted or {}).items() if k in schema.position and is_filled(v)}
+    method = "llm"
+    if not extracted:
+        extracted = fallback_extract(text, schema.defaults, schema)
+        method = "fallback"
+
+    phone_validation_errors = []
+    for key in [k for k in extracted if schema.field(k).kind == "phone"]:
+        if not validate_phone_format(extracted[key]):
+            phone_validation_errors.append({
+                "field": key,
+                "value": extracted.pop(key),
+                "message": "Phone number missing country code"
+            })
+
+    state = FillState.from_fields(schema, extracted)
+    missing = state.missing(investor_type)
+    return {
+        "id": record_id,
+        "investor_type": investor_type,
+        "method": method,
+        "extracted_fields": extracted,
+        "missing_mandatory_count": len(missing),
+        "missing_mandatory_fields": missing[:10],
+        "mandatory_completion": round(state.completion(investor_type), 3),
+        "phone_validation_errors": phone_validation_errors,
+    }
+
+
+async def extract_pack(pack: list, schema, gate: RateLimitGate, stats: dict):
+    """Results for one pack; a packed answer that cannot be parsed is retried record by record
+    (a cut-off one only for the records it did not finish)"""
+    mandatory_flat = schema.mandatory_fields(pack[0][1])
+    fields = [None] * len(pack)
+    if len(pack) > 1:
+        try:
+            fields = await _extract_packed(pack, schema, mandatory_flat, gate, stats)
+        except Exception as e:
+            if _is_fatal(e):
+                raise
+            logger.warning("Packed extraction of %d records failed, extracting them one by one: %r", len(pack), e)
+            stats["unpacked"] += 1
+
+    results = []
+    for (record_id, investor_type, text), extracted in zip(pack, fields):
+        if extracted is None:
+            try:
+                extracted = await _extract_single(text, schema, mandatory_flat, gate, stats)
+            except Exception as e:
+                if _is_rate_limited(e):
+                    results.append({"id": record_id, "investor_type": investor_type, "error": f"Rate limited: {e}"})
+                    continue
+                if _is_fatal(e):
+                    raise
+                logger.warning("LLM extraction of record %s failed, using the fallback: %r", record_id, e)
+                stats["llm_errors"] += 1
+                extracted = None
+        results.append(build_result(record_id, investor_type, text, extracted, schema))
+    return results
+
+
+async def run_batch(records, emit, schema=None, concurrency: int = BATCH_CONCURRENCY,
+                    pack_size: int = BATCH_PACK_SIZE):
+    """
+    Extract every record and emit(result) each one as soon as it is ready.
+    `records` is an iterable of read_records() tuples; at most ~2x`concurrency`
+    packs are held in memory at any time. Returns the batch stats. LLM errors are
+    logged and counted (llm_errors) before a record falls back to the local
+    extractor; authentication, unknown-model and rejected-request errors stop the batch.
+    """
+    if schema is None:
+        from main import load_compiled_schema
+        schema = load_compiled_schema()
+
+    stats = {"records": 0, "packs": 0, "llm_calls": 0, "rate_limited": 0, "unpacked": 0, "llm_errors": 0,
+             "fallback": 0, "errors": 0}
+    gate = RateLimitGate()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    def count(result):
+        stats["records"] += 1
+        if result.get("error"):
+            stats["errors"] += 1
+        elif result["method"] == "fallback":
+            stats["fallback"] += 1
+        emit(result)
+
+    async def worker():
+        while True:
+            pack = await queue.get()
+            if pack is None:
+                return
+            stats["packs"] += 1
+            try:
+                results = await extract_pack(pack, schema, gate, stats)
+            except Exception as e:
+                # One bad pack must not take the worker (and the batch) down with it, unless
+                # the LLM setup itself is broken: then every record would end up on the fallback
+                if _is_fatal(e):
+                    raise
+                logger.warning("Extraction of %d records failed: %r", len(pack), e)
+                results = [{"id": record_id, "investor_type": investor_type, "error": f"Extraction failed: {e}"}
+                           for record_id, investor_type, _ in pack]
+            for result in results:
+                count(result)
+
+    async def produce():
+        for pack in iter_packs(records, schema, count, pack_size):
+            await queue.put(pack)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    # The reader runs as a task too, so a worker stopping the batch cannot leave it blocked on a full queue
+    tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    tasks.append(asyncio.create_task(produce()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-extract form fields from JSONL records")
+    parser.add_argument("input", help="JSONL file of {id, investor_type, text} records ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL results file ('-' for stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--pack-size", type=int, default=BATCH_PACK_SIZE)
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+
+    def emit(result):
+        sink.write(json.dumps(result, ensure_ascii=False) + "\n")
+        sink.flush()
+
+    try:
+        stats = asyncio.run(run_batch(read_records(source), emit, concurrency=args.concurrency,
+                                      pack_size=args.pack_size))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    print(json.dumps(stats), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""
+Offline benchmark for lambda_handler and the live_fill_2 hot paths.
+
+Drives scripted conversations for every investor type in mandatory.json through
+lambda_handler with a fake ChatOpenAI (answers derived from the prompt, optional
+simulated latency) and an in-memory S3 stand-in serving the local
+form_keys.json / mandatory.json. No network or API key is needed and runs are
+seeded, so results are comparable between commits.
+
+    python benchmark.py                          # full report
+    python benchmark.py --rounds 5 --json bench.json
+    python benchmark.py --baseline bench.json    # exit 1 if a p95 regressed by more than --tolerance
+    python benchmark.py --mode full              # clients echoing the full session_data
+    python benchmark.py --llm-error-rate 0.3     # flaky provider: fallbacks and the circuit breaker
+
+Reports per-turn latency (p50/p95/p99), throughput, allocations (tracemalloc),
+request/response/stored payload sizes and per-call timings of the helpers.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+for name, value in (("OPENAI_API_KEY", "benchmark"), ("AWS_DEFAULT_REGION", "us-east-1"),
+                    ("TRACE_FORMAT", "off"), ("SESSION_STORE", "memory"), ("SESSION_SINK", "local"),
+                    ("FOLLOWUP_LLM_RATE", "0")):
+    os.environ.setdefault(name, value)
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FOLLOWUP_ANSWER = "Thanks! Is there anything else you'd like to share?"
+
+
+# ------------------- Stubs -------------------
+class LocalS3:
+    """S3 stand-in: serves files from the repo folder and keeps put_object bodies in memory"""
+
+    def __init__(self, root: str = HERE):
+        self.root = root
+        self.objects = {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) in self.objects:
+            data = self.objects[(Bucket, Key)]
+        else:
+            with open(os.path.join(self.root, Key), "rb") as f:
+                data = f.read()
+        etag = f'"{len(data)}"'
+        if kwargs.get("IfNoneMatch") == etag:
+            from botocore.exceptions import ClientError
+            raise ClientError({"Error": {"Code": "304"}, "ResponseMetadata": {"HTTPStatusCode": 304}}, "GetObject")
+        return {"Body": io.BytesIO(data), "ETag": etag}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.encode("utf-8")
+        return {"ETag": f'"{len(self.objects[(Bucket, Key)])}"'}
+
+
+def _between(text: str, start: str, end: str):
+    i = text.find(start)
+    if i < 0:
+        return None
+    i += len(start)
+    j = text.find(end, i)
+    return text[i:j if j >= 0 else None]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Fake ChatOpenAI. Extraction prompts are answered from `answers` (user message ->
+    fields), restricted to the fields the prompt offers, like a model that follows
+    the instructions (in the {"fields": [{"key", "value"}]} shape when a json_schema
+    response_format is bound); other prompts get a fixed follow-up question. Token usage is
+    estimated from the text (chars / 4). A share `error_rate` of the calls fails after its
+    delay, like a provider returning 5xx errors.
+    """
+
+    answers: dict = {}
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def _answer(self, prompt: str, structured: bool = False):
+        message = _between(prompt, 'User message: "', '"\n')
+        if message is None:
+            return FOLLOWUP_ANSWER
+        offered = _between(prompt, "Available form fields (use exact keys):\n", "\n")
+        try:
+            offered = set(json.loads(offered))
+        except (TypeError, ValueError):
+            offered = set()
+        fields = {k: v for k, v in self.answers.get(message, {}).items() if k in offered}
+        if structured:
+            fields = [{"key": k, "value": v} for k, v in fields.items()]
+        if '"followup"' in prompt:
+            return json.dumps({"fields": fields, "followup": FOLLOWUP_ANSWER})
+        return json.dumps({"fields": fields} if structured else fields)
+
+    def _result(self, messages, response_format=None):
+        prompt = "\n".join(str(m.content) for m in messages)
+        content = self._answer(prompt, structured=(response_format or {}).get("type") == "json_schema")
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))])
+
+    def _delay(self):
+        if not self.latency_ms:
+            return 0.0
+        return max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+
+    def _fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            raise ConnectionError("scripted provider error")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._delay())
+        self._fail()
+        return self._result(messages, kwargs.get("response_format"))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        self._fail()
+        return self._result(messages, kwargs.get("response_format"))
+
+
+def install_stubs(answers: dict, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0):
+    """Point config loading, session output and both LLMs at the local stand-ins"""
+    import config_cache
+    import live_fill_2
+    import main
+    from session_sink import S3SessionSink
+    from session_store import MemorySessionStore
+
+    s3 = LocalS3()
+    config_cache.config_cache._client = s3
+    config_cache.config_cache.clear()
+    live_fill_2.s3 = s3
+    main.session_sink = S3SessionSink(bucket="chatbot-outputs", client=s3)
+    main.session_store = MemorySessionStore()
+    model = ScriptedChatModel(answers=answers, latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate)
+    live_fill_2.llm_extraction = model
+    live_fill_2.llm_conversation = model
+    return s3, model
+
+
+# ------------------- Transcripts -------------------
+def sample_value(label: str, n: int):
+    label = label.lower()
+    if "mail" in label:
+        return f"investor{n}@example.com"
+    if "phone" in label or "fax" in label:
+        return f"+1 555 010 {n:04d}"
+    if "date" in label or "dob" in label or "birth" in label:
+        return f"1980-01-{n % 28 + 1:02d}"
+    if "zip" in label or "postal" in label:
+        return f"{10001 + n}"
+    return f"Sample {label} {n}"
+
+
+def build_transcripts(schema, fields_per_turn: int = 3):
+    """
+    One scripted conversation per investor type: a greeting (nothing to extract,
+    exercises the fallback) and then its mandatory text fields, a few per message.
+    Returns ({investor_type: [messages]}, {message: fields}).
+    """
+    from live_fill_2 import classify_mandatory_fields
+
+    transcripts, answers = {}, {}
+    for investor_type in schema.investor_types:
+        text_fields, _ = classify_mandatory_fields(list(schema.mandatory_fields(investor_type)))
+        messages = [f"Hi, I'd like to onboard as {investor_type}"]
+        answers[messages[0]] = {}
+        for start in range(0, len(text_fields), fields_per_turn):
+            chunk = text_fields[start:start + fields_per_turn]
+            values = {path: sample_value(schema.label(path), start + i) for i, path in enumerate(chunk)}
+            message = "; ".join(f"my {schema.label(path)} is {value}" for path, value in values.items())
+            messages.append(message)
+            answers[message] = values
+        transcripts[investor_type] = messages
+    return transcripts, answers
+
+
+# ------------------- Measurements -------------------
+def percentile(values, pct: float):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def summarize(values):
+    return {
+        "n": len(values),
+        "mean": round(sum(values) / len(values), 3) if values else 0.0,
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(max(values), 3) if values else 0.0,
+    }
+
+
+def run_conversation(investor_type: str, messages: list, mode: str, samples: dict, allocations: bool = False):
+    """Send one scripted conversation through lambda_handler, recording per-turn samples"""
+    import main
+
+    state = {}
+    for message in messages:
+        request = {"user_message": message}
+        if mode == "stored":
+            request.update({"session_id": state["session_id"]} if state else {"investor_type": investor_type})
+        else:
+            request.update({"investor_type": investor_type, "chat_history": state.get("chat_history", ""),
+                            "response_mode": mode})
+            if mode == "full":
+                request["session_data"] = state.get("session_data", {})
+            else:
+                request["session_fields"] = state.get("session_fields", {})
+        event = {"body": json.dumps(request)}
+
+        if allocations:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        response = main.lambda_handler(event, None)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            samples["alloc_peak_kb"].append((peak - before) / 1024)
+            samples["alloc_retained_kb"].append((current - before) / 1024)
+            continue
+
+        if response["statusCode"] != 200:
+            raise SystemExit(f"{investor_type}: HTTP {response['statusCode']} {response['body'][:300]}")
+        body = json.loads(response["body"])
+        samples["turn_ms"].append(elapsed_ms)
+        samples["by_type"].setdefault(investor_type, []).append(elapsed_ms)
+        samples["request_bytes"].append(len(event["body"]))
+        samples["response_bytes"].append(len(response["body"]))
+        samples["methods"][body["method"]] = samples["methods"].get(body["method"], 0) + 1
+        if mode == "stored":
+            record = main.session_store.get(body["session_id"])
+            samples["stored_bytes"].append(len(json.dumps(record, ensure_ascii=False)))
+            state = {"session_id": body["session_id"]}
+        else:
+            state = {"chat_history": body["chat_history"],
+                     "session_data": body.get("session_data"),
+                     "session_fields": {**state.get("session_fields", {}), **body.get("session_fields", {}),
+                                        **body.get("session_patch", {})}}
+    return samples
+
+
+def bench_call(fn, min_time: float = 0.2):
+    """Mean microseconds per call of fn(), repeated for at least `min_time` seconds"""
+    fn()
+    calls, start = 0, time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return round(elapsed / calls * 1e6, 2)
+
+
+def bench_helpers(schema, transcripts):
+    import live_fill_2
+    from extraction_cache import ExtractionCache
+    from schema_index import CompiledSchema, FillState
+    from session_state import expand_sparse, sparse_fields
+
+    form_keys = json.load(open(os.path.join(HERE, "form_keys.json"), encoding="utf-8"))
+    mandatory_master = json.load(open(os.path.join(HERE, "mandatory.json"), encoding="utf-8"))
+    investor_type = schema.investor_types[1]
+    mandatory = schema.mandatory_fields(investor_type)
+    message = transcripts[investor_type][1]
+    live_fill_flat = dict(schema.defaults)
+    filled = {path: "x" for path in list(mandatory)[:20]}
+    filled_flat = {**live_fill_flat, **filled}
+    fill_state = FillState.from_fields(schema, filled)
+
+    return {
+        "flatten_dict": bench_call(lambda: live_fill_2.flatten_dict(form_keys)),
+        "unflatten_dict": bench_call(lambda: live_fill_2.unflatten_dict(live_fill_flat)),
+        "compile_schema": bench_call(lambda: CompiledSchema(schema.defaults, mandatory_master)),
+        "select_schema_keys": bench_call(
+            lambda: live_fill_2.select_schema_keys(message, live_fill_flat, schema, mandatory)),
+        "fallback_extract": bench_call(
+            lambda: live_fill_2.fallback_extract("reach me at a@b.com or +1 555 010 0000", live_fill_flat, schema)),
+        "template_followup": bench_call(
+            lambda: live_fill_2.template_followup(filled, 12, list(mandatory)[:2], schema)),
+        "missing_mandatory": bench_call(lambda: live_fill_2.get_missing_mandatory_keys(filled_flat, mandatory)),
+        "fill_state_missing": bench_call(lambda: fill_state.missing(investor_type)),
+        "extraction_chain": bench_call(lambda: live_fill_2.extraction_chain(list(mandatory))),
+        "extraction_cache_key": bench_call(lambda: ExtractionCache.key(message, list(mandatory), schema.version_tag)),
+        "expand_sparse": bench_call(lambda: expand_sparse(schema, filled)),
+        "sparse_fields": bench_call(lambda: sparse_fields(live_fill_flat)),
+    }
+
+
+def run(rounds: int, mode: str, latency_ms: float, jitter_ms: float, seed: int, helpers: bool = True,
+        error_rate: float = 0.0):
+    import main
+    from extraction_cache import extraction_cache
+    from extraction_router import extraction_router
+    from llm_guard import llm_guard
+    from structured_output import extraction_stats
+
+    random.seed(seed)
+    install_stubs({}, latency_ms, jitter_ms)
+    schema = main.load_compiled_schema()
+    transcripts, answers = build_transcripts(schema)
+    install_stubs(answers, latency_ms, jitter_ms, error_rate)
+
+    # Warm-up: config load, schema compile, lazy imports
+    for investor_type, messages in transcripts.items():
+        run_conversation(investor_type, messages[:2], mode, _new_samples())
+
+    samples = _new_samples()
+    extraction_router.clear()
+    extraction_stats.clear()
+    llm_guard.clear()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        extraction_cache.clear()
+        for investor_type, messages in transcripts.items():
+            run_conversation(investor_type, messages, mode, samples)
+    wall = time.perf_counter() - start
+
+    extraction_cache.clear()
+    tracemalloc.start()
+    for investor_type, messages in transcripts.items():
+        run_conversation(investor_type, messages, mode, samples, allocations=True)
+    tracemalloc.stop()
+
+    report = {
+        "config": {"rounds": rounds, "mode": mode, "llm_latency_ms": latency_ms, "llm_jitter_ms": jitter_ms,
+                   "llm_error_rate": error_rate, "seed": seed, "investor_types": len(transcripts), "python": sys.version.split()[0]},
+        "turn_ms": summarize(samples["turn_ms"]),
+        "throughput_turns_per_s": round(len(samples["turn_ms"]) / wall, 2),
+        "by_investor_type_ms": {t: summarize(v) for t, v in samples["by_type"].items()},
+        "alloc_peak_kb": summarize(samples["alloc_peak_kb"]),
+        "alloc_retained_kb": summarize(samples["alloc_retained_kb"]),
+        "request_bytes": summarize(samples["request_bytes"]),
+        "response_bytes": summarize(samples["response_bytes"]),
+        "methods": samples["methods"],
+        "extraction_tiers": extraction_router.metrics(),
+        "extraction_parsing": extraction_stats.metrics(),
+        "llm_guard": llm_guard.metrics(),
+    }
+    if samples["stored_bytes"]:
+        report["stored_session_bytes"] = summarize(samples["stored_bytes"])
+    if helpers:
+        report["helpers_us"] = bench_helpers(schema, transcripts)
+    return report
+
+
+def _new_samples():
+    return {"turn_ms": [], "by_type": {}, "alloc_peak_kb": [], "alloc_retained_kb": [], "request_bytes": [],
+            "response_bytes": [], "stored_bytes": [], "methods": {}}
+
+
+# ------------------- Reporting -------------------
+def print_report(report: dict):
+    config = report["config"]
+    print(f"Benchmark: {config['investor_types']} investor types x {config['rounds']} rounds, mode={config['mode']}, "
+          f"LLM latency {config['llm_latency_ms']}±{config['llm_jitter_ms']} ms, Python {config['python']}")
+
+    def row(name, s, unit):
+        print(f"  {name:<32} p50 {s['p50']:>10.2f}  p95 {s['p95']:>10.2f}  p99 {s['p99']:>10.2f}  {unit}")
+
+    print(f"\nTurns: {report['turn_ms']['n']}  throughput {report['throughput_turns_per_s']} turns/s  "
+          f"methods {report['methods']}")
+    tiers = report["extraction_tiers"]
+    print(f"Extraction tiers: rules only {tiers['rules_only_rate']:.1%}, cache {tiers['cache_rate']:.1%}, "
+          f"LLM {tiers['llm_rate']:.1%} of turns ({tiers['rules_fields']} fields by rules, "
+          f"{tiers['llm_fields']} by LLM)")
+    parsing = report["extraction_parsing"]
+    print(f"LLM answers: {parsing['calls']} parsed {parsing['parsed']}, salvaged {parsing['salvaged']}, "
+          f"failed {parsing['parse_failures']}, fallback rate {parsing['fallback_rate']:.1%}")
+    guard = report["llm_guard"]
+    print(f"LLM calls: {guard['calls']} ok {guard['successes']}, errors {guard['errors']}, "
+          f"timeouts {guard['timeouts']}, refused {guard['short_circuits'] + guard['budget_skips']} "
+          f"(circuit opened {guard['breaker_opened']}x), hedges {guard['hedges']} ({guard['hedge_wins']} won)")
+    row("turn latency", report["turn_ms"], "ms")
+    for investor_type, s in report["by_investor_type_ms"].items():
+        row(f"  {investor_type[:30]}", s, "ms")
+    row("alloc peak / turn", report["alloc_peak_kb"], "KiB")
+    row("alloc retained / turn", report["alloc_retained_kb"], "KiB")
+    row("request payload", report["request_bytes"], "B")
+    row("response payload", report["response_bytes"], "B")
+    if "stored_session_bytes" in report:
+        row("stored session", report["stored_session_bytes"], "B")
+    if "helpers_us" in report:
+        print("\nHelpers (µs per call):")
+        for name, us in report["helpers_us"].items():
+            print(f"  {name:<32} {us:>10.2f}")
+
+
+def compare(report: dict, baseline: dict, tolerance: float):
+    """Metrics that got slower than baseline * (1 + tolerance)"""
+    checks = [("turn_ms.p95", report["turn_ms"]["p95"], baseline["turn_ms"]["p95"])]
+    for name, us in report.get("helpers_us", {}).items():
+        if name in baseline.get("helpers_us", {}):
+            checks.append((f"helpers_us.{name}", us, baseline["helpers_us"][name]))
+    return [(name, new, old) for name, new, old in checks if old and new > old * (1 + tolerance)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--mode", choices=("stored", "delta", "sparse", "full"), default="stored",
+                        help="how the client carries session state between turns")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of fake LLM calls that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-helpers", action="store_true", help="skip the per-helper timings")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="report from a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SESSION_SINK_ROOT", tempfile.mkdtemp(prefix="bench_sessions_"))
+    sys.path.insert(0, HERE)
+    report = run(args.rounds, args.mode, args.llm_latency_ms, args.llm_jitter_ms, args.seed,
+                 helpers=not args.no_helpers, error_rate=args.llm_error_rate)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nRegressions (> {args.tolerance:.0%} slower than baseline):")
+            for name, new, old in regressions:
+                print(f"  {name}: {old} -> {new}")
+            sys.exit(1)
+        print(f"\nNo regressions vs {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
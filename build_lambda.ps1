@@ -29,7 +29,21 @@ python -m spacy download en_core_web_sm --quiet
 # Copy source files
 Write-Host "📁 Copying project files..." -ForegroundColor Yellow
 Copy-Item ..\main.py .
-Copy-Item ..\live_fill_final.py .
+Copy-Item ..\live_fill_2.py .
+Copy-Item ..\config_cache.py .
+Copy-Item ..\schema_index.py .
+Copy-Item ..\session_state.py .
+Copy-Item ..\conversation_memory.py .
+Copy-Item ..\extraction_cache.py .
+Copy-Item ..\extraction_router.py .
+Copy-Item ..\intent_classifier.py .
+Copy-Item ..\structured_output.py .
+Copy-Item ..\llm_guard.py .
+Copy-Item ..\http_pool.py .
+Copy-Item ..\session_sink.py .
+Copy-Item ..\session_store.py .
+Copy-Item ..\turn_trace.py .
+Copy-Item ..\streaming.py .
 
 # (No need to copy JSONs — they’re loaded from S3 at runtime)
 
@@ -50,7 +64,8 @@ Write-Host "1️⃣ Go to AWS Lambda Console"
 Write-Host "2️⃣ Create a new function (Python 3.12 runtime)"
 Write-Host "3️⃣ Upload lambda-function.zip under 'Code > Upload from > .zip file'"
 Write-Host "4️⃣ Set Handler to: main.lambda_handler"
-Write-Host "5️⃣ Set Timeout to 60 seconds and Memory to 512+ MB"
+Write-Host "5️⃣ Set Timeout to 60 seconds; size Memory and reserved concurrency from 'python load_test.py'"
+Write-Host "     (suggested Lambda memory and environments per 10 turns/s are printed at the end)"
 Write-Host "6️⃣ Add Environment Variables:"
 Write-Host "     OPENAI_API_KEY = your_api_key"
 Write-Host "     AWS_REGION = your_region"
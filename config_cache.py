@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from turn_trace import trace_set
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Config -------------------
+# Seconds a cached config is served without asking S3 at all. Once it
+# expires the next read revalidates with If-None-Match, so an unchanged
+# object costs a 304 instead of a full download + json.loads.
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "300"))
+
+# Keep S3 on a short leash: if it is slow we would rather serve the last
+# good copy than burn the Lambda timeout waiting for it.
+S3_CONFIG_CONNECT_TIMEOUT = float(os.getenv("S3_CONFIG_CONNECT_TIMEOUT", "1"))
+S3_CONFIG_READ_TIMEOUT = float(os.getenv("S3_CONFIG_READ_TIMEOUT", "2"))
+
+
+def _is_not_modified(error: ClientError):
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    code = error.response.get("Error", {}).get("Code")
+    return status == 304 or code in ("304", "NotModified")
+
+
+class ConfigCache:
+    """
+    Module-level cache for JSON configs in S3 that survives warm invocations.
+
+    Entries are revalidated with the stored ETag once `ttl` has elapsed. If S3
+    errors out or times out and a previous copy exists, the stale copy is served
+    (logged, counted in stats["stale_served"] and set as config_stale on the turn trace).
+    S3 is read outside the cache lock, one request per key at a time: concurrent
+    readers of an expired key wait for that request instead of sending their own.
+    Returned dicts are shared between invocations and must be treated as read-only.
+    """
+
+    def __init__(self, client=None, ttl: float = CONFIG_CACHE_TTL):
+        self._client = client
+        self.ttl = ttl
+        self._entries = {}
+        self._fetch_locks = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "fetches": 0, "not_modified": 0, "stale_served": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = boto3.client(
+                "s3",
+                config=Config(
+                    connect_timeout=S3_CONFIG_CONNECT_TIMEOUT,
+                    read_timeout=S3_CONFIG_READ_TIMEOUT,
+                    retries={"max_attempts": 1},
+                ),
+            )
+        return self._client
+
+    def _fetch_lock(self, bucket: str, key: str):
+        with self._lock:
+            lock = self._fetch_locks.get((bucket, key))
+            if lock is None:
+                lock = self._fetch_locks[(bucket, key)] = threading.Lock()
+            return lock
+
+    def _fresh(self, entry):
+        return entry is not None and time.monotonic() - entry["checked_at"] < self.ttl
+
+    def get(self, bucket: str, key: str):
+        entry = self._entries.get((bucket, key))
+        if self._fresh(entry):
+            self.stats["hits"] += 1
+            return entry["data"]
+
+        with self._fetch_lock(bucket, key):
+            # Another reader may have refreshed it while we waited
+            entry = self._entries.get((bucket, key))
+            if self._fresh(entry):
+                self.stats["hits"] += 1
+                return entry["data"]
+
+            request = {"Bucket": bucket, "Key": key}
+            if entry and entry["etag"]:
+                request["IfNoneMatch"] = entry["etag"]
+
+            self.stats["fetches"] += 1
+            try:
+                obj = self.client.get_object(**request)
+                data = json.loads(obj["Body"].read().decode("utf-8"))
+            except ClientError as e:
+                if entry is None:
+                    raise
+                if _is_not_modified(e):
+                    self.stats["not_modified"] += 1
+                else:
+                    self._serve_stale(bucket, key, e)
+                entry["checked_at"] = time.monotonic()
+                return entry["data"]
+            except (BotoCoreError, ValueError) as e:
+                if entry is None:
+                    raise
+                self._serve_stale(bucket, key, e)
+                entry["checked_at"] = time.monotonic()
+                return entry["data"]
+
+            with self._lock:
+                self._entries[(bucket, key)] = {
+                    "data": data,
+                    "etag": obj.get("ETag"),
+                    "checked_at": time.monotonic(),
+                }
+            return data
+
+    def _serve_stale(self, bucket: str, key: str, error: Exception):
+        self.stats["stale_served"] += 1
+        logger.warning("Serving cached s3://%s/%s: %s", bucket, key, error)
+        trace_set(config_stale=True)
+
+    def version(self, bucket: str, key: str):
+        """ETag of the cached copy, or None if the object was never loaded."""
+        entry = self._entries.get((bucket, key))
+        return entry["etag"] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for k in self.stats:
+                self.stats[k] = 0
+
+
+config_cache = ConfigCache()
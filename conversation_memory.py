@@ -0,0 +1,92 @@
+import math
+import os
+
+from schema_index import field_label
+
+MEMORY_BUFFER_SIZE = int(os.getenv("MEMORY_BUFFER_SIZE", "8"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+CAPTURED_PREFIX = "Already captured: "
+SPEAKERS = ("User", "Bot")
+
+
+def estimate_tokens(text: str):
+    # ~4 characters per token for English; close enough for budgeting
+    return math.ceil(len(text) / 4)
+
+
+class ConversationMemory:
+    """
+    Bounded chat history for the extraction and conversation prompts.
+
+    The last `window` turns (a user message plus the bot reply) are kept verbatim.
+    Anything older is not replayed as prose: the prompt instead starts with one
+    "Already captured: ..." line listing the fields filled so far. The rendered
+    history never exceeds `token_budget` (estimated) tokens; the oldest lines go first.
+    """
+
+    def __init__(self, window: int = MEMORY_BUFFER_SIZE, token_budget: int = HISTORY_TOKEN_BUDGET):
+        self.window = window
+        self.token_budget = token_budget
+        self.lines = []
+        self.captured = []
+
+    @classmethod
+    def from_transcript(cls, transcript: str, **kwargs):
+        """Parse a "User: ...\\nBot: ..." transcript. A previous "Already captured" line is
+        ignored because it is rebuilt from the session state."""
+        memory = cls(**kwargs)
+        for raw in (transcript or "").splitlines():
+            speaker, _, text = raw.partition(": ")
+            if speaker in SPEAKERS:
+                memory.add(speaker, text)
+            elif raw.startswith(CAPTURED_PREFIX):
+                continue
+            elif memory.lines and raw.strip():
+                prev_speaker, prev_text = memory.lines[-1]
+                memory.lines[-1] = (prev_speaker, f"{prev_text}\n{raw}")
+        return memory
+
+    def add(self, speaker: str, text: str):
+        self.lines.append((speaker, text))
+        del self.lines[:-2 * self.window]
+
+    def add_user(self, text: str):
+        self.add("User", text)
+
+    def add_bot(self, text: str):
+        self.add("Bot", text)
+
+    def set_captured(self, live_fill_flat: dict):
+        """Summarize the fields filled so far (labels only, no values)"""
+        self.captured = [field_label(k) for k, v in live_fill_flat.items() if not (v == "" or v is None)]
+
+    def _captured_header(self):
+        if not self.captured:
+            return ""
+        # The summary may use at most half the budget; the rest is for recent turns
+        limit = self.token_budget // 2
+        labels = []
+        for i, label in enumerate(self.captured):
+            remaining = len(self.captured) - i
+            candidate = CAPTURED_PREFIX + ", ".join(labels + [label])
+            if remaining > 1 and estimate_tokens(candidate + f" and {remaining - 1} more") > limit:
+                return CAPTURED_PREFIX + ", ".join(labels) + f" and {remaining} more"
+            labels.append(label)
+        return CAPTURED_PREFIX + ", ".join(labels)
+
+    def render(self):
+        lines = [f"{speaker}: {text}" for speaker, text in self.lines]
+        header = self._captured_header()
+        budget = self.token_budget - estimate_tokens(header)
+        used = 0
+        kept = []
+        for line in reversed(lines):
+            cost = estimate_tokens(line) + 1
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        kept.reverse()
+        if header:
+            kept.insert(0, header)
+        return "\n".join(kept) + ("\n" if kept else "")
@@ -0,0 +1,94 @@
+"""
+Append-only JSONL session log.
+
+A CLI session folder holds a snapshot plus a log:
+
+    live_fill.json   the live_fill document when the session started (and again at the end)
+    log.jsonl        one compact JSON event per line, in order
+
+Field changes are logged as {"update": {flat path: value}} events holding
+absolute values, so replaying the whole log over any snapshot taken during the
+session gives the current live_fill (see rebuild_live_fill). Each turn costs
+one appended line instead of rewriting log.json and live_fill.json.
+"""
+import json
+import os
+import time
+
+# fsync after this many events or this many seconds, whichever comes first
+EVENT_LOG_FSYNC_EVERY = int(os.getenv("EVENT_LOG_FSYNC_EVERY", "20"))
+EVENT_LOG_FSYNC_INTERVAL = float(os.getenv("EVENT_LOG_FSYNC_INTERVAL", "1"))
+
+
+class EventLog:
+    """
+    List-like event log backed by a JSONL file.
+
+    append() writes the event as one line and hands it to the OS right away;
+    fsync is batched (EVENT_LOG_FSYNC_EVERY / EVENT_LOG_FSYNC_INTERVAL). Events
+    are also kept in `events` for the final output.
+    """
+
+    def __init__(self, path: str, fsync_every: int = EVENT_LOG_FSYNC_EVERY,
+                 fsync_interval: float = EVENT_LOG_FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.events = []
+        self._file = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def append(self, event: dict):
+        self._file.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self.events.append(event)
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._synced_at >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._unsynced and not self._file.closed:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __len__(self):
+        return len(self.events)
+
+
+def read_events(path: str):
+    """Yield the events of a JSONL log, skipping a torn last line left by a crash"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def replay(live_fill_flat: dict, events):
+    """Apply the "update" events to a flattened live_fill document (in place)"""
+    for event in events:
+        if "update" in event:
+            live_fill_flat.update(event["update"])
+    return live_fill_flat
+
+
+def rebuild_live_fill(session_folder: str):
+    """Flattened live_fill of a CLI session: live_fill.json snapshot + log.jsonl replay"""
+    from live_fill_2 import flatten_dict, load_json
+
+    live_fill_flat = flatten_dict(load_json(os.path.join(session_folder, "live_fill.json")))
+    log_path = os.path.join(session_folder, "log.jsonl")
+    if os.path.exists(log_path):
+        replay(live_fill_flat, read_events(log_path))
+    return live_fill_flat
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# ------------------- Config -------------------
+# Extraction runs at temperature 0, so the same message against the same field
+# set gives the same fields. 0 disables the cache entirely.
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "1024"))
+# Optional shared tier (e.g. a file on EFS shared by all containers). Empty = off.
+EXTRACTION_CACHE_SQLITE = os.getenv("EXTRACTION_CACHE_SQLITE", "")
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def normalize_message(message: str):
+    # Case is kept on purpose: names and addresses are extracted verbatim
+    return " ".join(unicodedata.normalize("NFC", message).split())
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache in front of the extraction LLM call.
+
+    Keys hash the normalized user message, the schema version and the set of field
+    keys offered to the model (which holds the session's missing mandatory fields),
+    not the per-session chat history, so common answers hit across sessions. Only
+    answers read off the message itself are stored (cacheable()): one resolved from
+    the history ("same as registered address") would hand a session another
+    session's values. Lookups go to an in-process LRU first and then to the optional
+    SQLite tier; shared hits are promoted into the LRU.
+    """
+
+    def __init__(self, max_entries: int = EXTRACTION_CACHE_SIZE, sqlite_path: str = EXTRACTION_CACHE_SQLITE,
+                 ttl: float = EXTRACTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.sqlite_path = sqlite_path
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._db = None
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0, "not_cacheable": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(message: str, field_keys, schema_version: str = ""):
+        payload = json.dumps([normalize_message(message), schema_version, sorted(field_keys)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def cacheable(message: str, fields: dict):
+        """
+        Whether every extracted value is text found in the message (case and spacing aside).
+        Empty answers are not: "same" or "yes" may extract nothing in one session and
+        fields resolved from the history in another.
+        """
+        text = normalize_message(message).casefold()
+        return bool(fields) and all(isinstance(v, str) and normalize_message(v).casefold() in text for v in fields.values())
+
+    def _shared(self):
+        if self._db is None and self.sqlite_path:
+            self._db = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS extraction_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _remember(self, key: str, value: dict):
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, key: str):
+        """Cached fields for `key` (a fresh copy), or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return dict(value)
+
+            db = self._shared()
+            if db is not None:
+                row = db.execute(
+                    "SELECT value FROM extraction_cache WHERE key = ? AND created_at >= ?",
+                    (key, time.time() - self.ttl),
+                ).fetchone()
+                if row:
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.stats["shared_hits"] += 1
+                    return dict(value)
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: dict, message: str = None):
+        """Store `value`; with `message`, only if the values were read off it (see cacheable)"""
+        if not self.enabled:
+            return
+        if message is not None and not self.cacheable(message, value):
+            with self._lock:
+                self.stats["not_cacheable"] += 1
+            return
+        value = dict(value)
+        with self._lock:
+            self._remember(key, value)
+            db = self._shared()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO extraction_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), time.time()),
+                )
+                db.commit()
+            self.stats["stores"] += 1
+
+    def metrics(self):
+        lookups = self.stats["memory_hits"] + self.stats["shared_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return {**self.stats, "entries": len(self._lru), "hit_rate": round(hits / lookups, 4) if lookups else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+
+
+extraction_cache = ExtractionCache()
@@ -0,0 +1,177 @@
+import os
+import re
+import threading
+import weakref
+
+from schema_index import CompiledSchema
+
+# ------------------- Config -------------------
+# Run deterministic rules before the extraction LLM and only send it what they
+# could not resolve. "0" restores LLM-first extraction.
+EXTRACTION_ROUTER = os.getenv("EXTRACTION_ROUTER", "1").lower() not in ("0", "false", "off", "no")
+
+# ------------------- Rules -------------------
+# name -> (value pattern, cue words, label words of the fields it fills, self-identifying)
+# A value is only taken locally when it identifies itself (an email, a phone number
+# with its country code, an IBAN) or follows one of its cue words ("zip: 10001").
+# A bare "pin" is no zip cue: "my PIN is 1234" is a passcode, "pin code 560001" (six
+# digits, as Indian PIN codes are) a zip.
+_CUE_TAIL = r"(?:\s+(?:number|no\.?|id|address|code))?(?:\s+is)?\s*[:=\-]?\s*"
+EXTRACTION_RULES = {
+    "email": (r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+", ("e-mail", "email", "mail"), ("email",), True),
+    "phone": (r"\+\d[\d\s\-()]{7,}\d|\d[\d\s\-]{7,}\d", ("telephone", "phone", "mobile", "cell"), ("phone",), False),
+    "iban": (r"\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){2,7}(?: ?[A-Z0-9]{1,4})?\b", ("iban",), ("iban",), False),
+    "swift": (r"\b[A-Z]{6}[A-Z0-9]{2}(?:[A-Z0-9]{3})?\b", ("swift", "bic"), ("swift",), False),
+    "zip": (r"\b[A-Z0-9]{3,6}(?:[ -][A-Z0-9]{3,4})?\b", ("zip", "postal", "postcode", "pin code", "pincode"),
+            ("zip",), False),
+    "amount": (r"(?:[$€£]\s?)?\d[\d,]*(?:\.\d+)?(?:\s?(?i:k|m|mn|million|usd|eur|gbp)\b)?",
+               ("amount", "commitment", "investing", "invest"), ("amount",), False),
+}
+_RULE_REGEX = {
+    name: re.compile(
+        rf"(?P<cue>(?i:\b(?:{'|'.join(re.escape(c) for c in cues)}){_CUE_TAIL}))?(?P<value>{pattern})"
+    )
+    for name, (pattern, cues, _, _) in EXTRACTION_RULES.items()
+}
+_SELF_IDENTIFYING = {"email": lambda v: True, "phone": lambda v: v.startswith("+"), "iban": lambda v: True}
+
+# Words that say whose value it is. With them in the message a value could belong to
+# any of several fields (investor, signatory, joint owner, mailing, bank), so the
+# message goes to the LLM instead.
+OWNER_CUES = re.compile(
+    r"\b(signator\w*|representative|co-?investor|joint|spouse|wife|husband|partner|mailing|bank|wiring|"
+    r"beneficiar\w*|director|fax)\b",
+    re.IGNORECASE,
+)
+
+# Words that carry no field value once the rule matches are cut out of the message
+FILLER_WORDS = frozenset({
+    "a", "also", "am", "an", "and", "at", "be", "can", "code", "contact", "e", "email", "here", "hi",
+    "hello", "i", "id", "is", "it", "its", "mail", "me", "my", "no", "number", "of", "ok", "okay",
+    "on", "phone", "please", "reach", "reached", "s", "telephone", "thanks", "thank", "the", "this",
+    "you", "zip", "postal", "mobile", "cell", "address", "with", "use",
+})
+_TOKEN = re.compile(r"[A-Za-z0-9]+")
+_SEPARATORS = re.compile(r"\s*(?:[,;&]\s*)+|\s{2,}")
+
+_rule_field_maps = weakref.WeakKeyDictionary()
+
+
+def rule_field_map(schema: CompiledSchema):
+    """rule -> candidate form keys, computed once per compiled schema"""
+    field_map = _rule_field_maps.get(schema)
+    if field_map is None:
+        field_map = {name: schema.fields_labelled(*words) for name, (_, _, words, _) in EXTRACTION_RULES.items()}
+        _rule_field_maps[schema] = field_map
+    return field_map
+
+
+def residual_text(message: str, spans):
+    """The message with the resolved spans cut out ("" when nothing but filler is left)"""
+    parts = []
+    last = 0
+    for start, end in sorted(spans):
+        parts.append(message[last:start])
+        last = end
+    parts.append(message[last:])
+    residual = _SEPARATORS.sub(", ", " ; ".join(p.strip() for p in parts if p.strip())).strip(" ,;.&-")
+    words = [w.lower() for w in _TOKEN.findall(residual)]
+    return residual if any(w not in FILLER_WORDS for w in words) else ""
+
+
+class Route:
+    """Outcome of the local tier: fields it resolved and what is left for the LLM"""
+
+    __slots__ = ("fields", "residual", "needs_llm")
+
+    def __init__(self, fields: dict, residual: str, needs_llm: bool):
+        self.fields = fields
+        self.residual = residual
+        self.needs_llm = needs_llm
+
+
+class ExtractionRouter:
+    """
+    Tiered extraction: rules first, the LLM only for the rest.
+
+    route() resolves the unambiguous values (one email, a phone number, a cued zip
+    code, ...) and cuts them out of the message. If nothing but filler is left the
+    LLM call is skipped; otherwise only the residual text and the fields the rules
+    did not fill go to it. Per-tier counters are in `stats` / metrics().
+    """
+
+    def __init__(self, enabled: bool = EXTRACTION_ROUTER):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.stats = {"turns": 0, "rules_only": 0, "llm_calls": 0, "cache_hits": 0, "fallbacks": 0,
+                      "rules_fields": 0, "llm_fields": 0, "fallback_fields": 0, "chars_saved": 0}
+
+    def route(self, message: str, live_fill_flat: dict, schema: CompiledSchema = None):
+        if not self.enabled:
+            return Route({}, message, True)
+        if schema is None:
+            schema = CompiledSchema(live_fill_flat)
+        field_map = rule_field_map(schema)
+        fields = {}
+        spans = []
+        taken = []
+        for name, regex in _RULE_REGEX.items():
+            candidates = [k for k in field_map[name] if k in live_fill_flat]
+            if not candidates:
+                continue
+            matches = [m for m in regex.finditer(message)
+                       if not any(s < m.end() and m.start() < e for s, e in taken)
+                       and (m.group("cue") or _SELF_IDENTIFYING.get(name, lambda v: False)(m.group("value")))]
+            if not matches:
+                continue
+            key = candidates[0]
+            current = live_fill_flat.get(key)
+            ambiguous = len(candidates) > 1 and (OWNER_CUES.search(message) or current not in ("", None))
+            if len(matches) > 1 or ambiguous:
+                # Several values, or whose value it is depends on wording: leave it all to the LLM
+                return Route({}, message, True)
+            match = matches[0]
+            fields[key] = match.group("value").strip()
+            spans.append(match.span())
+            taken.append(match.span("value"))
+        if not fields:
+            return Route({}, message, True)
+        residual = residual_text(message, spans)
+        return Route(fields, residual, bool(residual))
+
+    def record(self, route: Route, message: str, method: str, llm_fields: int = 0, fallback_fields: int = 0):
+        """Count one turn: which tiers ran and how many fields each produced"""
+        with self._lock:
+            self.stats["turns"] += 1
+            self.stats["rules_fields"] += len(route.fields)
+            if not route.needs_llm:
+                self.stats["rules_only"] += 1
+                self.stats["chars_saved"] += len(message)
+            else:
+                self.stats["chars_saved"] += len(message) - len(route.residual)
+                if method == "cache":
+                    self.stats["cache_hits"] += 1
+                else:
+                    self.stats["llm_calls"] += 1
+            self.stats["llm_fields"] += llm_fields
+            if fallback_fields:
+                self.stats["fallbacks"] += 1
+                self.stats["fallback_fields"] += fallback_fields
+
+    def metrics(self):
+        turns = self.stats["turns"]
+        return {
+            **self.stats,
+            # share of turns that never reached the LLM (OpenAI calls saved)
+            "rules_only_rate": round(self.stats["rules_only"] / turns, 4) if turns else 0.0,
+            "cache_rate": round(self.stats["cache_hits"] / turns, 4) if turns else 0.0,
+            "llm_rate": round(self.stats["llm_calls"] / turns, 4) if turns else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+
+extraction_router = ExtractionRouter()
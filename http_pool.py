@@ -0,0 +1,77 @@
+import asyncio
+import os
+import threading
+
+# ------------------- Config -------------------
+# One keep-alive connection pool per container, shared by both ChatOpenAI clients, so
+# warm turns reuse open TLS connections to the OpenAI API instead of handshaking again.
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "20"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "10"))
+# Idle connections older than this are closed rather than reused (a frozen Lambda
+# environment's connections may have been dropped by the other side meanwhile)
+LLM_POOL_KEEPALIVE_EXPIRY_S = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY_S", "60"))
+
+_lock = threading.Lock()
+_http_client = None
+_async_http_client = None
+_loop = None
+
+
+def pool_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY_S,
+    )
+
+
+def get_http_client():
+    """Shared httpx.Client for sync OpenAI calls (built on first use)"""
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                import httpx
+                _http_client = httpx.Client(limits=pool_limits())
+    return _http_client
+
+
+def get_async_http_client():
+    """
+    Shared httpx.AsyncClient for async OpenAI calls. Its connections belong to the event
+    loop that opened them, so turns run on the container loop (run_async) or one
+    long-running server loop.
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        with _lock:
+            if _async_http_client is None:
+                import httpx
+                _async_http_client = httpx.AsyncClient(limits=pool_limits())
+    return _async_http_client
+
+
+def run_async(coro):
+    """
+    asyncio.run for sync entry points (lambda_handler, CLI turns), but on one event loop
+    kept for the life of the container, so the async pool's keep-alive connections
+    survive between warm invocations.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    try:
+        return _loop.run_until_complete(coro)
+    finally:
+        _finish_pending(_loop)
+
+
+def _finish_pending(loop):
+    """Like asyncio.run's exit: cancel what the turn left running (abandoned LLM streams) and let it close"""
+    loop.run_until_complete(asyncio.sleep(0))
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    if pending:
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
@@ -0,0 +1,66 @@
+"""
+Cold-start import report for the Lambda entry point.
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter and
+summarizes where the time goes, grouped by top-level package.
+
+    python importtime_report.py                  # report for main
+    python importtime_report.py --module live_fill_2 --top 15
+    python importtime_report.py --budget-ms 400  # exit 1 if over budget (CI check)
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def measure(module: str):
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "importtime-report")
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        self_us, cumulative_us, name = int(parts[0]), int(parts[1]), parts[2]
+        rows.append((name.strip(), self_us, cumulative_us))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    rows = measure(args.module)
+    total_ms = next((cum for name, _, cum in rows if name == args.module), 0) / 1000
+
+    by_package = defaultdict(int)
+    for name, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    print(f"import {args.module}: {total_ms:.1f} ms")
+    print(f"\nTop {args.top} packages by self time:")
+    for package, self_us in sorted(by_package.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+
+    if args.budget_ms is not None:
+        status = "OK" if total_ms <= args.budget_ms else "OVER BUDGET"
+        print(f"\nBudget: {args.budget_ms:.0f} ms -> {status}")
+        if total_ms > args.budget_ms:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
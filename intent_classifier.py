@@ -0,0 +1,186 @@
+import os
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+# ------------------- Config -------------------
+# Answer confirm/decline/greeting/start/investor-type chat turns locally instead of
+# running extraction. "0" sends every chat message through extraction again (the
+# CLI's yes/no prompts are always classified locally).
+INTENT_ROUTING = os.getenv("INTENT_ROUTING", "1").lower() not in ("0", "false", "off", "no")
+# Minimum score (0-1) for a message to count as an intent
+INTENT_MIN_SCORE = float(os.getenv("INTENT_MIN_SCORE", "0.75"))
+# Longer messages are always treated as data
+INTENT_MAX_TOKENS = int(os.getenv("INTENT_MAX_TOKENS", "6"))
+
+INTENTS = ("confirm", "decline", "greeting", "start", "investor_type")
+
+# ------------------- Phrases -------------------
+INTENT_PHRASES = {
+    "confirm": (
+        "yes", "y", "yeah", "yea", "ya", "yep", "yup", "sure", "ok", "okay", "k", "absolutely", "definitely",
+        "of course", "go ahead", "yes please", "sure thing", "sounds good", "please do", "more", "i do",
+        "i have more", "ready", "i am ready", "yes i am ready", "why not", "alright", "right",
+    ),
+    "decline": (
+        "no", "n", "nope", "nah", "done", "that's all", "that is all", "nothing", "nothing else", "finish",
+        "finished", "not now", "will not", "won't", "no thanks", "no thank you", "i'm done", "all done",
+        "not really", "later", "maybe later", "stop", "exit", "quit", "no more",
+    ),
+    "greeting": (
+        "hi", "hello", "hey", "hiya", "hi there", "hello there", "hey there", "good morning",
+        "good afternoon", "good evening", "greetings",
+    ),
+    "start": (
+        "start", "let's start", "get started", "let's get started", "begin", "let's begin", "let's go",
+        "start now", "start onboarding", "onboard me", "i want to start", "get going",
+    ),
+}
+# Words that neither help nor hurt a match ("no, thank you" is still a decline)
+FILLER_TOKENS = frozenset({
+    "i", "im", "am", "a", "an", "the", "please", "thanks", "thank", "you", "it", "its", "is", "that", "thats",
+    "for", "now", "just", "so", "well", "um", "uh", "oh", "ah", "then", "very", "much", "as", "investor",
+    "investors", "we", "are", "my", "me", "type", "category",
+})
+# Extra words that point at an investor type without being part of its name
+INVESTOR_TYPE_ALIASES = {
+    "company": "corporation", "corp": "corporation", "inc": "corporation",
+    "charity": "profit", "ngo": "profit", "foundation": "profit",
+    "school": "education", "university": "education", "college": "education",
+    "govt": "government", "gov": "government", "person": "individual", "myself": "individual",
+}
+
+_TYPE_STOP = FILLER_TOKENS | {"of", "and"}
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str):
+    """Lowercase words without punctuation ("That's all!" -> "thats all")"""
+    text = text.lower().replace("’", "'").replace("'", "")
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def _stem(token: str):
+    return token[:-1] if len(token) > 3 and token.endswith("s") else token
+
+
+class Intent:
+    """A recognized non-data message: its intent, score and (for investor_type) the chosen type"""
+
+    __slots__ = ("name", "score", "value")
+
+    def __init__(self, name: str, score: float, value: str = None):
+        self.name = name
+        self.score = score
+        self.value = value
+
+    def to_dict(self):
+        return {"intent": self.name, "score": round(self.score, 3), "value": self.value}
+
+    def __repr__(self):
+        return f"Intent({self.name!r}, {self.score:.2f}, {self.value!r})"
+
+
+class IntentClassifier:
+    """
+    Phrase table plus a tiny token-scoring model, compiled once.
+
+    An exact (normalized) phrase scores 1.0. Otherwise every token votes for the
+    intents whose phrases contain it, weighted by how specific it is to them;
+    the score is the average over the non-filler tokens, so unknown words (a
+    name, an address) pull it down and the message is left to extraction.
+    Messages with digits or "@" are data unless they are an investor type number.
+    """
+
+    def __init__(self, investor_types=(), min_score: float = INTENT_MIN_SCORE, max_tokens: int = INTENT_MAX_TOKENS):
+        self.investor_types = tuple(investor_types)
+        self.min_score = min_score
+        self.max_tokens = max_tokens
+        self.phrases = {}
+        counts = defaultdict(lambda: defaultdict(int))
+        for intent, phrases in INTENT_PHRASES.items():
+            for phrase in phrases:
+                phrase = normalize(phrase)
+                self.phrases[phrase] = intent
+                for token in set(phrase.split()) - FILLER_TOKENS:
+                    counts[token][intent] += 1
+        self.weights = {
+            token: {intent: n / sum(by_intent.values()) for intent, n in by_intent.items()}
+            for token, by_intent in counts.items()
+        }
+
+        self.type_names = {}
+        self.type_tokens = {}
+        for investor_type in self.investor_types:
+            name = normalize(investor_type)
+            self.type_names[name] = investor_type
+            self.type_tokens[investor_type] = {_stem(t) for t in name.split()} - _TYPE_STOP
+
+    def classify(self, text: str, expect=None):
+        """Intent of `text` (restricted to `expect` when given), or None for a data message"""
+        norm = normalize(text)
+        if not norm:
+            return None
+        allowed = set(expect or INTENTS)
+        if "investor_type" in allowed and self.investor_types:
+            intent = self._investor_type(norm)
+            if intent is not None:
+                return intent
+        if "@" in text or any(c.isdigit() for c in norm):
+            return None
+        tokens = norm.split()
+        if len(tokens) > self.max_tokens:
+            return None
+
+        intent = self.phrases.get(norm)
+        if intent in allowed:
+            return Intent(intent, 1.0)
+
+        content = [t for t in tokens if t not in FILLER_TOKENS]
+        if not content:
+            return None
+        scores = defaultdict(float)
+        for token in content:
+            for intent, weight in self.weights.get(token, {}).items():
+                scores[intent] += weight / len(content)
+        ranked = sorted(((s, i) for i, s in scores.items() if i in allowed), reverse=True)
+        if not ranked or ranked[0][0] < self.min_score:
+            return None
+        if len(ranked) > 1 and ranked[1][0] >= ranked[0][0]:
+            return None
+        return Intent(ranked[0][1], ranked[0][0])
+
+    def _investor_type(self, norm: str):
+        if norm.isdigit():
+            index = int(norm)
+            if 1 <= index <= len(self.investor_types):
+                return Intent("investor_type", 1.0, self.investor_types[index - 1])
+            return None
+        if norm in self.type_names:
+            return Intent("investor_type", 1.0, self.type_names[norm])
+        tokens = norm.split()
+        if len(tokens) > self.max_tokens:
+            return None
+        content = {_stem(INVESTOR_TYPE_ALIASES.get(t, t)) for t in tokens} - _TYPE_STOP
+        if not content:
+            return None
+        scored = sorted(
+            ((len(content & type_tokens) / len(content), investor_type)
+             for investor_type, type_tokens in self.type_tokens.items()),
+            key=lambda pair: pair[0], reverse=True,
+        )
+        best_score, best = scored[0]
+        if best_score < self.min_score or (len(scored) > 1 and scored[1][0] >= best_score):
+            return None
+        return Intent("investor_type", best_score, best)
+
+
+@lru_cache(maxsize=16)
+def get_intent_classifier(investor_types=()):
+    """Shared classifier for a tuple of investor types (compiled once each)"""
+    return IntentClassifier(investor_types)
+
+
+def classify_intent(text: str, investor_types=(), expect=None):
+    """Intent of a chat message, or None for a data message"""
+    return get_intent_classifier(tuple(investor_types)).classify(text, expect)
@@ -1,58 +1,141 @@
 import os
-import boto3
-import io
+import asyncio
 import json
+import random
+import re
 import uuid
+import weakref
 import datetime
 from dotenv import load_dotenv
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 import warnings
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 
-# LangChain & OpenAI
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnableSequence
+from conversation_memory import ConversationMemory
+from extraction_cache import extraction_cache
+from extraction_router import extraction_router
+from intent_classifier import INTENT_ROUTING, classify_intent
+from llm_guard import (
+    LLM_EXTRACT_SHARE,
+    LLM_MAX_RETRIES,
+    LLM_REQUEST_TIMEOUT_S,
+    LLMUnavailable,
+    get_deadline,
+    llm_guard,
+)
+from schema_index import BOOLEAN_GROUPS, CompiledSchema, FieldDescriptor, FillState, field_label
+from session_sink import LocalSessionSink, S3SessionSink
+from structured_output import (
+    EXTRACTION_OUTPUT,
+    StreamingJSONParser,
+    extraction_response_format,
+    extraction_stats,
+    fields_from_output,
+    salvage_json,
+)
+from http_pool import get_async_http_client, get_http_client, run_async
+from turn_trace import start_trace, trace_set, trace_stage, trace_usage
 
-# NLP fallback
-import re
-import spacy
-from fuzzywuzzy import process
+# LangChain/OpenAI, spaCy, fuzzywuzzy and boto3 are imported lazily by the
+# providers below so a cold start only pays for what the turn actually uses.
+# `python importtime_report.py` shows the resulting cold-start import budget.
 
 # ------------------- Config -------------------
-s3 = boto3.client('s3')
-
-def load_json_from_s3(bucket, key):
-    response = s3.get_object(Bucket=bucket, Key=key)
-    return json.loads(response['Body'].read().decode('utf-8'))
-
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise EnvironmentError("Set OPENAI_API_KEY in .env")
 
-# Single model for everything: gpt-4o-mini (best price/performance)
-llm_extraction = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0.0,  # Deterministic for extraction
-    openai_api_key=OPENAI_API_KEY
-)
-
-llm_conversation = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0.7,  # Natural conversation
-    openai_api_key=OPENAI_API_KEY
-)
-
 FORM_KEYS_FILE = "form_keys.json"
 MANDATORY_FILE = "mandatory.json"
-MEMORY_BUFFER_SIZE = 8
 
-# Load spaCy
-try:
-    nlp = spacy.load("en_core_web_sm")
-except:
-    nlp = None
+# ------------------- Lazy providers -------------------
+# Module globals stay overridable (e.g. with a fake chat model); they are only
+# built on first use when still None. Both chat models share the container's
+# keep-alive HTTP pool (http_pool.py).
+s3 = None
+llm_extraction = None
+llm_conversation = None
+nlp = None
+_nlp_loaded = False
+_prompts = {}
+_chains = {}
+_structured_chains = OrderedDict()
+# Structured extraction chains are bound to the offered key set; this many are kept (LRU)
+EXTRACTION_CHAIN_CACHE = int(os.getenv("EXTRACTION_CHAIN_CACHE", "256"))
+
+def get_s3():
+    global s3
+    if s3 is None:
+        import boto3
+        s3 = boto3.client('s3')
+    return s3
+
+def get_extraction_llm():
+    global llm_extraction
+    if llm_extraction is None:
+        from langchain_openai import ChatOpenAI
+        # Single model for everything: gpt-4o-mini (best price/performance)
+        llm_extraction = ChatOpenAI(
+            model="gpt-4o-mini",
+            temperature=0.0,  # Deterministic for extraction
+            openai_api_key=OPENAI_API_KEY,
+            timeout=LLM_REQUEST_TIMEOUT_S,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client()
+        )
+    return llm_extraction
+
+def get_conversation_llm():
+    global llm_conversation
+    if llm_conversation is None:
+        from langchain_openai import ChatOpenAI
+        llm_conversation = ChatOpenAI(
+            model="gpt-4o-mini",
+            temperature=0.7,  # Natural conversation
+            openai_api_key=OPENAI_API_KEY,
+            timeout=LLM_REQUEST_TIMEOUT_S,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client()
+        )
+    return llm_conversation
+
+def get_nlp():
+    """spaCy en_core_web_sm, loaded on the first fallback extraction (None if unavailable)"""
+    global nlp, _nlp_loaded
+    if not _nlp_loaded:
+        _nlp_loaded = True
+        try:
+            import spacy
+            # Only NER is used; en_core_web_sm's ner has its own tok2vec, so the
+            # shared tok2vec and every other component can be skipped.
+            nlp = spacy.load("en_core_web_sm", exclude=[
+                "tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer"
+            ])
+        except:
+            nlp = None
+    return nlp
+
+def get_prompt(template: str):
+    prompt = _prompts.get(template)
+    if prompt is None:
+        from langchain_core.prompts import PromptTemplate
+        prompt = _prompts[template] = PromptTemplate.from_template(template)
+    return prompt
+
+def get_chain(template: str, llm):
+    """get_prompt(template) | llm, built once per template and model and reused by every turn"""
+    key = (template, id(llm))
+    entry = _chains.get(key)
+    if entry is None or entry[0] is not llm:
+        entry = _chains[key] = (llm, get_prompt(template) | llm)
+    return entry[1]
+
+def load_json_from_s3(bucket, key):
+    response = get_s3().get_object(Bucket=bucket, Key=key)
+    return json.loads(response['Body'].read().decode('utf-8'))
 
 # ------------------- Utilities -------------------
 def load_json(path):
@@ -63,9 +146,11 @@ def save_json(path, data):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=4, ensure_ascii=False)
 
+def new_session_name():
+    return datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + str(uuid.uuid4())[:8]
+
 def create_session_folder(root="chatbot_sessions"):
-    session_name = datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + str(uuid.uuid4())[:8]
-    session_folder = os.path.join(root, session_name)
+    session_folder = os.path.join(root, new_session_name())
     os.makedirs(session_folder, exist_ok=True)
     return session_folder
 
@@ -104,31 +189,65 @@ COMMON_PATTERNS = {
     "phone": r"\+?\d[\d\s\-]{7,}\d",
     "pan": r"[A-Z]{5}\d{4}[A-Z]",
 }
+# One alternation with a named group per pattern: a single finditer pass finds
+# every match of every pattern, and earlier patterns win on overlap (an email's
+# digits are never re-read as a phone number).
+FALLBACK_REGEX = re.compile("|".join(f"(?P<{name}>{pat})" for name, pat in COMMON_PATTERNS.items()))
+
+# Only labels FALLBACK_FIELD_LABELS maps to a field are taken. Places (GPE/LOC) are
+# not: spaCy does not tell a city from a country, so City/Country are left to the LLM
+# rather than filled by position. Nor are organisations (ORG): the form has no
+# company-name field, and an entity's legal name is not told apart from an employer.
+NER_LABELS = ("person", "date")
+
+# Fallback label -> words of the mandatory.json labels it fills. Candidates are in
+# form order, and the n-th value found for a label goes to the n-th field (first
+# email -> investor, second -> authorized signatory).
+FALLBACK_FIELD_LABELS = {
+    "email": ("email",),
+    "phone": ("phone",),
+    "pan": ("tax",),
+    "person": ("name",),
+    "date": ("dob",),
+}
+_fallback_field_maps = weakref.WeakKeyDictionary()
+
+def fallback_field_map(schema: CompiledSchema):
+    """label -> candidate form keys, computed once per compiled schema"""
+    field_map = _fallback_field_maps.get(schema)
+    if field_map is None:
+        field_map = {label: schema.fields_labelled(*words) for label, words in FALLBACK_FIELD_LABELS.items()}
+        _fallback_field_maps[schema] = field_map
+    return field_map
 
-def fallback_extract(user_input: str, form_keys_flat: dict):
-    extracted = {}
-    # Regex extraction
-    for name, pat in COMMON_PATTERNS.items():
-        m = re.search(pat, user_input)
-        if m:
-            extracted[name] = m.group().strip()
+def fallback_extract(user_input: str, form_keys_flat: dict, schema: CompiledSchema):
+    """
+    Regex + NER extraction. `schema` is the config's compiled schema (with mandatory.json):
+    the field labels come from it, and its field map is cached per schema.
+    """
+    found = defaultdict(list)
+    # Regex extraction (single pass, all matches)
+    for m in FALLBACK_REGEX.finditer(user_input):
+        value = m.group().strip()
+        if value not in found[m.lastgroup]:
+            found[m.lastgroup].append(value)
     
     # NLP extraction
+    nlp = get_nlp()
     if nlp:
         doc = nlp(user_input)
         for ent in doc.ents:
             label = ent.label_.lower()
-            if label in ["person", "org", "gpe", "loc", "date"]:
-                extracted[label] = ent.text
+            if label in NER_LABELS and ent.text not in found[label]:
+                found[label].append(ent.text)
     
-    # Fuzzy matching to form keys
+    # Map labels to form keys
+    field_map = fallback_field_map(schema)
     mapped = {}
-    for short_label, value in extracted.items():
-        result = process.extractOne(short_label, list(form_keys_flat.keys()))
-        if result:
-            candidate_key, score = result
-            if score >= 65:
-                mapped[candidate_key] = value
+    for label, values in found.items():
+        candidates = [k for k in field_map.get(label, ()) if k in form_keys_flat and k not in mapped]
+        for key, value in zip(candidates, values):
+            mapped[key] = value
     
     return mapped
 
@@ -142,9 +261,7 @@ def validate_phone_format(phone: str):
     return True
 
 # ------------------- LLM extraction -------------------
-EXTRACT_PROMPT = PromptTemplate(
-    input_variables=["schema_json", "user_input", "chat_history"],
-    template="""You are an assistant that extracts structured form data from user input.
+EXTRACT_TEMPLATE = """You are an assistant that extracts structured form data from user input.
 
 Conversation history:
 {chat_history}
@@ -160,30 +277,132 @@ If nothing can be extracted, return {{}}.
 Example output: {{"Name": "John Doe", "Email ID": "john@example.com"}}
 
 JSON:"""
-)
 
-def llm_extract(user_input: str, chat_history: str, live_fill_flat: dict):
-    schema_keys = list(live_fill_flat.keys())[:100]
-    schema_json = json.dumps(schema_keys, ensure_ascii=False)
-    
+# Used with EXTRACTION_OUTPUT=json_schema: the response format enforces the shape and
+# limits "key" to the fields offered this turn.
+STRUCTURED_EXTRACT_TEMPLATE = """You are an assistant that extracts structured form data from user input.
+
+Conversation history:
+{chat_history}
+
+Available form fields (use exact keys):
+{schema_json}
+
+User message: "{user_input}"
+
+Put every field you can fill from the user message in "fields" as {{"key": <form field>, "value": <value>}}.
+Keys MUST be form fields from the list above. If nothing can be extracted, return {{"fields": []}}."""
+
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "15"))
+
+def select_schema_keys(user_input: str, live_fill_flat: dict, schema: CompiledSchema, mandatory_flat: dict,
+                       top_k: int = SCHEMA_TOP_K, missing: list = None):
+    """Fields worth showing the LLM for this message: the top-K ranked against it plus
+    every still-missing mandatory field (`missing` when the caller has it), in form order."""
+    selected = set(schema.rank_fields(user_input, top_k))
+    selected.update(get_missing_mandatory_keys(live_fill_flat, mandatory_flat) if missing is None else missing)
+    return [k for k in live_fill_flat if k in selected]
+
+def _offered_keys(live_fill_flat: dict, schema_keys: list = None):
+    return schema_keys if schema_keys is not None else list(live_fill_flat.keys())[:100]
+
+def extract_inputs(user_input: str, chat_history: str, live_fill_flat: dict, schema_keys: list = None):
+    schema_keys = _offered_keys(live_fill_flat, schema_keys)
+    return {
+        "schema_json": json.dumps(schema_keys, ensure_ascii=False),
+        "user_input": user_input,
+        "chat_history": chat_history
+    }
+
+def extraction_chain(field_keys: list, combined: bool = False):
+    """
+    Prompt | extraction LLM for EXTRACTION_OUTPUT; with json_schema only `field_keys` can be
+    returned. Chains are prebuilt: one per template, and one per recently offered key set.
+    """
+    llm = get_extraction_llm()
+    # An enum needs at least one value
+    if EXTRACTION_OUTPUT != "json_schema" or not field_keys:
+        return get_chain(COMBINED_TEMPLATE if combined else EXTRACT_TEMPLATE, llm)
+    key = (combined, tuple(field_keys), id(llm))
+    entry = _structured_chains.get(key)
+    if entry is not None and entry[0] is llm:
+        _structured_chains.move_to_end(key)
+        return entry[1]
+    template = STRUCTURED_COMBINED_TEMPLATE if combined else STRUCTURED_EXTRACT_TEMPLATE
+    chain = get_prompt(template) | llm.bind(response_format=extraction_response_format(field_keys, combined))
+    _structured_chains[key] = (llm, chain)
+    if len(_structured_chains) > EXTRACTION_CHAIN_CACHE:
+        _structured_chains.popitem(last=False)
+    return chain
+
+def _parse_output(raw: str, live_fill_flat: dict):
+    """(parsed answer or None, fields kept, complete): tolerant parse, counted in extraction_stats"""
+    parsed, complete = salvage_json(raw)
+    returned = fields_from_output(parsed)
+    fields = {k: v for k, v in returned.items() if k in live_fill_flat}
+    extraction_stats.record(parsed, complete, len(fields), len(returned))
+    trace_set(extraction_parse="failed" if parsed is None else ("ok" if complete else "salvaged"))
+    return parsed, fields, complete
+
+def parse_extraction(result, live_fill_flat: dict):
+    """Fields of an extraction answer, or None when nothing could be parsed (fallback runs)"""
+    raw = result.content if hasattr(result, 'content') else str(result)
+    parsed, fields, _ = _parse_output(raw, live_fill_flat)
+    return fields if parsed is not None else None
+
+def llm_extract(user_input: str, chat_history: str, live_fill_flat: dict, schema_keys: list = None):
     try:
-        chain = EXTRACT_PROMPT | llm_extraction
-        result = chain.invoke({
-            "schema_json": schema_json,
-            "user_input": user_input,
-            "chat_history": chat_history
-        })
-        raw = result.content if hasattr(result, 'content') else str(result)
-        parsed = json.loads(raw)
-        filtered = {k: v for k, v in parsed.items() if k in live_fill_flat}
-        return filtered
+        chain = extraction_chain(_offered_keys(live_fill_flat, schema_keys))
+        with trace_stage("llm_extract"):
+            result = chain.invoke(extract_inputs(user_input, chat_history, live_fill_flat, schema_keys))
+        trace_usage("llm_extract", result)
     except Exception as e:
         return None
+    return parse_extraction(result, live_fill_flat)
+
+async def allm_extract(user_input: str, chat_history: str, live_fill_flat: dict, schema_keys: list = None,
+                       timeout: float = None):
+    """
+    Streams the answer within `timeout` seconds (through llm_guard, hedged when LLM_HEDGE
+    is on), so an interrupted or timed-out response still yields its complete fields.
+    Returns (fields or None, complete): complete is False for a cut-off or salvaged
+    answer, which must not be cached.
+    """
+    parsers = []
+    finished = True
+    try:
+        chain = extraction_chain(_offered_keys(live_fill_flat, schema_keys))
+        inputs = extract_inputs(user_input, chat_history, live_fill_flat, schema_keys)
+
+        async def attempt():
+            parser = StreamingJSONParser()
+            parsers.append(parser)
+            async for chunk in chain.astream(inputs):
+                trace_usage("llm_extract", chunk)
+                parser.feed(chunk.content if hasattr(chunk, 'content') else str(chunk))
+            return parser
+
+        with trace_stage("llm_extract"):
+            parser = await llm_guard.call("llm_extract", attempt,
+                                          get_deadline().remaining() if timeout is None else timeout, hedge=True)
+    except Exception as e:
+        trace_set(llm_extract_outcome=_outcome(e))
+        finished = False
+        parser = max(parsers, key=lambda p: len(p.chunks), default=None)
+        if parser is None or not parser.chunks:
+            return None, False
+    parsed, fields, complete = _parse_output(parser.text, live_fill_flat)
+    if parsed is None:
+        return None, False
+    return fields, finished and complete
+
+def _outcome(error: Exception):
+    if isinstance(error, LLMUnavailable):
+        return "skipped"
+    return "timeout" if isinstance(error, asyncio.TimeoutError) else "error"
 
 # ------------------- Natural conversation -------------------
-CONVERSATION_PROMPT = PromptTemplate(
-    input_variables=["extracted_fields", "missing_count", "chat_history"],
-    template="""You are a friendly onboarding assistant helping someone fill out a form.
+CONVERSATION_TEMPLATE = """You are a friendly onboarding assistant helping someone fill out a form.
 
 Conversation so far:
 {chat_history}
@@ -197,53 +416,364 @@ Generate ONE natural, friendly question (1 sentence max) asking if the user has
 - Keep it casual and human
 
 Question:"""
-)
+
+DEFAULT_FOLLOWUP = "Do you have any other information you'd like to provide?"
+COMPLETE_FOLLOWUP = "All set! Your PDF is ready. You can add more details or fill another form anytime."
+
+def _followup_inputs(extracted, missing_count: int, chat_history: str):
+    # extracted=None means the follow-up is generated speculatively, before extraction finished
+    if extracted is None:
+        captured = "the details in their latest message"
+    else:
+        captured = list(extracted.keys()) if extracted else "nothing new"
+    return {
+        "extracted_fields": captured,
+        "missing_count": missing_count,
+        "chat_history": chat_history
+    }
 
 def generate_natural_followup(extracted: dict, missing_count: int, chat_history: str):
     try:
-        chain = CONVERSATION_PROMPT | llm_conversation
-        result = chain.invoke({
-            "extracted_fields": list(extracted.keys()) if extracted else "nothing new",
-            "missing_count": missing_count,
-            "chat_history": chat_history
-        })
+        chain = get_chain(CONVERSATION_TEMPLATE, get_conversation_llm())
+        with trace_stage("llm_followup"):
+            result = chain.invoke(_followup_inputs(extracted or {}, missing_count, chat_history))
+        trace_usage("llm_followup", result)
         response = result.content if hasattr(result, 'content') else str(result)
         return response.strip()
     except:
-        return "Do you have any other information you'd like to provide?"
+        return DEFAULT_FOLLOWUP
+
+async def agenerate_natural_followup(extracted, missing_count: int, chat_history: str, timeout: float = None):
+    try:
+        chain = get_chain(CONVERSATION_TEMPLATE, get_conversation_llm())
+        inputs = _followup_inputs(extracted, missing_count, chat_history)
+        with trace_stage("llm_followup"):
+            result = await llm_guard.call("llm_followup", lambda: chain.ainvoke(inputs),
+                                          get_deadline().remaining() if timeout is None else timeout)
+        trace_usage("llm_followup", result)
+        response = result.content if hasattr(result, 'content') else str(result)
+        return response.strip()
+    except Exception as e:
+        trace_set(llm_followup_outcome=_outcome(e))
+        return DEFAULT_FOLLOWUP
+
+async def astream_natural_followup(extracted, missing_count: int, chat_history: str, timeout: float = None):
+    """Yield the follow-up question chunk by chunk as the conversation LLM produces it"""
+    sent = False
+    try:
+        chain = get_chain(CONVERSATION_TEMPLATE, get_conversation_llm())
+        inputs = _followup_inputs(extracted, missing_count, chat_history)
+        async for chunk in llm_guard.stream("llm_followup", lambda: chain.astream(inputs),
+                                            get_deadline().remaining() if timeout is None else timeout):
+            trace_usage("llm_followup", chunk)
+            text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            if text:
+                sent = True
+                yield text
+    except Exception as e:
+        trace_set(llm_followup_outcome=_outcome(e))
+        if not sent:
+            yield DEFAULT_FOLLOWUP
+
+# ------------------- Template follow-up -------------------
+# The follow-up only depends on what was captured and what is still missing, so
+# by default it is rendered locally. FOLLOWUP_LLM_RATE is the share of turns
+# (0.0-1.0) that still ask the conversation LLM for a free-form question.
+FOLLOWUP_LLM_RATE = float(os.getenv("FOLLOWUP_LLM_RATE", "0"))
+
+FOLLOWUP_TEMPLATES = {
+    "captured": (
+        "Thanks, I've got your {captured}! Anything else you'd like to share?",
+        "Got it, {captured} noted. Is there anything else you'd like to add?",
+        "Perfect, thanks for the {captured}! What else can you tell me?",
+    ),
+    "captured_few_left": (
+        "Thanks, I've got your {captured}! Could you also share your {next}?",
+        "Great, {captured} noted. Almost there, what's your {next}?",
+    ),
+    "nothing": (
+        "Sorry, I couldn't pick that up. Could you tell me your {next}?",
+        "Hmm, I didn't catch any details there. What's your {next}?",
+    ),
+}
+FEW_LEFT = 3
+
+def sample_llm_followup():
+    """Whether this turn asks the conversation LLM instead of rendering a template"""
+    return random.random() < FOLLOWUP_LLM_RATE
+
+def _join_labels(labels: list, limit: int = 3):
+    if len(labels) > limit:
+        labels = labels[:limit] + [f"{len(labels) - limit} more"]
+    if len(labels) <= 1:
+        return "".join(labels)
+    return ", ".join(labels[:-1]) + " and " + labels[-1]
+
+def template_followup(extracted: dict, missing_count: int, next_missing: list = (), schema: CompiledSchema = None):
+    """Local follow-up question from field labels and the missing count (no LLM call)"""
+    if not missing_count:
+        return COMPLETE_FOLLOWUP
+    label = schema.label if schema is not None else field_label
+    captured = _join_labels([label(k) for k in (extracted or {})])
+    upcoming = _join_labels([label(k) for k in next_missing], limit=2)
+    if captured and upcoming and missing_count <= FEW_LEFT:
+        bucket = "captured_few_left"
+    elif captured:
+        bucket = "captured"
+    elif upcoming:
+        bucket = "nothing"
+    else:
+        return DEFAULT_FOLLOWUP
+    return random.choice(FOLLOWUP_TEMPLATES[bucket]).format(captured=captured, next=upcoming)
+
+# ------------------- Intent replies -------------------
+# Bot lines of flow.txt for turns that carry no form data (see intent_classifier.py)
+GREETING_REPLY = ("Hi there, I'm Chatname your Finance Form Assistant. I can help you fill out your "
+                  "information in PDF documents quickly and accurately. Would you like to get started now?")
+ASK_INVESTOR_TYPE_REPLY = "Great! Could you tell me what type of investor category best describes you?"
+GOODBYE_REPLY = "Thank you for visiting. Goodbye!"
+START_DETAILS_REPLY = ("Alright, let's get started! Please enter the details you'd like to fill in the PDF. "
+                       "For best results, separate multiple details using ;, & or place each on a new line.")
+READY_REPLY = "Alright! Please enter details in the chat whenever you're ready."
+MISSING_REPLY = ("It looks like some mandatory information is missing. They are listed below. "
+                 "Would you like to provide them now?")
+
+def intent_followup(intent, missing: list, chat_history: str = "", schema: CompiledSchema = None):
+    """Bot reply to a confirm/decline/greeting/start/investor_type turn inside a session (no LLM call)"""
+    if intent.name == "investor_type":
+        return START_DETAILS_REPLY
+    if intent.name == "decline":
+        return MISSING_REPLY if missing else COMPLETE_FOLLOWUP
+    if intent.name in ("confirm", "start") and missing and chat_history.rstrip().endswith(MISSING_REPLY):
+        # "Yes" to "Would you like to provide them now?": ask for the first ones
+        label = schema.label if schema is not None else field_label
+        return f"Great! What's your {_join_labels([label(k) for k in missing[:2]], limit=2)}?"
+    if intent.name == "greeting":
+        return "Hi again! " + READY_REPLY
+    return READY_REPLY
+
+# ------------------- Turn pipeline -------------------
+# How extraction and an LLM follow-up question share a turn (turns that use the
+# template follow-up only make the extraction call):
+#   sequential  - extract, then generate the follow-up (two serial LLM round trips)
+#   speculative - generate the follow-up concurrently from the pre-extraction missing
+#                 count, then finalize it once the extraction result is known
+#   combined    - one structured LLM call returns both the fields and the question
+TURN_STRATEGIES = ("sequential", "speculative", "combined")
+TURN_STRATEGY = os.getenv("TURN_STRATEGY", "speculative")
+
+COMBINED_TEMPLATE = """You are a friendly onboarding assistant that extracts structured form data from user input.
+
+Conversation history:
+{chat_history}
+
+Available form fields (use exact keys):
+{schema_json}
+
+User message: "{user_input}"
+Still need: {missing_count} mandatory fields (before this message)
+
+Return ONLY a valid JSON object with two keys:
+- "fields": the extracted fields. Keys MUST match the form fields exactly. Use {{}} if nothing can be extracted.
+- "followup": ONE natural, friendly question (1 sentence max) asking if the user has more information to share.
+  Sound conversational and warm, don't mention "fields" or "data" or "mandatory".
+
+Example output: {{"fields": {{"Name": "John Doe"}}, "followup": "Thanks John! Anything else you'd like to add?"}}
+
+JSON:"""
+
+STRUCTURED_COMBINED_TEMPLATE = """You are a friendly onboarding assistant that extracts structured form data from user input.
+
+Conversation history:
+{chat_history}
+
+Available form fields (use exact keys):
+{schema_json}
+
+User message: "{user_input}"
+Still need: {missing_count} mandatory fields (before this message)
+
+Return:
+- "fields": every field you can fill from the user message as {{"key": <form field>, "value": <value>}}.
+  Keys MUST be form fields from the list above. Use [] if nothing can be extracted.
+- "followup": ONE natural, friendly question (1 sentence max) asking if the user has more information to share.
+  Sound conversational and warm, don't mention "fields" or "data" or "mandatory"."""
+
+def finalize_followup(speculative: str, missing_before: int, missing_after: int):
+    """A speculative question was written for the old missing count; replace it
+    when this turn completed every mandatory field."""
+    if missing_before and not missing_after:
+        return COMPLETE_FOLLOWUP
+    return speculative
+
+async def _combined_extract(user_input: str, chat_history: str, live_fill_flat: dict, missing_count: int,
+                            schema_keys: list = None, timeout: float = None):
+    """(fields or None, followup, complete) from one structured call"""
+    inputs = extract_inputs(user_input, chat_history, live_fill_flat, schema_keys)
+    inputs["missing_count"] = missing_count
+    try:
+        chain = extraction_chain(_offered_keys(live_fill_flat, schema_keys), combined=True)
+        with trace_stage("llm_combined"):
+            result = await llm_guard.call("llm_combined", lambda: chain.ainvoke(inputs),
+                                          get_deadline().remaining() if timeout is None else timeout)
+        trace_usage("llm_combined", result)
+    except Exception as e:
+        trace_set(llm_combined_outcome=_outcome(e))
+        return None, "", False
+    parsed, fields, complete = _parse_output(result.content if hasattr(result, 'content') else str(result),
+                                             live_fill_flat)
+    if parsed is None:
+        return None, "", False
+    followup = parsed.get("followup")
+    return fields, followup.strip() if isinstance(followup, str) else "", complete
+
+async def extract_and_followup(user_input: str, chat_history: str, live_fill_flat: dict,
+                               mandatory_flat: dict, apply_extracted, strategy: str = None,
+                               schema: CompiledSchema = None, with_followup: bool = True, intent=None,
+                               fill_state: FillState = None, investor_type: str = None):
+    """
+    Run one conversational turn: extraction (rules, LLM, then fallback) and the follow-up question.
+    apply_extracted(extracted, method) validates the fields, merges them into live_fill_flat and
+    returns what was kept. extraction_router resolves unambiguous values locally first; the LLM
+    only sees the rest of the message and the fields still open, and is skipped when nothing is
+    left (method "rules"). With a compiled schema the extraction prompt only lists the fields
+    selected by select_schema_keys. LLM extractions are served from / stored in
+    extraction_cache (method "cache" on a hit). The follow-up comes from template_followup
+    unless this turn is sampled for the LLM (FOLLOWUP_LLM_RATE) or the combined strategy
+    already produced one. with_followup=False only runs the extraction (followup is None),
+    for callers that stream the question themselves. Messages that are only a confirm / decline /
+    greeting / start (classify_intent, or the `intent` passed in) skip extraction entirely: method
+    "intent", no fields, and the reply from intent_followup even with with_followup=False.
+    LLM calls share the turn's deadline (llm_guard.turn_deadline, else LLM_TURN_DEADLINE_S from
+    now); a call that times out or fails falls back like an empty answer, and while llm_guard's
+    circuit is open or too little of the budget is left for a call, the turn runs on
+    fallback_extract and the template follow-up.
+    With a fill_state (kept in step by apply_extracted) the missing fields are read off its
+    bitset for `investor_type` instead of scanning live_fill_flat against mandatory_flat.
+    Returns (extracted, method, missing, followup).
+    """
+    strategy = strategy or TURN_STRATEGY
+    if strategy not in TURN_STRATEGIES:
+        raise ValueError(f"Unknown TURN_STRATEGY: {strategy}")
+
+    if intent is None and INTENT_ROUTING:
+        with trace_stage("intent_classify"):
+            intent = classify_intent(user_input)
+    def missing_keys():
+        if fill_state is not None:
+            return fill_state.missing(investor_type)
+        return get_missing_mandatory_keys(live_fill_flat, mandatory_flat)
+
+    if intent is not None:
+        missing = missing_keys()
+        trace_set(method="intent", intent=intent.name)
+        return {}, "intent", missing, intent_followup(intent, missing, chat_history, schema)
+
+    missing = missing_keys()
+    missing_before = len(missing)
+    schema_keys = None
+    if schema is not None:
+        with trace_stage("schema_select"):
+            schema_keys = select_schema_keys(user_input, live_fill_flat, schema, mandatory_flat, missing=missing)
+    speculative = None
+    followup = ""
+    deadline = get_deadline()
+    # Provider degraded (circuit open) or the turn's budget already spent:
+    # fallback_extract and the template follow-up answer
+    degraded = not llm_guard.available() or deadline.remaining() < llm_guard.min_call_s
+    use_llm_followup = with_followup and not degraded and sample_llm_followup()
+    if not with_followup or degraded:
+        strategy = "sequential"
+    # Extraction leaves part of the budget to a follow-up LLM call that runs after it
+    extract_share = LLM_EXTRACT_SHARE if use_llm_followup and strategy == "sequential" else 1.0
+
+    with trace_stage("rules_extract"):
+        route = extraction_router.route(user_input, live_fill_flat, schema)
+    llm_input = user_input
+    if route.fields:
+        llm_input = route.residual
+        if schema_keys is None:
+            schema_keys = list(live_fill_flat.keys())[:100]
+        schema_keys = [k for k in schema_keys if k not in route.fields]
+
+    cache_key = None
+    cached = None
+    extracted = None
+    complete = False
+    if route.needs_llm and extraction_cache.enabled:
+        with trace_stage("cache_lookup"):
+            cache_key = extraction_cache.key(
+                llm_input,
+                schema_keys if schema_keys is not None else list(live_fill_flat.keys())[:100],
+                schema.version_tag if schema is not None else ""
+            )
+            cached = extraction_cache.get(cache_key)
+
+    if cached is not None:
+        extracted = cached
+    elif not route.needs_llm:
+        extracted = None
+    elif strategy == "combined":
+        extracted, followup, complete = await _combined_extract(
+            llm_input, chat_history, live_fill_flat, missing_before, schema_keys, deadline.remaining()
+        )
+    elif strategy == "speculative" and use_llm_followup:
+        speculative = asyncio.ensure_future(agenerate_natural_followup(None, missing_before, chat_history,
+                                                                       deadline.remaining()))
+        extracted, complete = await allm_extract(llm_input, chat_history, live_fill_flat, schema_keys,
+                                                 deadline.remaining())
+    else:
+        extracted, complete = await allm_extract(llm_input, chat_history, live_fill_flat, schema_keys,
+                                                 deadline.share(extract_share))
+
+    # Only whole answers read off the message are cached: a cut-off one would be replayed
+    # truncated, and one resolved from this session's history would leak into other sessions
+    if cached is None and cache_key is not None and extracted is not None and complete:
+        extraction_cache.put(cache_key, extracted, llm_input)
+
+    llm_fields = extracted or {}
+    fallback_fields = {}
+    if route.needs_llm and not llm_fields:
+        if cached is None:
+            extraction_stats.record_fallback()
+        with trace_stage("fallback_extract"):
+            fallback_fields = fallback_extract(llm_input, live_fill_flat, schema)
+    if llm_fields:
+        method = "cache" if cached is not None else "llm"
+    elif route.fields:
+        method = "rules"
+    else:
+        method = "fallback"
+    # Rule values win: the LLM was not offered those fields
+    extracted = dict(route.fields)
+    for k, v in (llm_fields or fallback_fields).items():
+        extracted.setdefault(k, v)
+    extraction_router.record(route, user_input, method, len(llm_fields), len(fallback_fields))
+    trace_set(method=method, strategy=strategy, llm_followup=use_llm_followup, rules_fields=len(route.fields),
+              llm_skipped=not route.needs_llm, llm_degraded=degraded)
+
+    with trace_stage("apply"):
+        extracted = apply_extracted(extracted, method)
+        missing = missing_keys()
+
+    if not with_followup:
+        followup = None
+    elif speculative is not None:
+        followup = finalize_followup(await speculative, missing_before, len(missing))
+    elif strategy == "combined" and followup:
+        followup = finalize_followup(followup, missing_before, len(missing))
+    elif use_llm_followup and deadline.remaining() >= llm_guard.min_call_s:
+        followup = await agenerate_natural_followup(extracted or {}, len(missing), chat_history,
+                                                    deadline.remaining())
+    else:
+        with trace_stage("followup_template"):
+            followup = template_followup(extracted, len(missing), missing[:2], schema)
+
+    return extracted, method, missing, followup
 
 # ------------------- Field Mapping Helper -------------------
 def resolve_field_mapping(mandatory_data: dict, form_keys_flat: dict):
-    resolved = {}
-    
-    def find_field_path(field_id: str):
-        if not field_id:
-            return None
-        for path in form_keys_flat.keys():
-            if field_id in path and path.endswith('.value'):
-                return path
-        return None
-    
-    def process_dict(d, parent_key=""):
-        for key, value in d.items():
-            if isinstance(value, dict):
-                process_dict(value, key)
-            elif isinstance(value, str) and value:
-                actual_path = find_field_path(value)
-                if actual_path:
-                    resolved[actual_path] = ""
-            elif value == "":
-                if parent_key:
-                    section_prefix = f"{parent_key}.{key}"
-                else:
-                    section_prefix = key
-                
-                for path in form_keys_flat.keys():
-                    if section_prefix in path or key.replace(" ", "").lower() in path.lower():
-                        resolved[path] = ""
-    
-    process_dict(mandatory_data)
-    return resolved
+    return CompiledSchema(form_keys_flat).resolve(mandatory_data)
 
 # ------------------- Helper functions -------------------
 def get_missing_mandatory_keys(live_fill_flat: dict, mandatory_flat: dict):
@@ -254,8 +784,11 @@ def get_missing_mandatory_keys(live_fill_flat: dict, mandatory_flat: dict):
             missing.append(k)
     return missing
 
-def classify_mandatory_fields(mandatory_keys):
-    boolean_groups = ["Form PF (Investor Type)", "Type of Subscriber", "Share Class"]
+def classify_mandatory_fields(mandatory_keys, schema: CompiledSchema = None):
+    if schema is not None:
+        text_fields, grouped = schema.classify_fields(mandatory_keys)
+        return text_fields, defaultdict(list, grouped)
+    boolean_groups = BOOLEAN_GROUPS
     
     text_fields = []
     grouped_booleans = defaultdict(list)
@@ -269,44 +802,46 @@ def classify_mandatory_fields(mandatory_keys):
     
     return text_fields, grouped_booleans
 
-def get_all_boolean_fields_in_group(group_name, live_fill_flat):
+def get_all_boolean_fields_in_group(group_name, live_fill_flat, schema: CompiledSchema = None):
+    if schema is not None and group_name in schema.boolean_group_masks:
+        return schema.paths_of(schema.boolean_group_masks[group_name])
     all_fields = []
     for key in live_fill_flat.keys():
         if group_name.lower() in key.lower():
             all_fields.append(key)
     return all_fields
 
-def ask_text_fields_sequential(fields: list, live_fill_flat: dict, logs: list):
+def ask_text_fields_sequential(fields: list, live_fill_flat: dict, logs: list, schema: CompiledSchema = None):
     filled = {}
     mailing_checked = False
     same = "n"
+    describe = schema.describe if schema is not None else FieldDescriptor
     
     for key in fields:
         current_value = live_fill_flat.get(key, "")
         if current_value and str(current_value).strip():
             continue
         
-        path_parts = key.split('.')
-        if len(path_parts) >= 2:
-            short_name = path_parts[-2].replace("_", " ").replace("ID", "").strip().title()
-        else:
-            short_name = key.replace("_", " ").title()
+        field = describe(key)
+        short_name = field.label
         
-        if "mailing" in key.lower() and not mailing_checked:
-            same = input("\nIs mailing address same as registered address? (y/n): ").strip().lower()
+        if field.mailing and not mailing_checked:
+            same = classify_intent(input("\nIs mailing address same as registered address? (y/n): "),
+                                   expect=("confirm", "decline"))
+            same = "y" if same and same.name == "confirm" else "n"
             mailing_checked = True
             
             if same == "y":
-                for mail_key in [k for k in fields if "mailing" in k.lower()]:
+                for mail_key in [k for k in fields if describe(k).mailing]:
                     reg_key = mail_key.replace("mailing", "registered")
                     if reg_key in live_fill_flat and live_fill_flat[reg_key]:
                         filled[mail_key] = live_fill_flat[reg_key]
                 continue
         
-        if "mailing" in key.lower() and same == "y":
+        if field.mailing and same == "y":
             continue
         
-        if "phone" in key.lower() or "telephone" in key.lower():
+        if field.kind == "phone":
             while True:
                 value = input(f"{short_name}: ").strip()
                 if value:
@@ -327,20 +862,16 @@ def ask_text_fields_sequential(fields: list, live_fill_flat: dict, logs: list):
     
     return filled
 
-def ask_grouped_boolean_fields(grouped_booleans: dict, logs: list):
+def ask_grouped_boolean_fields(grouped_booleans: dict, logs: list, schema: CompiledSchema = None):
     filled = {}
+    describe = schema.describe if schema is not None else FieldDescriptor
     
     for group_name, fields in grouped_booleans.items():
         print(f"\n--- {group_name} ---")
         options = list(fields)
         
         for i, key in enumerate(options, start=1):
-            path_parts = key.split(".")
-            if len(path_parts) >= 2:
-                opt_name = path_parts[-2].replace("_", " ").replace("ID", "").strip().title()
-            else:
-                opt_name = key.replace("_", " ").title()
-            print(f"{i}. {opt_name}")
+            print(f"{i}. {describe(key).label}")
         
         while True:
             choice = input("Select one or multiple (comma-separated, e.g., 1,3): ").strip()
@@ -368,49 +899,57 @@ def main():
     print("I can help you fill out your information in PDF documents quickly and accurately.")
     
     while True:
-        start_choice = input("Would you like to get started now? (yes/no): ").strip().lower()
-        if start_choice in ["yes", "y", "sure", "absolutely"]:
+        start_choice = classify_intent(input("Would you like to get started now? (yes/no): "),
+                                       expect=("confirm", "start", "decline"))
+        if start_choice and start_choice.name in ("confirm", "start"):
             break
-        elif start_choice in ["no", "n", "nope", "not now"]:
-            print("Thank you for visiting. Goodbye!")
+        elif start_choice:
+            print(GOODBYE_REPLY)
             return
         else:
             print("Oops! I didn't get that. Could you please provide the details once more?")
     
     session_folder = create_session_folder()
+    session_name = os.path.basename(session_folder)
     live_fill_file = os.path.join(session_folder, "live_fill.json")
-    log_file = os.path.join(session_folder, "log.json")
+    log_file = os.path.join(session_folder, "log.jsonl")
+    # live_fill.json is a snapshot; every change is appended to log.jsonl (see event_log.py).
+    # Snapshots and the final upload are written in the background
+    session_sink = LocalSessionSink(root=os.path.dirname(session_folder))
+    output_sink = S3SessionSink(bucket="chatbot-outputs", prefix="")
     
     form_keys = load_json_from_s3("chatbot-static-configs", "form_keys.json")
     mandatory_master = load_json_from_s3("chatbot-static-configs", "mandatory.json")
 
     live_fill = form_keys.copy()
-    save_json(live_fill_file, live_fill)
+    session_sink.write(f"{session_name}/live_fill.json", live_fill)
     
-    logs = []
-    chat_history = ""
+    # Imported here: only the CLI keeps an event log, and event_log.py is not in the Lambda zip
+    from event_log import EventLog
+    logs = EventLog(log_file)
+    memory = ConversationMemory()
     
     # ============ PHASE 1: Select Investor Type ============
-    print("\nGreat! Could you tell me what type of investor category best describes you?")
+    print(f"\n{ASK_INVESTOR_TYPE_REPLY}")
     
     mandatory_data = mandatory_master.get("Type of Investors", {})
     investor_list = list(mandatory_data.keys())
     
     if not investor_list:
         print("❌ No investor types found. Exiting.")
+        session_sink.flush()
         return
     
     for idx, t in enumerate(investor_list, start=1):
         print(f"{idx}. {t}")
     
     choice = input("\nEnter Investor Type (number or name): ").strip()
-    if choice.isdigit() and 1 <= int(choice) <= len(investor_list):
-        investor_type = investor_list[int(choice) - 1]
-    else:
-        investor_type = choice
+    selected = classify_intent(choice, investor_list, expect=("investor_type",))
+    investor_type = selected.value if selected else choice
     
     if investor_type not in mandatory_data:
         print("❌ Invalid type. Exiting.")
+        session_sink.flush()
         return
     
     print(f"\nAlright, let's get started! Please enter the details you'd like to fill in the PDF.")
@@ -418,10 +957,12 @@ def main():
     logs.append({"investor_type": investor_type})
     
     live_fill_flat = flatten_dict(live_fill)
-    mandatory_flat = resolve_field_mapping(mandatory_data[investor_type], live_fill_flat)
+    schema = CompiledSchema(live_fill_flat, mandatory_master)
+    mandatory_flat = schema.mandatory_fields(investor_type)
     
     if not mandatory_flat:
         print("⚠️ Warning: No valid mandatory fields found after mapping!")
+        session_sink.flush()
         return
     
     # ============ PHASE 2: Conversational Information Gathering ============
@@ -433,41 +974,52 @@ def main():
         if not user_input:
             continue
         
-        chat_history += f"User: {user_input}\n"
-        
-        extracted = llm_extract(user_input, chat_history, live_fill_flat)
-        if not extracted:
-            extracted = fallback_extract(user_input, live_fill_flat)
-            logs.append({"extraction_method": "fallback", "result": extracted})
-        else:
-            logs.append({"extraction_method": "llm", "result": extracted})
+        # "No" / "That's all" ends the conversation; other non-data turns get a local reply
+        intent = classify_intent(user_input) if INTENT_ROUTING else None
+        if intent is not None and intent.name == "decline":
+            conversation_active = False
+            print(f"\n{READY_REPLY}\n")
+            continue
         
-        # Validate phone numbers
-        phone_fields = [k for k in (extracted or {}).keys() if "phone" in k.lower() or "telephone" in k.lower()]
-        for phone_key in phone_fields:
-            phone_value = extracted[phone_key]
-            if phone_value and not validate_phone_format(phone_value):
-                print("It looks like your phone number is missing the country code. Please enter it with the code.")
-                logs.append({"validation_error": "phone_missing_country_code", "field": phone_key})
-                del extracted[phone_key]
+        memory.add_user(user_input)
+        memory.set_captured(live_fill_flat)
+        chat_history = memory.render()
         
-        if extracted:
-            deep_update(live_fill_flat, extracted)
-            save_json(live_fill_file, unflatten_dict(live_fill_flat))
-            save_json(log_file, logs)
+        def apply_extracted(extracted, method):
+            logs.append({"extraction_method": method, "result": extracted})
+            
+            # Validate phone numbers
+            phone_fields = [k for k in (extracted or {}).keys() if schema.describe(k).kind == "phone"]
+            for phone_key in phone_fields:
+                phone_value = extracted[phone_key]
+                if phone_value and not validate_phone_format(phone_value):
+                    print("It looks like your phone number is missing the country code. Please enter it with the code.")
+                    logs.append({"validation_error": "phone_missing_country_code", "field": phone_key})
+                    del extracted[phone_key]
+            
+            if extracted:
+                deep_update(live_fill_flat, extracted)
+                logs.append({"update": extracted})
+            return extracted
         
-        missing = get_missing_mandatory_keys(live_fill_flat, mandatory_flat)
-        followup = generate_natural_followup(extracted or {}, len(missing), chat_history)
+        with start_trace("cli_turn") as trace:
+            extracted, method, missing, followup = run_async(
+                extract_and_followup(user_input, chat_history, live_fill_flat, mandatory_flat, apply_extracted,
+                                     schema=schema, intent=intent)
+            )
+        logs.append({"trace": trace.to_dict()})
         
         print(f"\n{followup}")
-        chat_history += f"Bot: {followup}\n"
+        memory.add_bot(followup)
+        if method == "intent":
+            continue
         
-        continue_input = input("→ ").strip().lower()
+        continue_input = classify_intent(input("→ "), expect=("confirm", "decline"))
         
-        if continue_input in ["no", "n", "nope", "done", "that's all", "nothing", "nah", "finish", "not now", "will not"]:
+        if continue_input and continue_input.name == "decline":
             conversation_active = False
-            print("\nAlright! Please enter details in the chat whenever you're ready.\n")
-        elif continue_input in ["yes", "y", "yeah", "sure", "yep", "ok", "okay", "more"]:
+            print(f"\n{READY_REPLY}\n")
+        elif continue_input:
             print()
         else:
             print("\nOops! I didn't get that. Could you please provide the details once more?")
@@ -476,55 +1028,43 @@ def main():
     missing_mandatory = get_missing_mandatory_keys(live_fill_flat, mandatory_flat)
     
     if missing_mandatory:
-        missing_field_names = []
-        for key in missing_mandatory:
-            path_parts = key.split('.')
-            if len(path_parts) >= 2:
-                field_name = path_parts[-2].replace("_", " ").replace("ID", "").strip().title()
-            else:
-                field_name = key.replace("_", " ").title()
-            missing_field_names.append(field_name)
+        missing_field_names = [schema.describe(key).label for key in missing_mandatory]
         
         print("It looks like some mandatory information is missing.")
         print("They are listed below:")
         for i, field in enumerate(missing_field_names, start=1):
             print(f"{i}. {field}")
         
-        collect_choice = input("\nWould you like to provide them now? (yes/no): ").strip().lower()
+        collect_choice = classify_intent(input("\nWould you like to provide them now? (yes/no): "),
+                                         expect=("confirm", "decline"))
         
-        if collect_choice in ["yes", "y", "sure", "absolutely"]:
-            text_fields, grouped_booleans = classify_mandatory_fields(missing_mandatory)
+        if collect_choice and collect_choice.name == "confirm":
+            text_fields, grouped_booleans = classify_mandatory_fields(missing_mandatory, schema)
             
             if text_fields:
-                filled_text = ask_text_fields_sequential(text_fields, live_fill_flat, logs)
+                filled_text = ask_text_fields_sequential(text_fields, live_fill_flat, logs, schema)
                 deep_update(live_fill_flat, filled_text)
-                save_json(live_fill_file, unflatten_dict(live_fill_flat))
-                save_json(log_file, logs)
+                logs.append({"update": filled_text})
             
             if grouped_booleans:
                 complete_grouped_booleans = defaultdict(list)
                 for group_name in grouped_booleans.keys():
-                    complete_grouped_booleans[group_name] = get_all_boolean_fields_in_group(group_name, live_fill_flat)
+                    complete_grouped_booleans[group_name] = get_all_boolean_fields_in_group(group_name, live_fill_flat, schema)
                 
-                filled_booleans = ask_grouped_boolean_fields(complete_grouped_booleans, logs)
+                filled_booleans = ask_grouped_boolean_fields(complete_grouped_booleans, logs, schema)
                 deep_update(live_fill_flat, filled_booleans)
-                save_json(live_fill_file, unflatten_dict(live_fill_flat))
-                save_json(log_file, logs)
+                logs.append({"update": filled_booleans})
     
     # ============ PHASE 4: Final Message ============
+    logs.close()
+    session_sink.write(f"{session_name}/live_fill.json", unflatten_dict(live_fill_flat))
     output_data = {
         "live_fill": unflatten_dict(live_fill_flat),
-        "logs": logs
+        "logs": logs.events
     }
 
-    output_key = f"{session_folder.split('/')[-1]}/final_output.json"
-    s3.put_object(
-        Bucket="chatbot-outputs",
-        Key=output_key,
-        Body=json.dumps(output_data, indent=4),
-        ContentType="application/json"
-    )
-    print(f"✅ Uploaded final output to S3: s3://chatbot-outputs/{output_key}")
+    output_key = f"{session_name}/final_output.json"
+    output_sink.write(output_key, output_data)
 
     print("\nAll set! Your PDF is ready. You can add more details or fill another form anytime.")
     
@@ -532,5 +1072,9 @@ def main():
     print(f"📄 Live JSON: {live_fill_file}")
     print(f"📝 Log file: {log_file}")
 
+    session_sink.flush()
+    if output_sink.flush() and not output_sink.stats["errors"]:
+        print(f"✅ Uploaded final output to S3: {output_sink.location(output_key)}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
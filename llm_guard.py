@@ -0,0 +1,309 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ------------------- Config -------------------
+# Seconds one chat turn may spend waiting on OpenAI (extraction + follow-up together)
+LLM_TURN_DEADLINE_S = float(os.getenv("LLM_TURN_DEADLINE_S", "20"))
+# Share of what is left that extraction gets when an LLM follow-up still has to run after it
+LLM_EXTRACT_SHARE = float(os.getenv("LLM_EXTRACT_SHARE", "0.6"))
+# A call is not started with less than this left; the local fallback answers instead
+LLM_MIN_CALL_S = float(os.getenv("LLM_MIN_CALL_S", "0.5"))
+# Per-request timeout and SDK retries of the ChatOpenAI clients (the backstop for sync callers)
+LLM_REQUEST_TIMEOUT_S = float(os.getenv("LLM_REQUEST_TIMEOUT_S", "15"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+# Time a Lambda invocation keeps after the LLM calls (save, serialize, sink flush)
+LAMBDA_RESERVE_S = float(os.getenv("LAMBDA_RESERVE_S", "5"))
+# Hedged extraction: when the first request is slower than the observed p95, send a
+# second one and take whichever answers first ("1" to enable; costs the extra calls)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes", "on")
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_LATENCY_WINDOW = 200
+# Circuit breaker: open after this many consecutive failed/timed-out calls, and
+# send one probe request after the cooldown
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN_S = float(os.getenv("BREAKER_COOLDOWN_S", "30"))
+
+current_deadline = ContextVar("current_deadline", default=None)
+
+
+class LLMUnavailable(Exception):
+    """The call was not made: the circuit is open or the turn's budget is spent"""
+
+
+# ------------------- Deadline -------------------
+class Deadline:
+    """Absolute end of a turn's LLM budget"""
+
+    __slots__ = ("budget", "expires")
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def share(self, fraction: float):
+        return self.remaining() * fraction
+
+
+def turn_budget(context=None):
+    """LLM budget of one turn: LLM_TURN_DEADLINE_S, capped by what the Lambda invocation has left"""
+    budget = LLM_TURN_DEADLINE_S
+    remaining_ms = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining_ms is not None:
+        budget = min(budget, max(0.0, remaining_ms() / 1000 - LAMBDA_RESERVE_S))
+    return budget
+
+
+@contextmanager
+def turn_deadline(budget: float = None):
+    """Make a Deadline current for one turn (extract_and_followup starts its own otherwise)"""
+    token = current_deadline.set(Deadline(LLM_TURN_DEADLINE_S if budget is None else budget))
+    try:
+        yield current_deadline.get()
+    finally:
+        current_deadline.reset(token)
+
+
+def get_deadline():
+    return current_deadline.get() or Deadline(LLM_TURN_DEADLINE_S)
+
+
+# ------------------- Circuit breaker -------------------
+class CircuitBreaker:
+    """
+    closed: calls go through. open: after `failures` consecutive failures every call
+    is refused for `cooldown` seconds. half_open: one probe call is let through; its
+    success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN_S):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self.probing = False
+
+    def available(self):
+        """Whether a call could go through now (does not claim the half-open probe)"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self.probing
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive = 0
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.state == "half_open" or self.consecutive >= self.failures:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self):
+        """A call was abandoned without an outcome (cancelled)"""
+        with self._lock:
+            self.probing = False
+
+    def reset(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive = 0
+            self.opened = 0
+            self.probing = False
+
+
+# ------------------- Guard -------------------
+class LLMGuard:
+    """
+    Every turn-path OpenAI call goes through call(): refused while the circuit is
+    open or the turn's budget is spent (LLMUnavailable, so the caller's local
+    fallback answers), cut off at its timeout, optionally hedged, and counted.
+    Latencies of successful calls are kept per call name for the hedge delay.
+    """
+
+    def __init__(self, breaker: CircuitBreaker = None, hedge: bool = LLM_HEDGE,
+                 hedge_quantile: float = LLM_HEDGE_QUANTILE, hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                 min_call_s: float = LLM_MIN_CALL_S):
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.min_call_s = min_call_s
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.stats = {"calls": 0, "successes": 0, "errors": 0, "timeouts": 0, "short_circuits": 0,
+                      "budget_skips": 0, "hedges": 0, "hedge_wins": 0}
+
+    def available(self):
+        return self.breaker.available()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _observe(self, name: str, seconds: float):
+        with self._lock:
+            window = self.latencies.get(name)
+            if window is None:
+                window = self.latencies[name] = deque(maxlen=LLM_LATENCY_WINDOW)
+            window.append(seconds)
+
+    def quantile(self, name: str, q: float):
+        """Latency quantile (s) of recent successful `name` calls, or None without samples"""
+        window = sorted(self.latencies.get(name, ()))
+        if not window:
+            return None
+        return window[min(len(window) - 1, int(q * len(window)))]
+
+    def hedge_delay(self, name: str):
+        if len(self.latencies.get(name, ())) < self.hedge_min_samples:
+            return None
+        return self.quantile(name, self.hedge_quantile)
+
+    def _admit(self, name: str, timeout: float):
+        if timeout < self.min_call_s:
+            self._count("budget_skips")
+            raise LLMUnavailable(f"{name}: {timeout:.2f}s left")
+        if not self.breaker.allow():
+            self._count("short_circuits")
+            raise LLMUnavailable(f"{name}: circuit open")
+        self._count("calls")
+
+    async def call(self, name: str, attempt, timeout: float, hedge: bool = False):
+        """
+        Await attempt() (a coroutine factory, so a hedge can start a second request)
+        within `timeout` seconds. Raises LLMUnavailable when the call is not made,
+        asyncio.TimeoutError when it runs out of time, or the call's own exception.
+        """
+        self._admit(name, timeout)
+        start = time.monotonic()
+        try:
+            if hedge and self.hedge:
+                result = await self._hedged(name, attempt, timeout)
+            else:
+                result = await asyncio.wait_for(attempt(), timeout)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            self.breaker.failure()
+            raise
+        except Exception:
+            self._count("errors")
+            self.breaker.failure()
+            raise
+        self._count("successes")
+        self.breaker.success()
+        self._observe(name, time.monotonic() - start)
+        return result
+
+    async def stream(self, name: str, chunks, timeout: float):
+        """call() for a streamed answer: yields the chunks of chunks() (an async iterator factory) until `timeout`"""
+        self._admit(name, timeout)
+        start = time.monotonic()
+        iterator = chunks().__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), max(0.0, start + timeout - time.monotonic()))
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            self.breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            self.breaker.failure()
+            raise
+        except Exception:
+            self._count("errors")
+            self.breaker.failure()
+            raise
+        self._count("successes")
+        self.breaker.success()
+        self._observe(name, time.monotonic() - start)
+
+    async def _hedged(self, name: str, attempt, timeout: float):
+        delay = self.hedge_delay(name)
+        first = asyncio.ensure_future(attempt())
+        if delay is None or delay >= timeout:
+            return await asyncio.wait_for(first, timeout)
+        expires = time.monotonic() + timeout
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self._count("hedges")
+                pending.add(asyncio.ensure_future(attempt()))
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self._count("hedge_wins")
+                        return task.result()
+                    if not pending:
+                        raise task.exception()
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, expires - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def metrics(self):
+        calls = self.stats["calls"]
+        refused = self.stats["short_circuits"] + self.stats["budget_skips"]
+        p95 = {name: round(self.quantile(name, 0.95) * 1000, 1) for name in self.latencies}
+        return {
+            **self.stats,
+            "breaker_state": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+            "timeout_rate": round(self.stats["timeouts"] / calls, 4) if calls else 0.0,
+            "error_rate": round(self.stats["errors"] / calls, 4) if calls else 0.0,
+            "refused_rate": round(refused / (calls + refused), 4) if calls + refused else 0.0,
+            "p95_ms": p95,
+        }
+
+    def clear(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+            self.latencies.clear()
+        self.breaker.reset()
+
+
+llm_guard = LLMGuard()
@@ -0,0 +1,289 @@
+"""
+Concurrent load test for one warm worker.
+
+Runs many onboarding sessions at once on one asyncio loop against the turn
+pipeline used by lambda_handler and the streaming app (main.aprocess_turn).
+Each virtual user replays flow.txt-style conversations: a first message with a
+phone number lacking its country code, the corrected phone, a "Yes" (answered by
+the local intent layer), a company name, and then the scripted mandatory-field
+turns from benchmark.py. It cycles through the
+investor types and pauses for --think-ms between turns.
+LLM calls are faked with a configurable latency distribution and error rate; S3 is stubbed.
+
+    python load_test.py                                    # 1,10,50,100,200,400 users, 20 s each
+    python load_test.py --users 100,300 --duration 30 --llm-latency lognormal:900:0.5
+    python load_test.py --llm-latency fixed:0 --users 1,2,4  # CPU-bound ceiling
+    python load_test.py --users 50 --llm-latency lognormal:2000:1 --turn-deadline-s 3 --hedge
+    python load_test.py --users 50 --llm-error-rate 0.5     # degraded provider: circuit breaker
+
+For every concurrency level it reports throughput, latency percentiles and the
+RSS/traced memory over time and how the LLM calls fared (timeouts, errors,
+calls refused by the circuit breaker, hedges), then marks where throughput stops scaling and
+prints Lambda sizing hints (memory from peak RSS, concurrency via Little's law).
+"""
+import argparse
+import asyncio
+import gc
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import benchmark
+
+FLOW_MESSAGES = (
+    "deew@gmail.com, my name is dewaang, my telephone number is 987654321",
+    "+91-9876543210",
+    "Yes",
+    "company - abc corp",
+)
+
+
+# ------------------- Fake LLM latency -------------------
+def parse_latency(spec: str):
+    """
+    "fixed:800", "normal:800:150" (mean, stdev ms) or "lognormal:800:0.5"
+    (mean ms, sigma) -> function returning one delay in seconds
+    """
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda: params[0] / 1000
+    if kind == "normal":
+        mean, stdev = params
+        return lambda: max(0.0, random.gauss(mean, stdev)) / 1000
+    if kind == "lognormal":
+        mean, sigma = params
+        mu = math.log(mean) - sigma ** 2 / 2 if mean > 0 else 0.0
+        return lambda: (random.lognormvariate(mu, sigma) if mean > 0 else 0.0) / 1000
+    raise SystemExit(f"Unknown latency distribution: {spec}")
+
+
+class LatencyChatModel(benchmark.ScriptedChatModel):
+    """ScriptedChatModel whose delays come from a latency distribution"""
+
+    delay: object = None
+
+    def _delay(self):
+        return self.delay()
+
+
+# ------------------- Memory -------------------
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+async def sample_memory(timeline: list, started: float, interval: float):
+    while True:
+        traced = tracemalloc.get_traced_memory()[0] / 2 ** 20 if tracemalloc.is_tracing() else None
+        timeline.append({"t_s": round(time.perf_counter() - started, 2), "rss_mb": round(rss_mb(), 1),
+                         "traced_mb": round(traced, 2) if traced is not None else None})
+        await asyncio.sleep(interval)
+
+
+# ------------------- Virtual users -------------------
+async def virtual_user(user_id: int, conversations: list, deadline: float, think_s: float, stats: dict,
+                       turn_deadline_s: float = None):
+    import main
+    from llm_guard import turn_deadline
+    from turn_trace import start_trace
+
+    n = user_id
+    while time.perf_counter() < deadline:
+        investor_type, messages = conversations[n % len(conversations)]
+        n += 1
+        session = {}
+        for message in messages:
+            if time.perf_counter() >= deadline:
+                return
+            body = {"user_message": message, **(session or {"investor_type": investor_type})}
+            start = time.perf_counter()
+            try:
+                with start_trace("load_turn"), turn_deadline(turn_deadline_s):
+                    response = await main.aprocess_turn(body)
+            except Exception as e:
+                stats["errors"] += 1
+                stats["last_error"] = repr(e)
+                break
+            stats["latencies_ms"].append((time.perf_counter() - start) * 1000)
+            session = {"session_id": response["session_id"]}
+            if think_s:
+                await asyncio.sleep(random.expovariate(1 / think_s))
+            else:
+                # Turns that never wait (rules only, circuit open) would otherwise hold the
+                # loop and push the other users' LLM deadlines back
+                await asyncio.sleep(0)
+        else:
+            stats["sessions_completed"] += 1
+
+
+async def run_level(users: int, duration: float, conversations: list, think_s: float, sample_s: float,
+                    turn_deadline_s: float = None):
+    from llm_guard import llm_guard
+
+    llm_guard.clear()
+    stats = {"latencies_ms": [], "errors": 0, "sessions_completed": 0}
+    timeline = []
+    started = time.perf_counter()
+    sampler = asyncio.ensure_future(sample_memory(timeline, started, sample_s))
+    deadline = started + duration
+    await asyncio.gather(*(virtual_user(i, conversations, deadline, think_s, stats, turn_deadline_s)
+                           for i in range(users)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    timeline.append({"t_s": round(elapsed, 2), "rss_mb": round(rss_mb(), 1),
+                     "traced_mb": round(tracemalloc.get_traced_memory()[0] / 2 ** 20, 2)
+                     if tracemalloc.is_tracing() else None})
+
+    latencies = stats["latencies_ms"]
+    rss = [point["rss_mb"] for point in timeline]
+    return {
+        "users": users,
+        "turns": len(latencies),
+        "throughput_turns_per_s": round(len(latencies) / elapsed, 2),
+        "latency_ms": benchmark.summarize(latencies),
+        "sessions_completed": stats["sessions_completed"],
+        "errors": stats["errors"],
+        "last_error": stats.get("last_error"),
+        "rss_start_mb": rss[0],
+        "rss_peak_mb": max(rss),
+        "rss_growth_mb_per_min": round((rss[-1] - rss[0]) / elapsed * 60, 2),
+        "llm_guard": llm_guard.metrics(),
+        "timeline": timeline,
+    }
+
+
+async def warm_up(conversations: list):
+    """One pass over every conversation so lazy imports (spaCy etc.) and caches are not measured"""
+    import main
+
+    for investor_type, messages in conversations:
+        session = {"investor_type": investor_type}
+        for message in messages:
+            response = await main.aprocess_turn({"user_message": message, **session})
+            session = {"session_id": response["session_id"]}
+
+
+def build_conversations(schema, transcripts: dict):
+    return [(investor_type, list(FLOW_MESSAGES) + messages[1:]) for investor_type, messages in transcripts.items()]
+
+
+def saturation_point(levels: list, threshold: float = 0.1):
+    """First level whose throughput is within `threshold` of the previous one"""
+    for previous, level in zip(levels, levels[1:]):
+        if level["throughput_turns_per_s"] < previous["throughput_turns_per_s"] * (1 + threshold):
+            return previous
+    return None
+
+
+def sizing_hints(levels: list):
+    """
+    A Lambda environment serves one request at a time, so its memory and turn time
+    come from the least concurrent level; the peak over all levels sizes a
+    long-running (streaming app) worker instead.
+    """
+    single = levels[0]
+    mean_s = single["latency_ms"]["mean"] / 1000
+    return {
+        "lambda_rss_mb": single["rss_peak_mb"],
+        "suggested_lambda_memory_mb": max(128, int(math.ceil(single["rss_peak_mb"] * 1.5 / 64)) * 64),
+        "worker_peak_rss_mb": max(level["rss_peak_mb"] for level in levels),
+        # Little's law: concurrent environments = arrival rate x turn duration
+        "lambda_concurrency_per_10_turns_per_s": max(1, math.ceil(10 * mean_s)),
+        "mean_turn_s": round(mean_s, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1,10,50,100,200,400", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--llm-latency", default="lognormal:800:0.4",
+                        help="fixed:MS | normal:MEAN:STDEV | lognormal:MEAN:SIGMA")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of fake LLM calls that fail")
+    parser.add_argument("--turn-deadline-s", type=float, help="LLM budget per turn (default LLM_TURN_DEADLINE_S)")
+    parser.add_argument("--hedge", action="store_true", help="hedge slow extraction calls (LLM_HEDGE)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a user's turns")
+    parser.add_argument("--sample-s", type=float, default=1.0, help="memory sampling interval")
+    parser.add_argument("--tracemalloc", action="store_true", help="also track Python heap (slower)")
+    parser.add_argument("--cache", action="store_true", help="keep the extraction cache on (replayed "
+                                                             "messages repeat, so it hides LLM latency)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    import main as handler
+    import llm_guard
+    from extraction_cache import extraction_cache
+
+    random.seed(args.seed)
+    benchmark.install_stubs({})
+    schema = handler.load_compiled_schema()
+    transcripts, answers = benchmark.build_transcripts(schema)
+    benchmark.install_stubs(answers)
+    import live_fill_2
+    model = LatencyChatModel(answers=answers, delay=parse_latency("fixed:0"))
+    live_fill_2.llm_extraction = model
+    live_fill_2.llm_conversation = model
+    if not args.cache:
+        extraction_cache.max_entries = 0
+
+    conversations = build_conversations(schema, transcripts)
+    asyncio.run(warm_up(conversations))
+    model.delay = parse_latency(args.llm_latency)
+    model.error_rate = args.llm_error_rate
+    llm_guard.llm_guard.hedge = args.hedge
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    levels = []
+    print(f"LLM latency {args.llm_latency}, error rate {args.llm_error_rate:.0%}, think {args.think_ms} ms, "
+          f"{args.duration:.0f} s per level")
+    print(f"{'users':>6} {'turns/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+          f"{'RSS MB':>8} {'peak MB':>8} {'MB/min':>7} {'errors':>6} {'LLM t/o':>7} {'LLM err':>7} "
+          f"{'refused':>7} {'hedges':>6}")
+    for users in [int(u) for u in args.users.split(",")]:
+        gc.collect()
+        level = asyncio.run(run_level(users, args.duration, conversations, args.think_ms / 1000, args.sample_s,
+                                      args.turn_deadline_s))
+        levels.append(level)
+        latency = level["latency_ms"]
+        guard = level["llm_guard"]
+        print(f"{users:>6} {level['throughput_turns_per_s']:>9.1f} {latency['p50']:>9.1f} {latency['p95']:>9.1f} "
+              f"{latency['p99']:>9.1f} {latency['max']:>9.1f} {level['rss_start_mb']:>8.1f} "
+              f"{level['rss_peak_mb']:>8.1f} {level['rss_growth_mb_per_min']:>7.1f} {level['errors']:>6} "
+              f"{guard['timeouts']:>7} {guard['errors']:>7} {guard['short_circuits'] + guard['budget_skips']:>7} "
+              f"{guard['hedges']:>6}")
+        if level["last_error"]:
+            print(f"       last error: {level['last_error']}")
+
+    knee = saturation_point(levels)
+    hints = sizing_hints(levels)
+    print()
+    if knee:
+        print(f"Throughput stops scaling at ~{knee['users']} concurrent users "
+              f"({knee['throughput_turns_per_s']} turns/s, p95 {knee['latency_ms']['p95']} ms)")
+    else:
+        print("Throughput still scaling at the highest level; try more users")
+    print(f"Lambda (one request per environment, {levels[0]['users']} user level): peak RSS {hints['lambda_rss_mb']} MB "
+          f"-> memory >= {hints['suggested_lambda_memory_mb']} MB; mean turn {hints['mean_turn_s']} s "
+          f"-> ~{hints['lambda_concurrency_per_10_turns_per_s']} concurrent environments per 10 turns/s")
+    print(f"Single async worker (streaming app): peak RSS {hints['worker_peak_rss_mb']} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "levels": levels, "saturation_users": knee["users"] if knee else None,
+                       "sizing": hints}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,26 @@
 import json
 import os
-import boto3
-from live_fill_final import (
+import uuid
+from config_cache import config_cache
+from http_pool import run_async
+from conversation_memory import ConversationMemory
+from intent_classifier import INTENT_ROUTING, classify_intent
+from llm_guard import turn_budget, turn_deadline
+from schema_index import FillState, compile_schema, get_compiled_schema
+from session_state import RESPONSE_MODES, changed_fields, expand_sparse, remap_sparse, sparse_fields
+from session_sink import SESSION_SINK_FLUSH_TIMEOUT, get_session_sink
+from session_store import SessionConflict, get_session_store
+from turn_trace import TRACE_DEBUG, start_trace, trace_set, trace_stage
+from live_fill_2 import (
+    ASK_INVESTOR_TYPE_REPLY,
+    GOODBYE_REPLY,
+    GREETING_REPLY,
     load_json,
-    save_json,
+    new_session_name,
     flatten_dict,
     unflatten_dict,
-    resolve_field_mapping,
-    llm_extract,
-    fallback_extract,
     deep_update,
-    get_missing_mandatory_keys,
-    generate_natural_followup,
+    extract_and_followup,
     validate_phone_format,
 )
 from dotenv import load_dotenv
@@ -22,131 +31,350 @@ S3_STATIC_BUCKET = "chatbot-static-configs"
 FORM_KEYS_FILE = "form_keys.json"
 MANDATORY_FILE = "mandatory.json"
 
-s3 = boto3.client("s3")
-
 
 def load_json_from_s3(bucket, key):
-    """Load JSON from S3 into Python dict"""
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    return json.loads(obj["Body"].read().decode("utf-8"))
+    """Load JSON from S3 into Python dict (cached across warm invocations)"""
+    return config_cache.get(bucket, key)
 
 
-def create_lambda_session_folder(root="/tmp/chatbot_sessions"):
-    """Lambda-compatible session folder creation"""
-    import uuid
-    import datetime
-    session_name = datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + str(uuid.uuid4())[:8]
-    session_folder = os.path.join(root, session_name)
-    os.makedirs(session_folder, exist_ok=True)
-    return session_folder
+def load_compiled_schema():
+    """Load both configs (cached) and return the CompiledSchema for their current version"""
+    form_keys = load_json_from_s3(S3_STATIC_BUCKET, FORM_KEYS_FILE)
+    mandatory_master = load_json_from_s3(S3_STATIC_BUCKET, MANDATORY_FILE)
+    version = (
+        config_cache.version(S3_STATIC_BUCKET, FORM_KEYS_FILE),
+        config_cache.version(S3_STATIC_BUCKET, MANDATORY_FILE),
+    )
+    schema = get_compiled_schema(version)
+    if schema is None:
+        with trace_stage("schema_compile"):
+            schema = compile_schema(flatten_dict(form_keys), mandatory_master, version)
+    return schema
 
 
-def lambda_handler(event, context):
-    """
-    AWS Lambda entry point for the Smart Form Chatbot.
-    Expects JSON payload:
-    {
-        "investor_type": "Individual Investor",
-        "user_message": "Hi, I'm John. My email is john@example.com",
-        "chat_history": "previous conversation text",
-        "session_data": {}  # Optional: existing live_fill data
+# 🔹 Session documents are written off the request path (local /tmp or S3, see session_sink.py)
+session_sink = get_session_sink()
+
+# 🔹 Server-side sessions for clients that only send a session_id (see session_store.py)
+session_store = get_session_store()
+
+
+class TurnRequestError(Exception):
+    """Invalid chat turn request; carries the HTTP status and error body"""
+
+    def __init__(self, payload, status=400):
+        super().__init__(payload.get("error", ""))
+        self.payload = payload
+        self.status = status
+
+
+def parse_event(event):
+    """Request body from an API Gateway / function URL event or a direct invocation"""
+    if "body" in event:
+        return json.loads(event["body"])
+    return event
+
+
+def start_reply(intent, user_input, chat_history, schema):
+    """Response to a greeting / start / decline sent before an investor type is chosen (no session yet)"""
+    if intent.name == "greeting":
+        followup = GREETING_REPLY
+    elif intent.name == "decline":
+        followup = GOODBYE_REPLY
+    else:
+        followup = ASK_INVESTOR_TYPE_REPLY
+
+    memory = ConversationMemory.from_transcript(chat_history)
+    memory.add_user(user_input)
+    memory.add_bot(followup)
+    reply = {
+        "method": "intent",
+        "intent": intent.name,
+        "followup_question": followup,
+        "chat_history": memory.render(),
     }
+    if followup == ASK_INVESTOR_TYPE_REPLY:
+        reply["available_types"] = list(schema.investor_types)
+    return reply
+
+
+def prepare_turn(body):
+    """
+    Validate a chat turn request and load everything the turn needs: compiled schema,
+    mandatory fields, flattened session state and bounded history.
+    Before an investor type is known, "Individual" (or "2") selects it and greetings /
+    "yes" / "no" return {"reply": response} without a session.
+    Raises TurnRequestError for invalid requests.
     """
+    user_input = body.get("user_message", "")
+    existing_session_data = body.get("session_data", None)
+    session_fields = body.get("session_fields", None)
 
-    try:
-        # 🔹 Parse incoming data
-        if "body" in event:
-            body = json.loads(event["body"])
+    # 🔹 Clients that hold no state of their own use a stored session (if a store is configured)
+    session_id = body.get("session_id")
+    stored = None
+    if session_store is None:
+        if session_id and existing_session_data is None and session_fields is None:
+            raise TurnRequestError({"error": "Server-side sessions are disabled (SESSION_STORE=none); "
+                                             "send session_data or session_fields"})
+        session_id = None
+    elif existing_session_data is None and session_fields is None:
+        if session_id:
+            with trace_stage("session_load"):
+                stored = session_store.get(session_id)
+            if stored is None and not body.get("investor_type"):
+                raise TurnRequestError({"error": f"Unknown session_id: {session_id}"}, status=404)
         else:
-            body = event
-
-        investor_type = body.get("investor_type", "")
-        user_input = body.get("user_message", "")
-        chat_history = body.get("chat_history", "")
-        existing_session_data = body.get("session_data", None)
-
-        if not investor_type or not user_input:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({
-                    "error": "Missing required fields: 'investor_type' or 'user_message'"
-                })
-            }
+            session_id = uuid.uuid4().hex
+    else:
+        session_id = None
 
-        # 🔹 Setup session folder in /tmp
-        session_folder = create_lambda_session_folder()
-        live_fill_file = os.path.join(session_folder, "live_fill.json")
+    investor_type = stored["investor_type"] if stored else body.get("investor_type", "")
+    chat_history = stored["chat_history"] if stored else body.get("chat_history", "")
+    response_mode = body.get("response_mode") or ("delta" if session_fields is not None or body.get("session_id") else "full")
 
-        # 🔹 Load form keys and mandatory fields from S3
-        form_keys = load_json_from_s3(S3_STATIC_BUCKET, FORM_KEYS_FILE)
-        mandatory_master = load_json_from_s3(S3_STATIC_BUCKET, MANDATORY_FILE)
+    # 🔹 Turns before the investor type is chosen are answered locally (no LLM call)
+    intent = None
+    if not investor_type and user_input and INTENT_ROUTING:
+        with trace_stage("config_load"):
+            schema = load_compiled_schema()
+        with trace_stage("intent_classify"):
+            intent = classify_intent(user_input, schema.investor_types)
+        if intent is not None and intent.name == "investor_type":
+            investor_type = intent.value
+        elif intent is not None:
+            return {"reply": start_reply(intent, user_input, chat_history, schema)}
 
-        # 🔹 Use existing session data or start fresh
-        if existing_session_data:
-            live_fill = existing_session_data
-        else:
-            live_fill = form_keys.copy()
-        
-        live_fill_flat = flatten_dict(live_fill)
-
-        if investor_type not in mandatory_master.get("Type of Investors", {}):
-            return {
-                "statusCode": 400,
-                "body": json.dumps({
-                    "error": f"Invalid investor type: {investor_type}",
-                    "available_types": list(mandatory_master.get("Type of Investors", {}).keys())
-                })
-            }
+    if not investor_type or not user_input:
+        raise TurnRequestError({
+            "error": "Missing required fields: 'investor_type' or 'user_message'"
+        })
 
-        mandatory_data = mandatory_master["Type of Investors"][investor_type]
-        mandatory_flat = resolve_field_mapping(mandatory_data, live_fill_flat)
+    if response_mode not in RESPONSE_MODES:
+        raise TurnRequestError({
+            "error": f"Invalid response_mode: {response_mode}",
+            "available_modes": list(RESPONSE_MODES)
+        })
 
-        # 🔹 Extract info from user message using LLM + fallback
-        extracted = llm_extract(user_input, chat_history, live_fill_flat)
-        if not extracted:
-            extracted = fallback_extract(user_input, live_fill_flat)
-            method = "fallback"
+    # 🔹 Load form keys and the compiled mandatory index (cached per config version)
+    with trace_stage("config_load"):
+        schema = load_compiled_schema()
+
+    mandatory_flat = schema.mandatory_fields(investor_type)
+    if mandatory_flat is None:
+        raise TurnRequestError({
+            "error": f"Invalid investor type: {investor_type}",
+            "available_types": list(schema.investor_types)
+        })
+
+    # 🔹 Use existing session data (sparse or full) or start fresh
+    with trace_stage("session_expand"):
+        dropped_fields = []
+        remapped_fields = {}
+        if session_fields is not None:
+            sparse, sparse_version = session_fields, body.get("schema_version")
+        elif stored:
+            sparse, sparse_version = stored["fields"], stored.get("schema_version")
         else:
-            method = "llm"
+            sparse = sparse_version = None
+        if sparse is not None:
+            # 🔹 Fields saved under another config version: move renamed paths over by field ID
+            if sparse_version and sparse_version != schema.version_tag:
+                trace_set(schema_version_mismatch=True)
+                sparse, remapped_fields = remap_sparse(schema, sparse, sparse_version)
+            live_fill_flat, dropped_fields = expand_sparse(schema, sparse)
+            fill_state = FillState.from_fields(schema, sparse)
+        elif existing_session_data:
+            live_fill_flat = flatten_dict(existing_session_data)
+            fill_state = FillState.from_flat(schema, live_fill_flat)
+        else:
+            live_fill_flat = dict(schema.defaults)
+            fill_state = FillState(schema)
+
+        # 🔹 Bound the client-held history: last N turns verbatim + a captured-fields summary
+        memory = ConversationMemory.from_transcript(chat_history)
+        memory.set_captured(live_fill_flat)
 
+    turn = {
+        "session_id": session_id,
+        "session_version": stored["version"] if stored else 0,
+        "investor_type": investor_type,
+        "user_input": user_input,
+        "chat_history": memory.render(),
+        "memory": memory,
+        "response_mode": response_mode,
+        "schema": schema,
+        "mandatory_flat": mandatory_flat,
+        "live_fill_flat": live_fill_flat,
+        "fill_state": fill_state,
+        "dropped_fields": dropped_fields,
+        "remapped_fields": remapped_fields,
+        "phone_validation_errors": [],
+        "patch": {},
+        "intent": intent,
+    }
+
+    def apply_extracted(extracted, method):
         # 🔹 Validate phone numbers
-        phone_validation_errors = []
-        phone_fields = [k for k in (extracted or {}).keys() if "phone" in k.lower() or "telephone" in k.lower()]
+        phone_fields = [k for k in (extracted or {}).keys() if schema.describe(k).kind == "phone"]
         for phone_key in phone_fields:
             phone_value = extracted[phone_key]
             if phone_value and not validate_phone_format(phone_value):
-                phone_validation_errors.append({
+                turn["phone_validation_errors"].append({
                     "field": phone_key,
                     "value": phone_value,
                     "message": "Phone number missing country code"
                 })
                 del extracted[phone_key]
 
-        # 🔹 Update the live_fill structure
+        # 🔹 Update the live_fill structure (and its filled-field bitset)
+        turn["patch"].update(changed_fields(live_fill_flat, extracted))
         deep_update(live_fill_flat, extracted)
-        updated_live_fill = unflatten_dict(live_fill_flat)
-        save_json(live_fill_file, updated_live_fill)
-
-        # 🔹 Determine missing mandatory fields
-        missing = get_missing_mandatory_keys(live_fill_flat, mandatory_flat)
-        followup = generate_natural_followup(extracted or {}, len(missing), chat_history)
-
-        # 🔹 Prepare final response
-        response_data = {
-            "session_folder": session_folder,
-            "method": method,
-            "extracted_fields": extracted,
-            "missing_mandatory_count": len(missing),
-            "missing_mandatory_fields": missing[:10],
-            "followup_question": followup,
-            "session_data": updated_live_fill,
-            "phone_validation_errors": phone_validation_errors
+        fill_state.update(extracted)
+        return extracted
+
+    turn["apply_extracted"] = apply_extracted
+    return turn
+
+
+def finish_turn(turn, extracted, method, missing, followup):
+    """Persist the session snapshot and build the response body for a finished turn"""
+    schema = turn["schema"]
+    live_fill_flat = turn["live_fill_flat"]
+    response_mode = turn["response_mode"]
+
+    memory = turn["memory"]
+    memory.add_user(turn["user_input"])
+    memory.add_bot(followup)
+    memory.set_captured(live_fill_flat)
+
+    # 🔹 Save the stored session; a concurrent turn that saved first wins
+    session_ids = {}
+    if turn["session_id"]:
+        record = {
+            "session_id": turn["session_id"],
+            "investor_type": turn["investor_type"],
+            "schema_version": schema.version_tag,
+            "fields": sparse_fields(live_fill_flat),
+            "chat_history": memory.render(),
         }
+        try:
+            with trace_stage("session_save"):
+                version = session_store.put(record, turn["session_version"])
+        except SessionConflict:
+            raise TurnRequestError({
+                "error": "Session was updated by another request; retry the message",
+                "session_id": turn["session_id"]
+            }, status=409)
+        session_ids = {"session_id": turn["session_id"], "session_version": version}
+
+    # 🔹 Queue the session snapshot on the session sink (one folder per stored session)
+    session_name = turn["session_id"] or new_session_name()
+    live_fill_key = f"{session_name}/live_fill.json"
+
+    if response_mode == "full":
+        session_payload = {"session_data": unflatten_dict(live_fill_flat)}
+        session_sink.write(live_fill_key, session_payload["session_data"])
+    else:
+        filled = sparse_fields(live_fill_flat)
+        session_sink.write(live_fill_key, {"schema_version": schema.version_tag, "fields": filled})
+        session_payload = {"schema_version": schema.version_tag}
+        if response_mode == "sparse":
+            session_payload["session_fields"] = filled
+        else:
+            session_payload["session_patch"] = turn["patch"]
+        if turn["dropped_fields"]:
+            session_payload["dropped_fields"] = turn["dropped_fields"]
+        if turn["remapped_fields"]:
+            session_payload["remapped_fields"] = turn["remapped_fields"]
+
+    return {
+        **session_ids,
+        "session_folder": session_sink.location(session_name),
+        "method": method,
+        "extracted_fields": extracted,
+        "missing_mandatory_count": len(missing),
+        "missing_mandatory_fields": missing[:10],
+        "followup_question": followup,
+        "chat_history": memory.render(),
+        "phone_validation_errors": turn["phone_validation_errors"],
+        **session_payload
+    }
+
+
+async def aprocess_turn(body):
+    """Run one chat turn and return the response data (raises TurnRequestError)"""
+    turn = prepare_turn(body)
+    if "reply" in turn:
+        return turn["reply"]
+
+    # 🔹 Extract info from user message (LLM + fallback) and generate the follow-up
+    extracted, method, missing, followup = await extract_and_followup(
+        turn["user_input"], turn["chat_history"], turn["live_fill_flat"],
+        turn["mandatory_flat"], turn["apply_extracted"], schema=turn["schema"], intent=turn["intent"],
+        fill_state=turn["fill_state"], investor_type=turn["investor_type"]
+    )
+
+    # 🔹 Prepare final response
+    return finish_turn(turn, extracted, method, missing, followup)
+
+
+def lambda_handler(event, context):
+    """
+    AWS Lambda entry point for the Smart Form Chatbot.
+    Expects JSON payload:
+    {
+        "session_id": "...",  # Optional: continue a stored session (then only user_message is needed)
+        "investor_type": "Individual Investor",  # Required unless session_id names a stored session
+                                                 # or user_message names the type ("Individual", "2")
+        "user_message": "Hi, I'm John. My email is john@example.com",
+        "chat_history": "previous conversation text",  # bounded server-side; echo back the returned one
+        "session_data": {},  # Optional: existing live_fill data (full nested document)
+        "schema_version": "...",  # Optional: with session_fields, the sparse alternative
+        "session_fields": {},  # Optional: only the filled field paths
+        "response_mode": "delta"  # Optional: "full" | "sparse" | "delta"
+    }
+    With a SESSION_STORE configured, a request without session_data/session_fields is stored
+    server-side and the response carries its session_id; later turns only need
+    {"session_id", "user_message"}.
+    response_mode defaults to "delta" when session_fields or session_id is sent and "full" otherwise.
+    "debug": true (or TRACE_DEBUG) adds the per-stage timing/token trace to the response.
+    OpenAI calls get at most LLM_TURN_DEADLINE_S, less when the invocation has less time left.
+    """
+    with start_trace("lambda_turn") as trace, turn_deadline(turn_budget(context)):
+        response = _handle_turn(event, trace)
+        trace.set(status=response["statusCode"])
+        trace.emit()
+        return response
+
+
+def _handle_turn(event, trace):
+    """One chat turn as a Lambda proxy response, recorded on `trace`"""
+    try:
+        # 🔹 Parse and validate incoming data
+        body = parse_event(event)
+        response_data = run_async(aprocess_turn(body))
+        if body.get("debug") or TRACE_DEBUG:
+            response_data["trace"] = trace.to_dict()
+        with trace_stage("serialize"):
+            response_body = json.dumps(response_data, ensure_ascii=False)
+        with trace_stage("sink_flush"):
+            flushed = session_sink.flush(SESSION_SINK_FLUSH_TIMEOUT)
+        if not flushed:
+            # The snapshot is a copy (the session itself is in the request/response or the
+            # session store), so the turn still succeeds; the trace shows the write lagging
+            trace.set(sink_flushed=False)
 
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(response_data, ensure_ascii=False)
+            "body": response_body
+        }
+
+    except TurnRequestError as e:
+        return {
+            "statusCode": e.status,
+            "body": json.dumps(e.payload)
         }
 
     except Exception as e:
@@ -157,4 +385,4 @@ def lambda_handler(event, context):
                 "error": str(e),
                 "traceback": traceback.format_exc()
             })
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,434 @@
+import hashlib
+import math
+import re
+from itertools import compress
+from operator import itemgetter
+
+_schema_cache = {}
+# format(mask, bits_format) digits -> 0/1 bytes, so a mask becomes one flag per path
+_BIT_FLAGS = bytes.maketrans(b"01", b"\x00\x01")
+
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOP_TOKENS = frozenset({
+    "id", "ids", "value", "details", "in", "subscription", "booklet",
+    "ds", "of", "the", "and", "or", "is", "my", "to", "for", "an", "no",
+})
+
+# Message shapes that point at fields even when no field word is used.
+FIELD_HINTS = (
+    (re.compile(r"[\w\.-]+@[\w\.-]+\.\w+"), ("email", "mail")),
+    (re.compile(r"\+?\d[\d\s\-]{7,}\d"), ("telephone", "phone", "fax")),
+    (re.compile(r"\b[A-Z]{2}\d{2}[A-Z0-9]{10,30}\b"), ("iban",)),
+    (re.compile(r"\b[A-Z]{6}[A-Z0-9]{2}([A-Z0-9]{3})?\b"), ("swift",)),
+    (re.compile(r"\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b|\b(19|20)\d{2}-\d{2}-\d{2}\b"), ("dob", "date", "inception")),
+    (re.compile(r"\b\d{5,6}(-\d{4})?\b"), ("zip", "zipcode")),
+    (re.compile(r"[$€£]|\b(usd|eur|gbp)\b", re.IGNORECASE), ("usd", "eur", "gbp")),
+)
+HINT_WEIGHT = 2.0
+_OWNER_TOKENS = frozenset({"investor", "co"})
+
+# Checkbox sections asked as one multiple-choice question instead of field by field
+BOOLEAN_GROUPS = ("Form PF (Investor Type)", "Type of Subscriber", "Share Class")
+
+
+def field_label(path: str):
+    """Human-readable label for a flattened field path ("...investoremail_ID.value" -> "Investoremail")."""
+    path_parts = path.split(".")
+    if len(path_parts) >= 2:
+        return path_parts[-2].replace("_", " ").replace("ID", "").strip().title()
+    return path.replace("_", " ").title()
+
+
+def tokenize(text: str):
+    """Lowercase word tokens, splitting camelCase and snake_case identifiers."""
+    words = _WORD.findall(_CAMEL_BOUNDARY.sub(" ", text).lower())
+    return [w for w in words if len(w) > 1 and w not in _STOP_TOKENS]
+
+
+class FieldDescriptor:
+    """
+    One form field, derived from its dotted path once per schema:
+
+    - field_id: the segment naming the field ("investoremail_ID")
+    - label: short label used by the CLI prompts ("Investoremail")
+    - display_label: mandatory.json label when there is one ("Email IDs"), else label
+    - section: the dotted path above the field ("Details in Subscription Booklet.Address (Registered)")
+    - boolean_group: the BOOLEAN_GROUPS section the field belongs to, or None
+    - kind: "boolean" (checkbox group member), "phone", "email" or "text"
+    - mailing: part of a mailing address (the CLI can copy it from the registered one)
+    """
+
+    __slots__ = ("index", "path", "field_id", "label", "display_label", "section", "boolean_group", "kind",
+                 "mailing", "tokens")
+
+    def __init__(self, path: str, index: int = -1, boolean_group: str = None, display_label: str = None):
+        parts = path.split(".")
+        if parts[-1] == "value" and len(parts) >= 2:
+            parts = parts[:-1]
+        lower = path.lower()
+        self.index = index
+        self.path = path
+        self.field_id = parts[-1]
+        self.label = field_label(path)
+        self.display_label = display_label or self.label
+        self.section = ".".join(parts[:-1])
+        if boolean_group is None:
+            boolean_group = next((g for g in BOOLEAN_GROUPS if g.lower() in lower), None)
+        self.boolean_group = boolean_group or None
+        if boolean_group:
+            self.kind = "boolean"
+        elif "phone" in lower:
+            self.kind = "phone"
+        elif "email" in lower:
+            self.kind = "email"
+        else:
+            self.kind = "text"
+        self.mailing = "mailing" in lower
+        self.tokens = frozenset(tokenize(self.field_id))
+
+    def __repr__(self):
+        return f"FieldDescriptor({self.path!r}, kind={self.kind!r})"
+
+
+class _SegmentTrie:
+    """Trie over dotted path segments. Every suffix of a path is inserted so a
+    section like "Type of Subscriber" is found wherever it sits in the path."""
+
+    __slots__ = ("children", "paths")
+
+    def __init__(self):
+        self.children = {}
+        self.paths = []
+
+    def insert(self, segments, position):
+        for start in range(len(segments)):
+            node = self
+            for seg in segments[start:]:
+                node = node.children.setdefault(seg, _SegmentTrie())
+                if not node.paths or node.paths[-1] != position:
+                    node.paths.append(position)
+
+    def find(self, segments):
+        node = self
+        for seg in segments:
+            node = node.children.get(seg)
+            if node is None:
+                return []
+        return node.paths
+
+
+class CompiledSchema:
+    """
+    form_keys.json + mandatory.json compiled once per config version.
+
+    - field_index: field ID (any run of whole path segments) -> first `.value` path
+    - section_trie: segment trie used to expand section headers to their paths
+    - mandatory: investor type -> resolved mandatory flat dict (precomputed)
+    - defaults: the flattened form_keys document, used as the base for sparse sessions
+    - token_index: token -> {path position: idf weight}, from path words and the
+      human labels in mandatory.json, used to rank fields against a user message
+    - labelled_fields: path -> word sets of the mandatory.json labels mapped to it
+    - display_labels: path -> first mandatory.json label, e.g. "Name (Authorized Signatory)"
+    - fields: FieldDescriptor per path, in form order (field(path) / describe(path))
+    - bitmasks over the path order (bit i = paths[i]): mandatory_masks per investor type,
+      boolean_group_masks per BOOLEAN_GROUPS section and default_filled_mask; see FillState
+
+    Per-turn mandatory resolution is then a dict lookup. The resolved dicts
+    are shared and must be treated as read-only.
+    """
+
+    def __init__(self, form_keys_flat: dict, mandatory_master: dict = None, version=None):
+        self.version = version
+        self.version_tag = hashlib.sha1(repr(version).encode("utf-8")).hexdigest()[:12]
+        self.defaults = dict(form_keys_flat)
+        self.paths = tuple(form_keys_flat.keys())
+        self.position = {path: i for i, path in enumerate(self.paths)}
+        self._lower_paths = tuple(path.lower() for path in self.paths)
+
+        self.field_index = {}
+        self.section_trie = _SegmentTrie()
+        self._lower_segments = {}
+        for i, path in enumerate(self.paths):
+            segments = path.split(".")
+            self.section_trie.insert(segments, i)
+            for seg in segments:
+                self._lower_segments.setdefault(seg.lower(), []).append(i)
+            if path.endswith(".value"):
+                field_segments = segments[:-1]
+                for start in range(len(field_segments)):
+                    for end in range(start + 1, len(field_segments) + 1):
+                        self.field_index.setdefault(".".join(field_segments[start:end]), path)
+
+        investor_types = (mandatory_master or {}).get("Type of Investors", {})
+        self.investor_types = tuple(investor_types.keys())
+        self.mandatory = {t: self.resolve(data) for t, data in investor_types.items()}
+        self.labelled_fields = {}
+        self.display_labels = {}
+        self.token_index = self._build_token_index(investor_types)
+
+        self.all_mask = (1 << len(self.paths)) - 1
+        self.mandatory_masks = {t: self.mask(fields) for t, fields in self.mandatory.items()}
+        # Per investor type: mandatory paths in mandatory.json order, and a getter picking
+        # their flags out of a mask's bit string (most significant first, so bit i is at
+        # len(paths) - 1 - i) in that order, for FillState.missing. The trailing 0 keeps the
+        # getter returning a tuple for single-field types; compress stops at the shorter paths.
+        last = len(self.paths) - 1
+        self._bits_format = f"0{len(self.paths)}b"
+        self._mandatory_paths = {t: tuple(fields) for t, fields in self.mandatory.items()}
+        self._mandatory_flags = {
+            t: itemgetter(*(last - self.position[p] for p in fields), 0) for t, fields in self.mandatory.items()
+        }
+        self.boolean_group_masks = {
+            group: self.mask(p for p, lower in zip(self.paths, self._lower_paths) if group.lower() in lower)
+            for group in BOOLEAN_GROUPS
+        }
+        self.boolean_mask = 0
+        for group_mask in self.boolean_group_masks.values():
+            self.boolean_mask |= group_mask
+        self.default_filled_mask = self.mask(p for p, v in self.defaults.items() if v != "" and v is not None)
+
+        self.fields = tuple(
+            FieldDescriptor(
+                path, i,
+                boolean_group=next((g for g, m in self.boolean_group_masks.items() if m >> i & 1), ""),
+                display_label=self.display_labels.get(path),
+            )
+            for i, path in enumerate(self.paths)
+        )
+
+    def find_field_path(self, field_id: str):
+        if not field_id:
+            return None
+        path = self.field_index.get(field_id)
+        if path is None:
+            # Field IDs that only match part of a segment ("Qualified Purchaser"
+            # vs "Qualified Purchaser Status") still need the substring scan.
+            path = next((p for p in self.paths if field_id in p and p.endswith(".value")), None)
+            self.field_index[field_id] = path
+        return path
+
+    def section_paths(self, parent_key: str, key: str):
+        section_prefix = f"{parent_key}.{key}" if parent_key else key
+        compact = key.replace(" ", "").lower()
+        matches = set(self.section_trie.find(section_prefix.split(".")))
+        matches.update(self._lower_segments.get(compact, ()))
+        if not matches:
+            matches = {
+                i for i, path in enumerate(self.paths)
+                if section_prefix in path or compact in self._lower_paths[i]
+            }
+        return [self.paths[i] for i in sorted(matches)]
+
+    def resolve(self, mandatory_data: dict):
+        resolved = {}
+
+        def process_dict(d, parent_key=""):
+            for key, value in d.items():
+                if isinstance(value, dict):
+                    process_dict(value, key)
+                elif isinstance(value, str) and value:
+                    actual_path = self.find_field_path(value)
+                    if actual_path:
+                        resolved[actual_path] = ""
+                elif value == "":
+                    for path in self.section_paths(parent_key, key):
+                        resolved[path] = ""
+
+        process_dict(mandatory_data)
+        return resolved
+
+    def mandatory_fields(self, investor_type: str):
+        return self.mandatory.get(investor_type)
+
+    def field(self, path: str):
+        return self.fields[self.position[path]]
+
+    def describe(self, path: str):
+        """FieldDescriptor for `path`, also for paths outside this schema (e.g. from client session data)"""
+        i = self.position.get(path)
+        return self.fields[i] if i is not None else FieldDescriptor(path)
+
+    def mask(self, paths):
+        """Bitmask of the given (known) paths"""
+        bits = 0
+        for path in paths:
+            i = self.position.get(path)
+            if i is not None:
+                bits |= 1 << i
+        return bits
+
+    def paths_of(self, mask: int):
+        """Paths whose bits are set in `mask`, in form order"""
+        paths = []
+        while mask:
+            low = mask & -mask
+            paths.append(self.paths[low.bit_length() - 1])
+            mask ^= low
+        return paths
+
+    def classify_fields(self, paths):
+        """(text fields, {boolean group: fields}) like classify_mandatory_fields, from the group masks"""
+        text_fields = []
+        grouped = {}
+        for path in paths:
+            bit = 1 << self.position[path]
+            if not bit & self.boolean_mask:
+                text_fields.append(path)
+                continue
+            group = next(g for g in BOOLEAN_GROUPS if bit & self.boolean_group_masks[g])
+            grouped.setdefault(group, []).append(path)
+        return text_fields, grouped
+
+    def _build_token_index(self, investor_types: dict):
+        aliases = [set(tokenize(path)) for path in self.paths]
+
+        def add_labels(d, parent_key=""):
+            for key, value in d.items():
+                if isinstance(value, dict):
+                    add_labels(value, key)
+                    continue
+                if isinstance(value, str) and value:
+                    path = self.find_field_path(value)
+                    targets = [path] if path else []
+                    if path:
+                        self.labelled_fields.setdefault(path, []).append(frozenset(tokenize(key)))
+                        self.display_labels.setdefault(path, f"{key} ({parent_key})" if parent_key else key)
+                else:
+                    targets = self.section_paths(parent_key, key)
+                label_tokens = tokenize(f"{parent_key} {key}")
+                for path in targets:
+                    aliases[self.position[path]].update(label_tokens)
+
+        for data in investor_types.values():
+            add_labels(data)
+
+        # Field IDs like "investoremail_ID" glue words together; index any known
+        # label word found inside a longer path token as well.
+        vocabulary = {t for tokens in aliases for t in tokens if len(t) >= 4}
+        for tokens in aliases:
+            tokens.update({w for t in list(tokens) for w in vocabulary if w != t and w in t})
+
+        postings = {}
+        for i, tokens in enumerate(aliases):
+            for token in tokens:
+                postings.setdefault(token, []).append(i)
+        n = len(self.paths) or 1
+        return {
+            token: dict.fromkeys(positions, math.log(1 + n / len(positions)))
+            for token, positions in postings.items()
+        }
+
+    def label(self, path: str):
+        """Human label for a path: its mandatory.json label when there is one"""
+        return self.describe(path).display_label
+
+    def fields_labelled(self, *words):
+        """`.value` paths, in form order, whose mandatory.json label or own field ID
+        consists only of `words` (ignoring "investor"/"co"): "Name" matches, "Bank Name" does not."""
+        words = set(words)
+        matches = []
+        for field in self.fields:
+            path = field.path
+            if not path.endswith(".value"):
+                continue
+            candidates = self.labelled_fields.get(path, []) + [field.tokens]
+            if any(label - _OWNER_TOKENS and label - _OWNER_TOKENS <= words for label in candidates):
+                matches.append(path)
+        return matches
+
+    def rank_fields(self, message: str, top_k: int):
+        """Top `top_k` field paths most relevant to `message`, best first."""
+        scores = {}
+        tokens = set(tokenize(message))
+        tokens.update(t[:-1] for t in list(tokens) if t.endswith("s") and t[:-1] in self.token_index)
+        for token in tokens:
+            for i, weight in self.token_index.get(token, {}).items():
+                scores[i] = scores.get(i, 0.0) + weight
+        for pattern, hint_tokens in FIELD_HINTS:
+            if pattern.search(message):
+                for token in hint_tokens:
+                    for i in self.token_index.get(token, {}):
+                        scores[i] = scores.get(i, 0.0) + HINT_WEIGHT
+        ranked = sorted(scores, key=lambda i: (-scores[i], i))[:top_k]
+        return [self.paths[i] for i in ranked]
+
+
+class FillState:
+    """
+    Which fields of a session are filled, as one int bitset aligned with
+    schema.paths. Missing / optional-remaining / completion for an investor type
+    are then mask operations instead of dict scans.
+    """
+
+    __slots__ = ("schema", "bits")
+
+    def __init__(self, schema: CompiledSchema, bits: int = None):
+        self.schema = schema
+        self.bits = schema.default_filled_mask if bits is None else bits
+
+    @classmethod
+    def from_flat(cls, schema: CompiledSchema, live_fill_flat: dict):
+        """From a full flattened live_fill document"""
+        return cls(schema, schema.mask(p for p, v in live_fill_flat.items() if v != "" and v is not None))
+
+    @classmethod
+    def from_fields(cls, schema: CompiledSchema, fields: dict):
+        """From sparse fields (only the changed/filled paths) on top of the form defaults"""
+        state = cls(schema)
+        state.update(fields)
+        return state
+
+    def update(self, fields: dict):
+        position = self.schema.position
+        for path, value in fields.items():
+            i = position.get(path)
+            if i is None:
+                continue
+            if value != "" and value is not None:
+                self.bits |= 1 << i
+            else:
+                self.bits &= ~(1 << i)
+        return self
+
+    def is_filled(self, path: str):
+        return bool(self.bits >> self.schema.position[path] & 1)
+
+    def missing_mask(self, investor_type: str):
+        return self.schema.mandatory_masks[investor_type] & ~self.bits
+
+    def missing_count(self, investor_type: str):
+        return self.missing_mask(investor_type).bit_count()
+
+    def missing(self, investor_type: str):
+        """Missing mandatory paths, in mandatory.json order (same as get_missing_mandatory_keys)"""
+        schema = self.schema
+        mask = schema.mandatory_masks[investor_type] & ~self.bits
+        if not mask:
+            return []
+        if mask == schema.mandatory_masks[investor_type]:
+            return list(schema._mandatory_paths[investor_type])
+        flags = format(mask, schema._bits_format).encode("ascii").translate(_BIT_FLAGS)
+        return list(compress(schema._mandatory_paths[investor_type], schema._mandatory_flags[investor_type](flags)))
+
+    def optional_remaining(self, investor_type: str):
+        """Empty paths that are not mandatory for this investor type, in form order"""
+        return self.schema.paths_of(self.schema.all_mask & ~self.schema.mandatory_masks[investor_type] & ~self.bits)
+
+    def completion(self, investor_type: str):
+        """Share of the mandatory fields that are filled (0.0-1.0)"""
+        total = self.schema.mandatory_masks[investor_type].bit_count()
+        return 1.0 if not total else 1 - self.missing_count(investor_type) / total
+
+
+def get_compiled_schema(version):
+    """Return the CompiledSchema cached for this config version, or None."""
+    return _schema_cache.get(version)
+
+
+def compile_schema(form_keys_flat: dict, mandatory_master: dict, version):
+    """Compile and cache the schema for `version`, dropping older versions."""
+    schema = CompiledSchema(form_keys_flat, mandatory_master, version=version)
+    _schema_cache.clear()
+    _schema_cache[version] = schema
+    return schema
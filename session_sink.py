@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ------------------- Config -------------------
+# "local" writes under SESSION_SINK_ROOT, "s3" puts objects in SESSION_SINK_BUCKET
+SESSION_SINK = os.getenv("SESSION_SINK", "local")
+SESSION_SINK_ROOT = os.getenv("SESSION_SINK_ROOT", "/tmp/chatbot_sessions")
+SESSION_SINK_BUCKET = os.getenv("SESSION_SINK_BUCKET", "chatbot-outputs")
+SESSION_SINK_PREFIX = os.getenv("SESSION_SINK_PREFIX", "")
+# Writes to the same key within this window collapse into one
+SESSION_SINK_COALESCE_MS = float(os.getenv("SESSION_SINK_COALESCE_MS", "20"))
+# Size of the shared S3 connection pool (and of the upload thread pool)
+SESSION_SINK_POOL_SIZE = int(os.getenv("SESSION_SINK_POOL_SIZE", "10"))
+# How long lambda_handler waits for pending writes before returning (the
+# container may be frozen right after, stranding them until the next invocation)
+SESSION_SINK_FLUSH_TIMEOUT = float(os.getenv("SESSION_SINK_FLUSH_TIMEOUT", "1"))
+
+logger = logging.getLogger(__name__)
+
+_shared_s3 = None
+_shared_s3_lock = threading.Lock()
+
+
+def shared_s3_client():
+    """One boto3 S3 client (thread-safe, pooled connections) for every S3 sink in the process"""
+    global _shared_s3
+    with _shared_s3_lock:
+        if _shared_s3 is None:
+            import boto3
+            from botocore.config import Config
+            _shared_s3 = boto3.client("s3", config=Config(max_pool_connections=SESSION_SINK_POOL_SIZE))
+        return _shared_s3
+
+
+def dumps_compact(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class SessionSink:
+    """
+    Write-behind store for session documents (live_fill.json, final_output.json, ...).
+
+    write() only records the latest document for a key and returns; a background
+    thread serializes (compact JSON) and stores pending documents, so repeated
+    writes to one key within the coalescing window are stored once. Documents
+    must not be mutated after they are handed to write(). Call flush() before
+    the process (or Lambda invocation) ends if the writes must have landed.
+    """
+
+    def __init__(self, coalesce_ms: float = SESSION_SINK_COALESCE_MS):
+        self.coalesce = coalesce_ms / 1000
+        self._pending = {}
+        self._inflight = 0
+        self._flush_requested = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {"writes": 0, "coalesced": 0, "stored": 0, "errors": 0, "flush_timeouts": 0}
+
+    def location(self, key: str):
+        """Where `key` ends up (path or URI), for logs and responses"""
+        raise NotImplementedError
+
+    def _store(self, key: str, body: bytes):
+        raise NotImplementedError
+
+    def write(self, key: str, data):
+        with self._cond:
+            if key in self._pending:
+                self.stats["coalesced"] += 1
+            self._pending[key] = data
+            self.stats["writes"] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="session-sink", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _store_one(self, item):
+        key, data = item
+        try:
+            self._store(key, dumps_compact(data))
+            return True
+        except Exception as e:
+            logger.warning("Session sink failed to write %s: %s", self.location(key), e)
+            return False
+
+    def _store_batch(self, batch: dict):
+        return [self._store_one(item) for item in batch.items()]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Let more writes coalesce unless someone is waiting in flush()
+                deadline = time.monotonic() + self.coalesce
+                while not self._flush_requested and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                self._flush_requested = False
+                batch, self._pending = self._pending, {}
+                self._inflight = len(batch)
+            results = self._store_batch(batch)
+            with self._cond:
+                self.stats["stored"] += sum(results)
+                self.stats["errors"] += len(results) - sum(results)
+                self._inflight = 0
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = None):
+        """
+        Wait until every pending write is stored; False if `timeout` ran out first (logged
+        and counted in stats["flush_timeouts"]: the writes stay queued until the process
+        runs again, and a frozen Lambda environment may never do so)
+        """
+        with self._cond:
+            if self._pending:
+                self._flush_requested = True
+                self._cond.notify_all()
+            flushed = self._cond.wait_for(lambda: not self._pending and not self._inflight, timeout)
+            if not flushed:
+                self.stats["flush_timeouts"] += 1
+                logger.warning("Session sink flush timed out after %ss with %d write(s) pending",
+                               timeout, len(self._pending) + self._inflight)
+            return flushed
+
+
+class LocalSessionSink(SessionSink):
+    """Files under `root`; each write is atomic (temp file + rename)"""
+
+    def __init__(self, root: str = SESSION_SINK_ROOT, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+
+    def location(self, key: str):
+        return os.path.join(self.root, key)
+
+    def _store(self, key: str, body: bytes):
+        path = self.location(key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+
+class S3SessionSink(SessionSink):
+    """Objects in `bucket` under `prefix`. Pass `client` to use a specific (e.g. moto) client."""
+
+    def __init__(self, bucket: str = SESSION_SINK_BUCKET, prefix: str = SESSION_SINK_PREFIX, client=None, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = client
+        self._pool = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = shared_s3_client()
+        return self._client
+
+    def location(self, key: str):
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+    def _store(self, key: str, body: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=f"{self.prefix}{key}", Body=body,
+                               ContentType="application/json")
+
+    def _store_batch(self, batch: dict):
+        if len(batch) == 1:
+            return super()._store_batch(batch)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=SESSION_SINK_POOL_SIZE, thread_name_prefix="session-sink-s3")
+        return list(self._pool.map(self._store_one, batch.items()))
+
+
+def get_session_sink(kind: str = SESSION_SINK):
+    if kind == "local":
+        return LocalSessionSink()
+    if kind == "s3":
+        return S3SessionSink()
+    raise ValueError(f"Unknown SESSION_SINK: {kind}")
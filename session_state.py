@@ -0,0 +1,60 @@
+"""
+Sparse session representation for lambda_handler.
+
+Instead of the full nested live_fill document (almost entirely empty strings),
+clients may hold only the filled field paths plus the schema version:
+
+    {"schema_version": "3f2a9c01b7de", "fields": {"Details in ...investoremail_ID.value": "a@b.com"}}
+
+Response modes:
+- "full":   nested live_fill document (legacy `session_data`)
+- "sparse": every filled field path
+- "delta":  only the field paths changed by this turn
+"""
+
+RESPONSE_MODES = ("full", "sparse", "delta")
+
+
+def is_filled(value):
+    return not (value == "" or value is None)
+
+
+def sparse_fields(live_fill_flat: dict):
+    """Only the filled field paths of a flattened live_fill document"""
+    return {k: v for k, v in live_fill_flat.items() if is_filled(v)}
+
+
+def expand_sparse(schema, fields: dict):
+    """Rebuild a flattened live_fill document from the schema defaults + sparse fields.
+    Paths unknown to this schema version are dropped and returned separately."""
+    live_fill_flat = dict(schema.defaults)
+    dropped = []
+    for path, value in (fields or {}).items():
+        if path in live_fill_flat:
+            live_fill_flat[path] = value
+        else:
+            dropped.append(path)
+    return live_fill_flat, dropped
+
+
+def remap_sparse(schema, fields: dict, schema_version: str = None):
+    """Fields saved under another schema version (`schema_version` != schema.version_tag),
+    moved onto this version's paths by field ID where the path itself is gone.
+    Returns (fields, {old path: new path}); same-version fields are returned as they are."""
+    if not fields or not schema_version or schema_version == schema.version_tag:
+        return fields, {}
+    moved = {}
+    remapped = {}
+    for path, value in fields.items():
+        if path not in schema.position and path.endswith(".value"):
+            new_path = schema.field_index.get(path.split(".")[-2])
+            if new_path is not None and new_path not in fields:
+                remapped[path] = new_path
+                path = new_path
+        moved[path] = value
+    return moved, remapped
+
+
+def changed_fields(before: dict, updates: dict):
+    """Subset of `updates` whose value differs from `before`"""
+    return {k: v for k, v in updates.items() if before.get(k, "") != v}
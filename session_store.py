@@ -0,0 +1,229 @@
+"""
+Server-side chat sessions keyed by session ID.
+
+A session record is a plain dict:
+
+    {"session_id": "...", "version": 3, "investor_type": "Individual",
+     "schema_version": "3f2a9c01b7de", "fields": {sparse filled fields}, "chat_history": "..."}
+
+Writes are optimistic: put(record, expected_version) only succeeds if the stored
+version is still `expected_version` (0 = the session must not exist yet) and
+raises SessionConflict otherwise, so two concurrent turns of one session cannot
+silently overwrite each other.
+"""
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# ------------------- Config -------------------
+# "none" (default: no server-side sessions, clients send session_data / session_fields),
+# "memory" (one process only; refused in Lambda, where the next turn may land on
+# another container), "sqlite" or "dynamodb"
+SESSION_STORE = os.getenv("SESSION_STORE", "none")
+SESSION_STORES = ("none", "memory", "sqlite", "dynamodb")
+SESSION_STORE_SQLITE = os.getenv("SESSION_STORE_SQLITE", "/tmp/chatbot_sessions.db")
+SESSION_STORE_TABLE = os.getenv("SESSION_STORE_TABLE", "chatbot-sessions")
+# e.g. http://localhost:8000 for DynamoDB Local
+SESSION_STORE_ENDPOINT = os.getenv("SESSION_STORE_ENDPOINT", "")
+# Seconds until an idle session expires (DynamoDB: the "expires_at" TTL attribute); 0 = never
+SESSION_STORE_TTL = int(os.getenv("SESSION_STORE_TTL", str(30 * 24 * 3600)))
+# Most sessions the memory store keeps (least recently used are dropped)
+SESSION_STORE_MAX_ENTRIES = int(os.getenv("SESSION_STORE_MAX_ENTRIES", "10000"))
+
+
+class SessionConflict(Exception):
+    """The session changed (or already exists) since it was read"""
+
+
+class SessionStore(abc.ABC):
+    @abc.abstractmethod
+    def get(self, session_id: str):
+        """Stored record for `session_id`, or None"""
+
+    @abc.abstractmethod
+    def put(self, record: dict, expected_version: int):
+        """Store `record` as version expected_version + 1 and return that version"""
+
+    @abc.abstractmethod
+    def delete(self, session_id: str):
+        """Forget `session_id` (no error if it does not exist)"""
+
+
+class MemorySessionStore(SessionStore):
+    """In-process LRU of at most `max_entries` sessions, each expiring `ttl` seconds after its last write"""
+
+    def __init__(self, max_entries: int = SESSION_STORE_MAX_ENTRIES, ttl: int = SESSION_STORE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _current(self, session_id: str):
+        entry = self._records.get(session_id)
+        if entry is None:
+            return None
+        data, written_at = entry
+        if self.ttl and time.time() - written_at > self.ttl:
+            del self._records[session_id]
+            return None
+        self._records.move_to_end(session_id)
+        return data
+
+    def get(self, session_id: str):
+        with self._lock:
+            data = self._current(session_id)
+        return json.loads(data) if data else None
+
+    def put(self, record: dict, expected_version: int):
+        with self._lock:
+            current = self._current(record["session_id"])
+            current_version = json.loads(current)["version"] if current else 0
+            if current_version != expected_version:
+                raise SessionConflict(record["session_id"])
+            version = expected_version + 1
+            self._records[record["session_id"]] = (
+                json.dumps({**record, "version": version}, ensure_ascii=False), time.time()
+            )
+            self._records.move_to_end(record["session_id"])
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+            return version
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._records.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in one SQLite file; rows idle longer than `ttl` seconds count as gone"""
+
+    def __init__(self, path: str = SESSION_STORE_SQLITE, ttl: int = SESSION_STORE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def _oldest(self):
+        return time.time() - self.ttl if self.ttl else 0.0
+
+    def get(self, session_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version, data FROM sessions WHERE session_id = ? AND updated_at >= ?",
+                (session_id, self._oldest()),
+            ).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[1]), "version": row[0]}
+
+    def put(self, record: dict, expected_version: int):
+        version = expected_version + 1
+        data = json.dumps({**record, "version": version}, ensure_ascii=False)
+        with self._lock:
+            if expected_version == 0:
+                self._db.execute("DELETE FROM sessions WHERE session_id = ? AND updated_at < ?",
+                                 (record["session_id"], self._oldest()))
+                try:
+                    self._db.execute(
+                        "INSERT INTO sessions (session_id, version, data, updated_at) VALUES (?, ?, ?, ?)",
+                        (record["session_id"], version, data, time.time()),
+                    )
+                except sqlite3.IntegrityError:
+                    self._db.rollback()
+                    raise SessionConflict(record["session_id"])
+            else:
+                cursor = self._db.execute(
+                    "UPDATE sessions SET version = ?, data = ?, updated_at = ? "
+                    "WHERE session_id = ? AND version = ? AND updated_at >= ?",
+                    (version, data, time.time(), record["session_id"], expected_version, self._oldest()),
+                )
+                if cursor.rowcount != 1:
+                    self._db.rollback()
+                    raise SessionConflict(record["session_id"])
+            self._db.commit()
+        return version
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+
+class DynamoDBSessionStore(SessionStore):
+    """
+    Table with a string partition key "session_id". Works against DynamoDB,
+    DynamoDB Local (SESSION_STORE_ENDPOINT) or moto; pass `client` to inject one.
+    """
+
+    def __init__(self, table: str = SESSION_STORE_TABLE, client=None, ttl: int = SESSION_STORE_TTL):
+        self.table = table
+        self.ttl = ttl
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("dynamodb", endpoint_url=SESSION_STORE_ENDPOINT or None)
+        return self._client
+
+    def get(self, session_id: str):
+        item = self.client.get_item(
+            TableName=self.table, Key={"session_id": {"S": session_id}}, ConsistentRead=True
+        ).get("Item")
+        if item is None:
+            return None
+        return {**json.loads(item["data"]["S"]), "version": int(item["version"]["N"])}
+
+    def put(self, record: dict, expected_version: int):
+        version = expected_version + 1
+        item = {
+            "session_id": {"S": record["session_id"]},
+            "version": {"N": str(version)},
+            "data": {"S": json.dumps({**record, "version": version}, ensure_ascii=False)},
+        }
+        if self.ttl:
+            item["expires_at"] = {"N": str(int(time.time()) + self.ttl)}
+        if expected_version == 0:
+            condition = {"ConditionExpression": "attribute_not_exists(session_id)"}
+        else:
+            condition = {
+                "ConditionExpression": "version = :expected",
+                "ExpressionAttributeValues": {":expected": {"N": str(expected_version)}},
+            }
+        try:
+            self.client.put_item(TableName=self.table, Item=item, **condition)
+        except Exception as e:
+            if type(e).__name__ == "ConditionalCheckFailedException" or \
+                    getattr(e, "response", {}).get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                raise SessionConflict(record["session_id"])
+            raise
+        return version
+
+    def delete(self, session_id: str):
+        self.client.delete_item(TableName=self.table, Key={"session_id": {"S": session_id}})
+
+
+def get_session_store(kind: str = SESSION_STORE):
+    """The configured store, or None for "none" (stateless: sessions travel with the client)"""
+    if kind == "none":
+        return None
+    if kind == "memory":
+        if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+            raise ValueError("SESSION_STORE=memory only lives in one container; use sqlite on EFS or dynamodb "
+                             "in Lambda")
+        return MemorySessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore()
+    if kind == "dynamodb":
+        return DynamoDBSessionStore()
+    raise ValueError(f"Unknown SESSION_STORE: {kind}")
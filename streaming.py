@@ -0,0 +1,131 @@
+import asyncio
+import json
+import traceback
+
+from live_fill_2 import (
+    astream_natural_followup,
+    extract_and_followup,
+    sample_llm_followup,
+    template_followup,
+)
+from llm_guard import get_deadline, llm_guard, turn_deadline
+from main import TurnRequestError, finish_turn, prepare_turn
+from turn_trace import TRACE_DEBUG, start_trace
+
+# ------------------- Streaming chat turns -------------------
+# Python Lambda handlers cannot stream their response, so streaming is served by
+# this plain ASGI app (e.g. `uvicorn streaming:app` behind the Lambda Web
+# Adapter with response streaming enabled, or any container host). The request
+# body is the same JSON lambda_handler takes; the response is NDJSON, one event
+# per line:
+#   {"event": "extraction", ...}       as soon as the fields are extracted
+#   {"event": "followup", "delta": ...} one or more chunks of the follow-up question
+#   {"event": "done", ...}             chat_history and the session payload
+#   {"event": "error", ...}            if the turn fails after streaming started
+# prepare_turn / finish_turn block (config load, session store, sink), so they run in
+# worker threads (asyncio.to_thread, which carries the trace context over) instead of
+# stalling the other turns on the event loop.
+NDJSON = b"application/x-ndjson"
+
+
+def _line(event: dict):
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def stream_turn(turn: dict, trace=None):
+    """Run one prepared turn and yield its NDJSON events"""
+    if "reply" in turn:
+        # 🔹 Greeting / start before an investor type: nothing to extract or save
+        reply = dict(turn["reply"])
+        yield {"event": "followup", "delta": reply["followup_question"]}
+        yield {"event": "done", **reply}
+        return
+
+    extracted, method, missing, followup = await extract_and_followup(
+        turn["user_input"], turn["chat_history"], turn["live_fill_flat"],
+        turn["mandatory_flat"], turn["apply_extracted"], schema=turn["schema"], with_followup=False,
+        intent=turn["intent"], fill_state=turn["fill_state"], investor_type=turn["investor_type"]
+    )
+    yield {
+        "event": "extraction",
+        "method": method,
+        "extracted_fields": extracted,
+        "missing_mandatory_count": len(missing),
+        "missing_mandatory_fields": missing[:10],
+        "phone_validation_errors": turn["phone_validation_errors"],
+    }
+
+    # 🔹 Template and intent replies are ready at once; LLM questions are relayed as they arrive
+    if followup is not None:
+        yield {"event": "followup", "delta": followup}
+    elif missing and llm_guard.available() and sample_llm_followup():
+        chunks = []
+        async for delta in astream_natural_followup(extracted or {}, len(missing), turn["chat_history"],
+                                                    get_deadline().remaining()):
+            chunks.append(delta)
+            yield {"event": "followup", "delta": delta}
+        followup = "".join(chunks).strip()
+    else:
+        followup = template_followup(extracted, len(missing), missing[:2], turn["schema"])
+        yield {"event": "followup", "delta": followup}
+
+    response_data = await asyncio.to_thread(finish_turn, turn, extracted, method, missing, followup)
+    for key in ("method", "extracted_fields", "missing_mandatory_count", "missing_mandatory_fields",
+                "phone_validation_errors"):
+        response_data.pop(key)
+    if trace is not None:
+        response_data["trace"] = trace.to_dict()
+    yield {"event": "done", **response_data}
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, status: int, payload: dict):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode("utf-8")})
+
+
+async def app(scope, receive, send):
+    """ASGI entry point: POST a chat turn, receive NDJSON events"""
+    if scope["type"] != "http":
+        return
+    if scope["method"] != "POST":
+        await _send_json(send, 405, {"error": "Use POST"})
+        return
+    with start_trace("stream_turn") as trace, turn_deadline():
+        await _serve_turn(receive, send, trace)
+        trace.emit()
+
+
+async def _serve_turn(receive, send, trace):
+    # 🔹 Validation errors are still plain JSON responses with a status code
+    try:
+        body = json.loads(await _read_body(receive) or b"{}")
+        turn = await asyncio.to_thread(prepare_turn, body)
+    except TurnRequestError as e:
+        await _send_json(send, e.status, e.payload)
+        return
+    except Exception as e:
+        await _send_json(send, 500, {"error": str(e), "traceback": traceback.format_exc()})
+        return
+
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", NDJSON), (b"cache-control", b"no-cache")]})
+    try:
+        async for event in stream_turn(turn, trace if body.get("debug") or TRACE_DEBUG else None):
+            await send({"type": "http.response.body", "body": _line(event), "more_body": True})
+    except TurnRequestError as e:
+        await send({"type": "http.response.body", "body": _line({"event": "error", "status": e.status, **e.payload}),
+                    "more_body": True})
+    except Exception as e:
+        await send({"type": "http.response.body", "body": _line({"event": "error", "error": str(e)}),
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
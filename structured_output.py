@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+
+# ------------------- Config -------------------
+# "json_schema": the extraction LLM must answer with {"fields": [{"key", "value"}]} where
+# "key" is an enum of the fields offered this turn (OpenAI structured outputs, strict).
+# "text": the original free-form JSON prompt. Both are parsed with salvage_json.
+EXTRACTION_OUTPUT = os.getenv("EXTRACTION_OUTPUT", "json_schema")
+EXTRACTION_OUTPUTS = ("json_schema", "text")
+# How far back salvage_json cuts a truncated object looking for a parseable prefix
+SALVAGE_MAX_ATTEMPTS = 64
+
+_decoder = json.JSONDecoder()
+
+
+# ------------------- Response formats -------------------
+def extraction_json_schema(field_keys, with_followup: bool = False):
+    """JSON schema of an extraction answer whose keys can only be `field_keys`"""
+    properties = {
+        "fields": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "key": {"type": "string", "enum": list(field_keys)},
+                    "value": {"anyOf": [{"type": "string"}, {"type": "boolean"}]},
+                },
+                "required": ["key", "value"],
+                "additionalProperties": False,
+            },
+        },
+    }
+    if with_followup:
+        properties["followup"] = {"type": "string"}
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def extraction_response_format(field_keys, with_followup: bool = False):
+    """OpenAI response_format for a strict structured extraction"""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "combined_extraction" if with_followup else "extraction",
+            "strict": True,
+            "schema": extraction_json_schema(field_keys, with_followup),
+        },
+    }
+
+
+# ------------------- Tolerant parsing -------------------
+def _boundaries(text: str):
+    """
+    Scan JSON text once: the positions where a truncated prefix can be cut (before a
+    "," or right after a "{" / "[" outside strings), the containers still open at the
+    end, and whether it ends inside a string.
+    """
+    cuts = []
+    stack = []
+    in_string = escaped = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+            cuts.append(i + 1)
+        elif c in "}]":
+            if stack:
+                stack.pop()
+        elif c == ",":
+            cuts.append(i)
+    return cuts, stack, in_string
+
+
+def _close(prefix: str):
+    _, stack, in_string = _boundaries(prefix)
+    if in_string:
+        return None
+    return prefix.rstrip().rstrip(",") + "".join(reversed(stack))
+
+
+def salvage_json(text: str):
+    """
+    First JSON object in model output -> (object, complete).
+
+    Preambles and code fences around the object are skipped. A truncated object
+    (stream cut off, max tokens) is closed after its last complete member; a value
+    cut off mid-string is dropped rather than kept half-written. (None, False) when
+    there is no object or nothing of it survives.
+    """
+    start = text.find("{") if text else -1
+    if start < 0:
+        return None, False
+    try:
+        obj, _ = _decoder.raw_decode(text, start)
+        if isinstance(obj, dict):
+            return obj, True
+    except ValueError:
+        pass
+
+    body = text[start:]
+    fence = body.find("```")
+    if fence >= 0:
+        body = body[:fence]
+    cuts, _, _ = _boundaries(body)
+    candidates = [len(body)] + cuts[::-1][:SALVAGE_MAX_ATTEMPTS]
+    for end in candidates:
+        closed = _close(body[:end])
+        if closed is None:
+            continue
+        try:
+            obj = json.loads(closed)
+        except ValueError:
+            continue
+        if isinstance(obj, dict) and obj:
+            return obj, False
+    return None, False
+
+
+class StreamingJSONParser:
+    """Accumulates streamed chunks of one JSON answer; value() salvages whatever has arrived"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def feed(self, chunk: str):
+        if chunk:
+            self.chunks.append(chunk)
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def value(self):
+        return salvage_json(self.text)
+
+
+def fields_from_output(parsed, allowed=None):
+    """
+    Field dict from a parsed extraction answer, keeping only keys in `allowed` (if given).
+    Accepts the structured shape ({"fields": [{"key", "value"}]}), the combined
+    text shape ({"fields": {...}}) and a plain {key: value} object.
+    """
+    if not isinstance(parsed, dict):
+        return {}
+    fields = parsed.get("fields", parsed)
+    if isinstance(fields, list):
+        fields = {
+            item["key"]: item["value"] for item in fields
+            if isinstance(item, dict) and isinstance(item.get("key"), str) and "value" in item
+        }
+    if not isinstance(fields, dict):
+        return {}
+    if allowed is None:
+        return dict(fields)
+    return {k: v for k, v in fields.items() if k in allowed}
+
+
+# ------------------- Counters -------------------
+class ExtractionStats:
+    """How extraction answers parsed: cleanly, salvaged, or not at all (a paid call thrown away)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "parsed": 0, "salvaged": 0, "parse_failures": 0, "empty": 0,
+                      "dropped_keys": 0, "fallbacks": 0}
+
+    def record(self, parsed, complete: bool, kept: int = 0, returned: int = 0):
+        with self._lock:
+            self.stats["calls"] += 1
+            if parsed is None:
+                self.stats["parse_failures"] += 1
+                return
+            self.stats["parsed" if complete else "salvaged"] += 1
+            if not kept:
+                self.stats["empty"] += 1
+            self.stats["dropped_keys"] += max(0, returned - kept)
+
+    def record_fallback(self):
+        with self._lock:
+            self.stats["fallbacks"] += 1
+
+    def metrics(self):
+        calls = self.stats["calls"]
+        return {
+            **self.stats,
+            "parse_failure_rate": round(self.stats["parse_failures"] / calls, 4) if calls else 0.0,
+            "salvage_rate": round(self.stats["salvaged"] / calls, 4) if calls else 0.0,
+            "fallback_rate": round(self.stats["fallbacks"] / calls, 4) if calls else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+
+extraction_stats = ExtractionStats()
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatOpenAI in tests. Call n answers `answers[n]` after
+    `delays[n]` seconds, or raises `errors[n]` (None = no error); the last entry of each
+    list repeats. `prompts` records what every call was sent.
+    """
+
+    answers: list = ["{}"]
+    delays: list = [0.0]
+    errors: list = [None]
+    prompts: list = []
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    @property
+    def calls(self):
+        return len(self.prompts)
+
+    def _next(self, messages):
+        n = len(self.prompts)
+        self.prompts.append("\n".join(str(m.content) for m in messages))
+
+        def pick(values):
+            return values[min(n, len(values) - 1)]
+
+        return pick(self.answers), pick(self.delays), pick(self.errors)
+
+    @staticmethod
+    def _result(answer):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        answer, delay, error = self._next(messages)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return self._result(answer)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        answer, delay, error = self._next(messages)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self._result(answer)
+
+
+def install(monkeypatch, model: FakeChatModel):
+    """Use `model` for both live_fill_2 LLMs for the duration of a test"""
+    import live_fill_2
+
+    monkeypatch.setattr(live_fill_2, "llm_extraction", model)
+    monkeypatch.setattr(live_fill_2, "llm_conversation", model)
+    return model
@@ -0,0 +1,58 @@
+import asyncio
+import json
+import logging
+import os
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import batch_extract  # noqa: E402
+import live_fill_2  # noqa: E402
+from fake_llm import FakeChatModel, install  # noqa: E402
+from schema_index import CompiledSchema  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMAIL = "Details in Subscription Booklet.investoremail_ID.value"
+
+
+class AuthenticationError(Exception):
+    status_code = 401
+
+
+@pytest.fixture(scope="module")
+def schema():
+    with open(os.path.join(ROOT, "form_keys.json"), encoding="utf-8") as f:
+        form_keys = json.load(f)
+    with open(os.path.join(ROOT, "mandatory.json"), encoding="utf-8") as f:
+        mandatory_master = json.load(f)
+    return CompiledSchema(live_fill_2.flatten_dict(form_keys), mandatory_master)
+
+
+def _run(schema, n: int, concurrency: int = 1):
+    lines = [json.dumps({"id": i, "investor_type": schema.investor_types[1], "text": f"my name is Person {i}"})
+             for i in range(n)]
+    out = []
+    stats = asyncio.run(asyncio.wait_for(
+        batch_extract.run_batch(batch_extract.read_records(lines), out.append, schema=schema,
+                                concurrency=concurrency, pack_size=1), 30))
+    return stats, out
+
+
+def test_transient_llm_error_is_logged_counted_and_falls_back(monkeypatch, schema, caplog):
+    install(monkeypatch, FakeChatModel(answers=[json.dumps({"fields": [{"key": EMAIL, "value": "a@b.com"}]})],
+                                       errors=[ConnectionError("connection reset"), None], prompts=[]))
+    with caplog.at_level(logging.WARNING, logger="batch_extract"):
+        stats, out = _run(schema, 2)
+    assert stats["llm_errors"] == 1
+    assert stats["errors"] == 0
+    assert sorted(result["method"] for result in out) == ["fallback", "llm"]
+    assert "connection reset" in caplog.text
+
+
+def test_fatal_llm_error_stops_the_batch(monkeypatch, schema):
+    model = install(monkeypatch, FakeChatModel(errors=[AuthenticationError("invalid api key")], prompts=[]))
+    with pytest.raises(AuthenticationError):
+        # More packs than the queue holds: the reader must not hang once the workers stopped
+        _run(schema, 20, concurrency=2)
+    assert model.calls <= 2
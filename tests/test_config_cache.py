@@ -0,0 +1,75 @@
+import io
+import json
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from config_cache import ConfigCache
+
+
+class SlowS3:
+    """get_object stand-in: JSON bodies with an ETag, a delay per call and optional failures"""
+
+    def __init__(self, objects: dict, delay: float = 0.0):
+        self.objects = objects
+        self.delay = delay
+        self.calls = []
+        self.error = None
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.calls.append((Key, IfNoneMatch))
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        if IfNoneMatch is not None and IfNoneMatch == self.objects[Key][1]:
+            raise ClientError({"Error": {"Code": "304"}, "ResponseMetadata": {"HTTPStatusCode": 304}}, "GetObject")
+        data, etag = self.objects[Key]
+        return {"Body": io.BytesIO(json.dumps(data).encode("utf-8")), "ETag": etag}
+
+
+def _get_concurrently(cache, keys):
+    results = []
+    threads = [threading.Thread(target=lambda k=k: results.append(cache.get("bucket", k))) for k in keys]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_readers_of_one_key_share_one_request():
+    s3 = SlowS3({"form_keys.json": ({"a": 1}, '"v1"')}, delay=0.1)
+    cache = ConfigCache(client=s3, ttl=60)
+    assert _get_concurrently(cache, ["form_keys.json"] * 8) == [{"a": 1}] * 8
+    assert len(s3.calls) == 1
+    assert cache.stats["fetches"] == 1
+    assert cache.stats["hits"] == 7
+
+
+def test_different_keys_are_fetched_in_parallel():
+    s3 = SlowS3({"a.json": ({"a": 1}, '"a"'), "b.json": ({"b": 1}, '"b"')}, delay=0.3)
+    cache = ConfigCache(client=s3, ttl=60)
+    start = time.monotonic()
+    _get_concurrently(cache, ["a.json", "b.json"])
+    assert time.monotonic() - start < 0.55
+
+
+def test_expired_entry_is_revalidated_with_its_etag():
+    s3 = SlowS3({"form_keys.json": ({"a": 1}, '"v1"')})
+    cache = ConfigCache(client=s3, ttl=0)
+    first = cache.get("bucket", "form_keys.json")
+    assert cache.get("bucket", "form_keys.json") is first
+    assert s3.calls[-1] == ("form_keys.json", '"v1"')
+    assert cache.stats["not_modified"] == 1
+
+
+def test_stale_copy_is_served_when_s3_fails(caplog):
+    s3 = SlowS3({"form_keys.json": ({"a": 1}, '"v1"')})
+    cache = ConfigCache(client=s3, ttl=0)
+    cache.get("bucket", "form_keys.json")
+    s3.error = ClientError({"Error": {"Code": "SlowDown"}, "ResponseMetadata": {"HTTPStatusCode": 503}}, "GetObject")
+    with caplog.at_level("WARNING", logger="config_cache"):
+        assert cache.get("bucket", "form_keys.json") == {"a": 1}
+    assert cache.stats["stale_served"] == 1
+    assert "Serving cached s3://bucket/form_keys.json" in caplog.text
@@ -0,0 +1,53 @@
+import json
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from event_log import EventLog, read_events, rebuild_live_fill, replay  # noqa: E402
+
+
+def test_append_writes_one_compact_line_per_event(tmp_path):
+    log = EventLog(str(tmp_path / "log.jsonl"))
+    log.append({"investor_type": "Individual"})
+    log.append({"update": {"a.value": "é"}})
+    log.close()
+    lines = (tmp_path / "log.jsonl").read_text(encoding="utf-8").splitlines()
+    assert lines == ['{"investor_type":"Individual"}', '{"update":{"a.value":"é"}}']
+    assert len(log) == 2
+    assert list(log) == [{"investor_type": "Individual"}, {"update": {"a.value": "é"}}]
+
+
+def test_fsync_is_batched(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd))
+    log = EventLog(str(tmp_path / "log.jsonl"), fsync_every=3, fsync_interval=3600)
+    for i in range(7):
+        log.append({"n": i})
+    assert len(synced) == 2
+    log.close()
+    assert len(synced) == 3
+
+
+def test_read_events_skips_a_torn_last_line(tmp_path):
+    path = tmp_path / "log.jsonl"
+    path.write_text('{"update":{"a.value":"1"}}\n{"update":{"a.va', encoding="utf-8")
+    assert list(read_events(str(path))) == [{"update": {"a.value": "1"}}]
+
+
+def test_replay_applies_updates_in_order():
+    events = [{"update": {"a.value": "1"}}, {"user": "hi"}, {"update": {"a.value": "2", "b.value": "x"}}]
+    assert replay({"a.value": "", "b.value": ""}, events) == {"a.value": "2", "b.value": "x"}
+
+
+def test_rebuild_live_fill_from_snapshot_and_log(tmp_path):
+    (tmp_path / "live_fill.json").write_text(json.dumps({"a": {"value": ""}, "b": {"value": "kept"}}),
+                                             encoding="utf-8")
+    log = EventLog(str(tmp_path / "log.jsonl"))
+    log.append({"update": {"a.value": "filled"}})
+    log.close()
+    assert rebuild_live_fill(str(tmp_path)) == {"a.value": "filled", "b.value": "kept"}
+
+
+def test_rebuild_live_fill_without_a_log(tmp_path):
+    (tmp_path / "live_fill.json").write_text(json.dumps({"a": {"value": "x"}}), encoding="utf-8")
+    assert rebuild_live_fill(str(tmp_path)) == {"a.value": "x"}
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import live_fill_2  # noqa: E402
+from extraction_cache import ExtractionCache, extraction_cache  # noqa: E402
+from fake_llm import FakeChatModel, install  # noqa: E402
+from schema_index import CompiledSchema  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def schema():
+    with open(os.path.join(ROOT, "form_keys.json"), encoding="utf-8") as f:
+        form_keys = json.load(f)
+    with open(os.path.join(ROOT, "mandatory.json"), encoding="utf-8") as f:
+        mandatory_master = json.load(f)
+    return CompiledSchema(live_fill_2.flatten_dict(form_keys), mandatory_master)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    extraction_cache.clear()
+    yield
+    extraction_cache.clear()
+
+
+def _answer(fields: dict):
+    return json.dumps({"fields": [{"key": k, "value": v} for k, v in fields.items()]})
+
+
+def _turn(schema, message: str, chat_history: str):
+    investor_type = schema.investor_types[1]
+    return asyncio.run(live_fill_2.extract_and_followup(
+        message, chat_history, dict(schema.defaults), schema.mandatory_fields(investor_type),
+        lambda extracted, method: extracted, schema=schema, with_followup=False))
+
+
+def test_two_sessions_share_a_hit(schema, monkeypatch):
+    name = schema.fields_labelled("name")[0]
+    model = install(monkeypatch, FakeChatModel(answers=[_answer({name: "John Smith"})], prompts=[]))
+
+    first = _turn(schema, "John Smith", "User: hi\nBot: What's your full name?\n")
+    second = _turn(schema, "John  Smith", "Already captured: Email\nUser: a@b.com\nBot: And your name?\n")
+
+    assert first[:2] == ({name: "John Smith"}, "llm")
+    assert second[:2] == ({name: "John Smith"}, "cache")
+    assert model.calls == 1
+    assert extraction_cache.stats["memory_hits"] == 1
+
+
+def test_answers_resolved_from_the_history_are_not_shared(schema, monkeypatch):
+    city = schema.fields_labelled("city")[0]
+    model = install(monkeypatch, FakeChatModel(answers=[_answer({city: "Paris"}), _answer({city: "Lyon"})], prompts=[]))
+
+    first = _turn(schema, "same as registered address", "User: I live in Paris\n")
+    second = _turn(schema, "same as registered address", "User: I live in Lyon\n")
+
+    assert first[0] == {city: "Paris"}
+    assert second[:2] == ({city: "Lyon"}, "llm")
+    assert model.calls == 2
+    assert extraction_cache.stats["not_cacheable"] == 2
+
+
+def test_cacheable():
+    assert ExtractionCache.cacheable("Email: John@Example.com", {"e": "john@example.com"})
+    assert not ExtractionCache.cacheable("same as above", {"c": "Paris"})
+    assert not ExtractionCache.cacheable("yes", {})
+    assert not ExtractionCache.cacheable("accredited: yes", {"flag": True})
@@ -0,0 +1,40 @@
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import live_fill_2  # noqa: E402
+from extraction_router import ExtractionRouter, rule_field_map  # noqa: E402
+from schema_index import CompiledSchema  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def schema():
+    with open(os.path.join(ROOT, "form_keys.json"), encoding="utf-8") as f:
+        form_keys = json.load(f)
+    with open(os.path.join(ROOT, "mandatory.json"), encoding="utf-8") as f:
+        mandatory_master = json.load(f)
+    return CompiledSchema(live_fill_2.flatten_dict(form_keys), mandatory_master)
+
+
+@pytest.fixture(scope="module")
+def zip_key(schema):
+    return rule_field_map(schema)["zip"][0]
+
+
+@pytest.mark.parametrize("message", ["zip 10001", "postal code: 10001", "pin code 560001", "my pincode is 560001"])
+def test_cued_zip_is_taken_by_the_rules(schema, zip_key, message):
+    route = ExtractionRouter(enabled=True).route(message, dict(schema.defaults), schema)
+    assert route.fields == {zip_key: message.split()[-1]}
+    assert not route.needs_llm
+
+
+@pytest.mark.parametrize("message", ["PIN 4455", "my pin is 1234"])
+def test_bare_pin_is_not_a_zip(schema, zip_key, message):
+    route = ExtractionRouter(enabled=True).route(message, dict(schema.defaults), schema)
+    assert zip_key not in route.fields
+    assert route.needs_llm
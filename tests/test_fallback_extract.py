@@ -0,0 +1,50 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import live_fill_2  # noqa: E402
+from schema_index import CompiledSchema  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def schema():
+    with open(os.path.join(ROOT, "form_keys.json"), encoding="utf-8") as f:
+        form_keys = json.load(f)
+    with open(os.path.join(ROOT, "mandatory.json"), encoding="utf-8") as f:
+        mandatory_master = json.load(f)
+    return CompiledSchema(live_fill_2.flatten_dict(form_keys), mandatory_master)
+
+
+def test_email_fills_investor_email(schema):
+    fields = live_fill_2.fallback_extract("john@example.com", schema.defaults, schema)
+    assert fields == {"Details in Subscription Booklet.investoremail_ID.value": "john@example.com"}
+
+
+def test_field_map_is_built_once_per_schema(schema):
+    live_fill_2.fallback_extract("john@example.com", schema.defaults, schema)
+    assert live_fill_2.fallback_field_map(schema) is live_fill_2.fallback_field_map(schema)
+
+
+def test_places_are_left_to_the_llm(schema, monkeypatch):
+    entities = [SimpleNamespace(text="France", label_="GPE"), SimpleNamespace(text="Jane Doe", label_="PERSON")]
+    monkeypatch.setattr(live_fill_2, "get_nlp", lambda: lambda text: SimpleNamespace(ents=entities))
+    fields = live_fill_2.fallback_extract("Jane Doe, France", schema.defaults, schema)
+    assert "France" not in fields.values()
+    assert "Jane Doe" in fields.values()
+
+
+def test_every_ner_label_maps_to_fields(schema):
+    field_map = live_fill_2.fallback_field_map(schema)
+    assert all(field_map.get(label) for label in live_fill_2.NER_LABELS)
+
+
+def test_organisations_are_left_to_the_llm(schema, monkeypatch):
+    entities = [SimpleNamespace(text="Acme Capital LLC", label_="ORG")]
+    monkeypatch.setattr(live_fill_2, "get_nlp", lambda: lambda text: SimpleNamespace(ents=entities))
+    assert live_fill_2.fallback_extract("I work at Acme Capital LLC", schema.defaults, schema) == {}
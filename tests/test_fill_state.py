@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import live_fill_2  # noqa: E402
+from extraction_cache import extraction_cache  # noqa: E402
+from fake_llm import FakeChatModel, install  # noqa: E402
+from live_fill_2 import deep_update, get_missing_mandatory_keys  # noqa: E402
+from schema_index import CompiledSchema, FillState  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def schema():
+    with open(os.path.join(ROOT, "form_keys.json"), encoding="utf-8") as f:
+        form_keys = json.load(f)
+    with open(os.path.join(ROOT, "mandatory.json"), encoding="utf-8") as f:
+        mandatory_master = json.load(f)
+    return CompiledSchema(live_fill_2.flatten_dict(form_keys), mandatory_master)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    extraction_cache.clear()
+    yield
+    extraction_cache.clear()
+
+
+@pytest.mark.parametrize("index", [0, 1, -1])
+def test_missing_matches_the_dict_scan(schema, index):
+    investor_type = schema.investor_types[index]
+    mandatory = schema.mandatory_fields(investor_type)
+    fields = {path: "x" for path in list(mandatory)[::3]}
+    live_fill_flat = {**schema.defaults, **fields}
+    expected = get_missing_mandatory_keys(live_fill_flat, mandatory)
+
+    assert FillState.from_fields(schema, fields).missing(investor_type) == expected
+    assert FillState.from_flat(schema, live_fill_flat).missing(investor_type) == expected
+    cleared = next(iter(fields))
+    assert FillState.from_fields(schema, fields).update({cleared: ""}).missing(investor_type) == \
+        get_missing_mandatory_keys({**live_fill_flat, cleared: ""}, mandatory)
+
+
+def test_turn_reads_missing_off_the_fill_state(schema, monkeypatch):
+    investor_type = schema.investor_types[1]
+    mandatory = schema.mandatory_fields(investor_type)
+    name = next(path for path in mandatory if path in schema.fields_labelled("name"))
+    install(monkeypatch, FakeChatModel(
+        answers=[json.dumps({"fields": [{"key": name, "value": "John Smith"}]})], prompts=[]))
+    live_fill_flat = dict(schema.defaults)
+    fill_state = FillState(schema)
+
+    def apply_extracted(extracted, method):
+        deep_update(live_fill_flat, extracted)
+        fill_state.update(extracted)
+        return extracted
+
+    extracted, method, missing, _ = asyncio.run(live_fill_2.extract_and_followup(
+        "John Smith", "", live_fill_flat, mandatory, apply_extracted, schema=schema, with_followup=False,
+        fill_state=fill_state, investor_type=investor_type))
+
+    assert (extracted, method) == ({name: "John Smith"}, "llm")
+    assert name not in missing
+    assert missing == get_missing_mandatory_keys(live_fill_flat, mandatory)
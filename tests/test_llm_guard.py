@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import live_fill_2  # noqa: E402
+from fake_llm import FakeChatModel, install  # noqa: E402
+from llm_guard import BREAKER_FAILURES, CircuitBreaker, Deadline, LLMGuard, LLMUnavailable, llm_guard, \
+    turn_deadline  # noqa: E402
+from schema_index import CompiledSchema  # noqa: E402
+from turn_trace import start_trace  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _call(guard, model, timeout=1.0, hedge=False):
+    return asyncio.run(guard.call("llm_extract", lambda: model.ainvoke("hi"), timeout, hedge=hedge))
+
+
+def _fail(guard, model, times):
+    for _ in range(times):
+        with pytest.raises(ConnectionError):
+            _call(guard, model)
+
+
+def test_deadline_shares_what_is_left():
+    deadline = Deadline(10)
+    assert 9.9 < deadline.remaining() <= 10
+    assert 4.9 < deadline.share(0.5) <= 5
+    assert Deadline(0).remaining() == 0.0
+
+
+def test_breaker_opens_after_consecutive_failures():
+    guard = LLMGuard(breaker=CircuitBreaker(cooldown=60))
+    model = FakeChatModel(errors=[ConnectionError("503")], prompts=[])
+    _fail(guard, model, BREAKER_FAILURES - 1)
+    assert guard.breaker.state == "closed"
+    _fail(guard, model, 1)
+    assert guard.breaker.state == "open"
+
+    with pytest.raises(LLMUnavailable):
+        _call(guard, model)
+    assert model.calls == BREAKER_FAILURES
+    assert guard.stats["short_circuits"] == 1
+    assert not guard.available()
+
+
+def test_half_open_probe_success_closes_the_circuit():
+    guard = LLMGuard(breaker=CircuitBreaker(failures=2, cooldown=0.05))
+    model = FakeChatModel(answers=["{}"], errors=[ConnectionError("503"), ConnectionError("503"), None], prompts=[])
+    _fail(guard, model, 2)
+    assert guard.breaker.state == "open"
+    time.sleep(0.06)
+    assert guard.available()
+    assert _call(guard, model).content == "{}"
+    assert guard.breaker.state == "closed"
+
+
+def test_half_open_probe_failure_opens_it_again():
+    guard = LLMGuard(breaker=CircuitBreaker(failures=2, cooldown=0.05))
+    model = FakeChatModel(errors=[ConnectionError("503")], prompts=[])
+    _fail(guard, model, 2)
+    time.sleep(0.06)
+    assert guard.breaker.allow()
+    assert not guard.breaker.allow()  # only one probe at a time
+    guard.breaker.release()
+    _fail(guard, model, 1)
+    assert guard.breaker.state == "open"
+    assert guard.breaker.opened == 2
+
+
+def test_timeout_counts_as_a_failure():
+    guard = LLMGuard(breaker=CircuitBreaker(failures=1, cooldown=60), min_call_s=0.01)
+    model = FakeChatModel(delays=[1.0], prompts=[])
+    with pytest.raises(asyncio.TimeoutError):
+        _call(guard, model, timeout=0.05)
+    assert guard.stats["timeouts"] == 1
+    assert guard.breaker.state == "open"
+
+
+def test_hedged_call_wins_when_the_primary_stalls():
+    guard = LLMGuard(hedge=True, hedge_min_samples=3)
+    for _ in range(3):
+        guard._observe("llm_extract", 0.02)
+    model = FakeChatModel(answers=["slow", "fast"], delays=[5.0, 0.0], prompts=[])
+    start = time.monotonic()
+    assert _call(guard, model, timeout=2.0, hedge=True).content == "fast"
+    assert time.monotonic() - start < 1.0
+    assert guard.stats["hedges"] == 1
+    assert guard.stats["hedge_wins"] == 1
+
+
+def test_hedge_waits_for_enough_samples():
+    guard = LLMGuard(hedge=True, hedge_min_samples=3)
+    model = FakeChatModel(answers=["only"], delays=[0.05], prompts=[])
+    assert _call(guard, model, hedge=True).content == "only"
+    assert model.calls == 1
+    assert guard.stats["hedges"] == 0
+
+
+@pytest.fixture
+def schema():
+    with open(os.path.join(ROOT, "form_keys.json"), encoding="utf-8") as f:
+        form_keys = json.load(f)
+    with open(os.path.join(ROOT, "mandatory.json"), encoding="utf-8") as f:
+        mandatory_master = json.load(f)
+    return CompiledSchema(live_fill_2.flatten_dict(form_keys), mandatory_master)
+
+
+def test_exhausted_deadline_uses_fallback_and_template(schema, monkeypatch):
+    model = install(monkeypatch, FakeChatModel(answers=["Lovely! What else?"], prompts=[]))
+    monkeypatch.setattr(live_fill_2, "sample_llm_followup", lambda: True)
+    llm_guard.clear()
+    investor_type = schema.investor_types[1]
+
+    async def turn():
+        with start_trace("test") as trace, turn_deadline(0.1):
+            result = await live_fill_2.extract_and_followup(
+                "John Smith", "", dict(schema.defaults), schema.mandatory_fields(investor_type),
+                lambda extracted, method: extracted, schema=schema)
+        return result, trace.to_dict()
+
+    (extracted, method, missing, followup), trace = asyncio.run(turn())
+    assert model.calls == 0
+    assert method == "fallback"
+    assert "fallback_extract" in trace["stages_ms"]
+    assert "followup_template" in trace["stages_ms"]
+    assert followup not in ("Lovely! What else?", live_fill_2.DEFAULT_FOLLOWUP)
+    assert trace["llm_degraded"] is True
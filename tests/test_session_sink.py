@@ -0,0 +1,84 @@
+import json
+import threading
+
+import pytest
+
+from session_sink import LocalSessionSink, S3SessionSink, SessionSink
+
+
+class BlockingSink(SessionSink):
+    """Stores into a dict, but only once `release` is set (or fails when `fail` is set)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+        self.fail = False
+        self.stored = {}
+
+    def location(self, key):
+        return f"mem://{key}"
+
+    def _store(self, key, body):
+        self.release.wait(5)
+        if self.fail:
+            raise OSError("disk full")
+        self.stored[key] = json.loads(body)
+
+
+def test_local_sink_writes_compact_json(tmp_path):
+    sink = LocalSessionSink(root=str(tmp_path), coalesce_ms=0)
+    sink.write("session_1/live_fill.json", {"a": "1", "b": None})
+    assert sink.flush(5)
+    path = tmp_path / "session_1" / "live_fill.json"
+    assert path.read_text(encoding="utf-8") == '{"a":"1","b":null}'
+    assert sink.stats["stored"] == 1
+    assert sink.stats["flush_timeouts"] == 0
+
+
+def test_writes_to_one_key_are_coalesced():
+    sink = BlockingSink(coalesce_ms=10_000)
+    for i in range(5):
+        sink.write("live_fill.json", {"turn": i})
+    sink.release.set()
+    assert sink.flush(5)
+    assert sink.stored == {"live_fill.json": {"turn": 4}}
+    assert sink.stats["writes"] == 5
+    assert sink.stats["coalesced"] == 4
+    assert sink.stats["stored"] == 1
+
+
+def test_flush_timeout_returns_false_and_is_counted():
+    sink = BlockingSink(coalesce_ms=0)
+    sink.write("live_fill.json", {"turn": 1})
+    assert sink.flush(0.05) is False
+    assert sink.stats["flush_timeouts"] == 1
+    sink.release.set()
+    assert sink.flush(5) is True
+    assert sink.stored == {"live_fill.json": {"turn": 1}}
+    assert sink.stats["flush_timeouts"] == 1
+
+
+def test_failed_store_is_counted_not_raised():
+    sink = BlockingSink(coalesce_ms=0)
+    sink.fail = True
+    sink.release.set()
+    sink.write("live_fill.json", {"turn": 1})
+    assert sink.flush(5)
+    assert sink.stats["errors"] == 1
+    assert sink.stats["stored"] == 0
+
+
+def test_s3_sink_stores_batch():
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="sessions")
+        sink = S3SessionSink(bucket="sessions", prefix="chat/", client=client, coalesce_ms=50)
+        for name in ("live_fill.json", "final_output.json"):
+            sink.write(f"session_1/{name}", {"name": name})
+        assert sink.flush(5)
+        body = client.get_object(Bucket="sessions", Key="chat/session_1/final_output.json")["Body"].read()
+        assert json.loads(body) == {"name": "final_output.json"}
+        assert sink.stats["stored"] == 2
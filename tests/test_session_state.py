@@ -0,0 +1,26 @@
+from schema_index import CompiledSchema
+from session_state import expand_sparse, remap_sparse
+
+OLD = CompiledSchema({"Booklet.investoremail_ID.value": "", "Booklet.fax_ID.value": ""}, version="v1")
+NEW = CompiledSchema({"Subscription Booklet.investoremail_ID.value": "", "Booklet.phone_ID.value": ""}, version="v2")
+
+
+def test_same_version_is_left_alone():
+    fields = {"Booklet.investoremail_ID.value": "a@b.com"}
+    assert remap_sparse(OLD, fields, OLD.version_tag) == (fields, {})
+
+
+def test_renamed_paths_move_by_field_id():
+    fields = {"Booklet.investoremail_ID.value": "a@b.com", "Booklet.fax_ID.value": "123"}
+    moved, remapped = remap_sparse(NEW, fields, OLD.version_tag)
+    assert remapped == {"Booklet.investoremail_ID.value": "Subscription Booklet.investoremail_ID.value"}
+    live_fill_flat, dropped = expand_sparse(NEW, moved)
+    assert live_fill_flat["Subscription Booklet.investoremail_ID.value"] == "a@b.com"
+    assert dropped == ["Booklet.fax_ID.value"]
+
+
+def test_current_value_wins_over_a_remapped_one():
+    fields = {"Booklet.investoremail_ID.value": "old@b.com", "Subscription Booklet.investoremail_ID.value": "new@b.com"}
+    moved, remapped = remap_sparse(NEW, fields, OLD.version_tag)
+    assert remapped == {}
+    assert expand_sparse(NEW, moved)[0]["Subscription Booklet.investoremail_ID.value"] == "new@b.com"
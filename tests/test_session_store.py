@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from session_store import DynamoDBSessionStore, MemorySessionStore, SessionConflict, SQLiteSessionStore, \
+    get_session_store
+
+
+def _record(session_id="s1", **fields):
+    return {"session_id": session_id, "investor_type": "Individual", "schema_version": "v1",
+            "fields": fields, "chat_history": ""}
+
+
+@pytest.fixture
+def dynamodb_store():
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    with moto.mock_aws():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName="sessions",
+            KeySchema=[{"AttributeName": "session_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "session_id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield DynamoDBSessionStore(table="sessions", client=client)
+
+
+@pytest.fixture(params=["memory", "sqlite", "dynamodb"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    return request.getfixturevalue("dynamodb_store")
+
+
+def test_put_and_get_round_trip(store):
+    assert store.get("s1") is None
+    assert store.put(_record(a="1"), 0) == 1
+    assert store.put(_record(a="2"), 1) == 2
+    record = store.get("s1")
+    assert record["version"] == 2
+    assert record["fields"] == {"a": "2"}
+
+
+def test_stale_expected_version_raises_conflict(store):
+    store.put(_record(a="1"), 0)
+    store.put(_record(a="2"), 1)
+    with pytest.raises(SessionConflict):
+        store.put(_record(a="stale"), 1)
+    assert store.get("s1")["fields"] == {"a": "2"}
+
+
+def test_creating_an_existing_session_raises_conflict(store):
+    store.put(_record(), 0)
+    with pytest.raises(SessionConflict):
+        store.put(_record(), 0)
+
+
+def test_update_of_missing_session_raises_conflict(store):
+    with pytest.raises(SessionConflict):
+        store.put(_record(), 3)
+
+
+def test_delete(store):
+    store.put(_record(), 0)
+    store.delete("s1")
+    assert store.get("s1") is None
+    store.delete("s1")
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_entries=2)
+    for session_id in ("a", "b"):
+        store.put(_record(session_id), 0)
+    store.get("a")
+    store.put(_record("c"), 0)
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: MemorySessionStore(ttl=1),
+    lambda tmp_path: SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=1),
+])
+def test_expired_sessions_are_gone(make_store, tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    store.put(_record(), 0)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 5)
+    assert store.get("s1") is None
+    assert store.put(_record(), 0) == 1
+
+
+def test_store_kinds(monkeypatch):
+    assert get_session_store("none") is None
+    assert isinstance(get_session_store("memory"), MemorySessionStore)
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "chatbot")
+    with pytest.raises(ValueError):
+        get_session_store("memory")
+    with pytest.raises(ValueError):
+        get_session_store("redis")
@@ -0,0 +1,121 @@
+import asyncio
+import io
+import json
+import os
+import threading
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+httpx = pytest.importorskip("httpx")
+
+import config_cache  # noqa: E402
+import main  # noqa: E402
+import streaming  # noqa: E402
+from extraction_cache import extraction_cache  # noqa: E402
+from fake_llm import FakeChatModel, install  # noqa: E402
+from llm_guard import llm_guard  # noqa: E402
+from session_sink import LocalSessionSink  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RepoS3:
+    """get_object stand-in serving the config JSONs checked into the repo"""
+
+    def get_object(self, Bucket, Key, **kwargs):
+        with open(os.path.join(ROOT, Key), "rb") as f:
+            data = f.read()
+        return {"Body": io.BytesIO(data), "ETag": f'"{len(data)}"'}
+
+
+@pytest.fixture(autouse=True)
+def local_turn(monkeypatch, tmp_path):
+    monkeypatch.setattr(config_cache.config_cache, "_client", RepoS3())
+    monkeypatch.setattr(main, "session_sink", LocalSessionSink(root=str(tmp_path), coalesce_ms=0))
+    extraction_cache.clear()
+    llm_guard.clear()
+    yield
+    extraction_cache.clear()
+
+
+def _post(body: dict):
+    async def post():
+        transport = httpx.ASGITransport(app=streaming.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/", json=body)
+
+    return asyncio.run(post())
+
+
+def _events(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def _turn_body():
+    return {"investor_type": "Individual", "user_message": "My name is John Smith", "session_fields": {}}
+
+
+def _name_answer(schema):
+    name = next(p for p in schema.mandatory_fields("Individual") if p in schema.fields_labelled("name"))
+    return name, json.dumps({"fields": [{"key": name, "value": "John Smith"}]})
+
+
+def test_events_stream_in_order_with_blocking_steps_off_the_loop(monkeypatch):
+    schema = main.load_compiled_schema()
+    name, answer = _name_answer(schema)
+    model = install(monkeypatch, FakeChatModel(answers=[answer, "Lovely to meet you, John! What's your email?"],
+                                               prompts=[]))
+    monkeypatch.setattr(streaming, "sample_llm_followup", lambda: True)
+    threads = {}
+
+    def on_thread(name, fn):
+        def run(*args):
+            threads[name] = threading.get_ident()
+            return fn(*args)
+        return run
+
+    monkeypatch.setattr(streaming, "prepare_turn", on_thread("prepare", streaming.prepare_turn))
+    monkeypatch.setattr(streaming, "finish_turn", on_thread("finish", streaming.finish_turn))
+
+    response = _post(_turn_body())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = _events(response)
+    assert [e["event"] for e in events] == ["extraction", "followup", "done"]
+    assert events[0]["method"] == "llm"
+    assert events[0]["extracted_fields"] == {name: "John Smith"}
+    assert events[1]["delta"] == "Lovely to meet you, John! What's your email?"
+    assert events[2]["followup_question"] == events[1]["delta"]
+    assert events[2]["session_patch"] == {name: "John Smith"}
+    assert "extracted_fields" not in events[2]
+    assert model.calls == 2
+    # prepare_turn / finish_turn block (config, store, sink): they must not run on the event loop
+    assert set(threads) == {"prepare", "finish"}
+    assert threading.get_ident() not in threads.values()
+
+
+def test_failure_after_the_stream_started_ends_with_an_error_event(monkeypatch):
+    schema = main.load_compiled_schema()
+    install(monkeypatch, FakeChatModel(answers=[_name_answer(schema)[1]], prompts=[]))
+    monkeypatch.setattr(streaming, "sample_llm_followup", lambda: False)
+
+    def conflict(*args):
+        raise main.TurnRequestError({"error": "Session was updated by another request"}, status=409)
+
+    monkeypatch.setattr(streaming, "finish_turn", conflict)
+
+    events = _events(_post(_turn_body()))
+
+    assert [e["event"] for e in events] == ["extraction", "followup", "error"]
+    assert events[-1]["status"] == 409
+
+
+def test_invalid_request_is_a_plain_json_error():
+    response = _post({"investor_type": "Nope", "user_message": "hi there"})
+
+    assert response.status_code == 400
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["error"] == "Invalid investor type: Nope"
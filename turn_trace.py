@@ -0,0 +1,133 @@
+"""
+Per-turn latency and token tracing.
+
+A TurnTrace is made current for one turn (lambda_handler, the streaming app or a
+CLI turn); code along the way times itself with `with trace_stage("llm_extract"):`
+and reports LLM token usage with trace_usage(stage, result). Both are no-ops when
+no trace is current, so library code can call them unconditionally.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ------------------- Config -------------------
+# "json" (one structured log line per turn), "emf" (CloudWatch Embedded Metric Format) or "off"
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "json")
+TRACE_NAMESPACE = os.getenv("TRACE_NAMESPACE", "SmartFormChatbot")
+# Add the trace to every response body (requests can also send "debug": true)
+TRACE_DEBUG = os.getenv("TRACE_DEBUG", "").lower() in ("1", "true", "yes")
+
+current_trace = ContextVar("current_trace", default=None)
+
+
+def _usage(result):
+    """(prompt, completion) tokens from a LangChain chat result, or None"""
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (getattr(result, "response_metadata", None) or {}).get("token_usage")
+    if token_usage:
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+    return None
+
+
+class TurnTrace:
+    def __init__(self, name: str = "turn"):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.tokens = {}
+        self.attributes = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def usage(self, stage: str, result):
+        counts = _usage(result)
+        if counts:
+            entry = self.tokens.setdefault(stage, {"prompt": 0, "completion": 0})
+            entry["prompt"] += counts[0]
+            entry["completion"] += counts[1]
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            **self.attributes,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "stages_ms": {name: round(ms, 2) for name, ms in self.stages.items()},
+            "tokens": self.tokens,
+        }
+
+    def to_emf(self):
+        data = self.to_dict()
+        metrics = {"total_ms": data["total_ms"]}
+        metrics.update({f"{name}_ms": ms for name, ms in data["stages_ms"].items()})
+        units = {name: "Milliseconds" for name in metrics}
+        for stage, counts in self.tokens.items():
+            for kind, count in counts.items():
+                metrics[f"{stage}_{kind}_tokens"] = count
+                units[f"{stage}_{kind}_tokens"] = "Count"
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": TRACE_NAMESPACE,
+                    "Dimensions": [["trace", "method"]],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit in units.items()],
+                }],
+            },
+            "trace": self.name,
+            "method": str(self.attributes.get("method", "none")),
+            **{k: v for k, v in self.attributes.items() if k != "method"},
+            **metrics,
+        }
+
+    def emit(self, fmt: str = None):
+        """Print the trace as one log line (CloudWatch picks up stdout)"""
+        fmt = fmt or TRACE_FORMAT
+        if fmt == "emf":
+            print(json.dumps(self.to_emf(), ensure_ascii=False))
+        elif fmt == "json":
+            print(json.dumps({"trace": self.name, **self.to_dict()}, ensure_ascii=False))
+
+
+@contextmanager
+def start_trace(name: str = "turn"):
+    """Make a new TurnTrace current for the duration of the block"""
+    trace = TurnTrace(name)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+
+@contextmanager
+def trace_stage(name: str):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def trace_usage(stage: str, result):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.usage(stage, result)
+
+
+def trace_set(**attributes):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.set(**attributes)